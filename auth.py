@@ -1,22 +1,74 @@
 """
 Módulo de gestión de autenticación de usuarios.
-Maneja el hash de contraseñas y validación de credenciales.
+Maneja el hash de contraseñas, la validación de credenciales y los tokens
+de sesión firmados que evitan repetir bcrypt al volver a abrir la aplicación.
 """
+import base64
+import hashlib
+import hmac
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Optional
+
 import bcrypt
+from dotenv import load_dotenv
+
+
+load_dotenv()
+
+# Coste de bcrypt (log2 de las iteraciones) para los hashes nuevos; los
+# hashes con otro coste se regeneran en el siguiente inicio de sesión
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+
+# Hilos dedicados a bcrypt (libera el GIL, así que escalan con los núcleos)
+AUTH_WORKERS = min(4, os.cpu_count() or 1)
+
+# Validez de un token de sesión (segundos). Solo se guarda uno si el
+# usuario marca "Recordarme" y cerrar sesión revoca los anteriores
+SESSION_TTL = 7 * 24 * 3600
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def get_auth_executor() -> ThreadPoolExecutor:
+    """Obtiene el pool de hilos de autenticación del proceso, creándolo la primera vez."""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=AUTH_WORKERS, thread_name_prefix="auth")
+        return _executor
+
+
+def run_in_background(func: Callable, *args) -> Future:
+    """
+    Ejecuta una operación con bcrypt en el pool de autenticación.
+    
+    Args:
+        func: Función a ejecutar (por ejemplo, Database.validate_user)
+        *args: Argumentos de la función
+    
+    Returns:
+        Future con el resultado
+    """
+    return get_auth_executor().submit(func, *args)
 
 
-def hash_password(password: str) -> str:
+def hash_password(password: str, rounds: Optional[int] = None) -> str:
     """
     Genera un hash seguro de la contraseña usando bcrypt.
     
     Args:
         password: Contraseña en texto plano
-        
+        rounds: Coste de bcrypt (por defecto BCRYPT_ROUNDS)
+    
     Returns:
         Hash de la contraseña como string
     """
     password_bytes = password.encode('utf-8')
-    salt = bcrypt.gensalt()
+    salt = bcrypt.gensalt(rounds or BCRYPT_ROUNDS)
     hashed = bcrypt.hashpw(password_bytes, salt)
     return hashed.decode('utf-8')
 
@@ -28,10 +80,89 @@ def verify_password(password: str, hashed_password: str) -> bool:
     Args:
         password: Contraseña en texto plano a verificar
         hashed_password: Hash almacenado de la contraseña
-        
+    
     Returns:
         True si la contraseña es correcta, False en caso contrario
     """
     password_bytes = password.encode('utf-8')
     hashed_bytes = hashed_password.encode('utf-8')
     return bcrypt.checkpw(password_bytes, hashed_bytes)
+
+
+def password_needs_rehash(hashed_password: str, rounds: Optional[int] = None) -> bool:
+    """
+    Indica si un hash se generó con un coste distinto del configurado.
+    
+    Args:
+        hashed_password: Hash almacenado ("$2b$<coste>$...")
+        rounds: Coste esperado (por defecto BCRYPT_ROUNDS)
+    
+    Returns:
+        True si conviene regenerar el hash
+    """
+    try:
+        cost = int(hashed_password.split('$')[2])
+    except (IndexError, ValueError):
+        return True
+    return cost != (rounds or BCRYPT_ROUNDS)
+
+
+def _b64encode(data: bytes) -> str:
+    """Base64 para URLs sin relleno."""
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode('ascii')
+
+
+def _sign(payload: str, secret: bytes) -> str:
+    """Firma HMAC-SHA256 de un texto."""
+    return _b64encode(hmac.new(secret, payload.encode('utf-8'), hashlib.sha256).digest())
+
+
+def create_session_token(user_id: int, secret: bytes, version: int = 0, ttl: int = SESSION_TTL) -> str:
+    """
+    Genera un token de sesión firmado.
+    
+    Args:
+        user_id: ID del usuario
+        secret: Clave de firma
+        version: Versión de sesión vigente del usuario (ver verify_session_token)
+        ttl: Segundos de validez
+    
+    Returns:
+        Token "<user_id>.<versión>.<caducidad>.<firma>"
+    """
+    payload = f"{user_id}.{version}.{int(time.time()) + ttl}"
+    return f"{payload}.{_sign(payload, secret)}"
+
+
+def verify_session_token(
+    token: str,
+    secret: bytes,
+    current_version: Callable[[int], Optional[int]]
+) -> Optional[int]:
+    """
+    Comprueba la firma, la caducidad y la versión de un token de sesión.
+    
+    Args:
+        token: Token generado con create_session_token
+        secret: Clave de firma
+        current_version: Función que devuelve la versión de sesión vigente
+            de un usuario (None si ya no existe); al incrementarla quedan
+            revocados todos sus tokens anteriores
+    
+    Returns:
+        ID del usuario, o None si el token no es válido, ha caducado o
+        está revocado
+    """
+    try:
+        payload, signature = token.rsplit('.', 1)
+        user_id, version, expires_at = (int(part) for part in payload.split('.'))
+    except (AttributeError, ValueError):
+        return None
+    
+    if not hmac.compare_digest(signature.encode('utf-8'), _sign(payload, secret).encode('ascii')):
+        return None
+    if expires_at < time.time():
+        return None
+    if current_version(user_id) != version:
+        return None
+    return user_id
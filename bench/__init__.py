@@ -0,0 +1,4 @@
+"""
+Benchmarks de rendimiento del chatbot.
+Cada módulo se ejecuta con: python -m bench.<nombre>
+"""
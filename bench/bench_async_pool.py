@@ -0,0 +1,94 @@
+"""
+Benchmark de sesiones de chat concurrentes contra un servidor Groq simulado.
+Compara un GroqClient síncrono con su propio cliente HTTP por sesión (un hilo
+cada una) con AsyncGroqClient sobre el pool HTTP compartido del proceso.
+
+Uso: python -m bench.bench_async_pool [--sessions 50] [--turns 5] [--concurrency 32]
+"""
+import argparse
+import asyncio
+import statistics
+import threading
+import time
+
+from groq import Groq
+
+from bench.mock_groq import MockGroqConfig, start_mock_server
+from groq_client import AsyncGroqClient, GroqClient, configure_http_pool
+from request_scheduler import RequestScheduler
+
+
+def unlimited_scheduler() -> RequestScheduler:
+    """Planificador sin límites efectivos, para medir solo el transporte."""
+    return RequestScheduler(requests_per_minute=10 ** 9, tokens_per_minute=10 ** 12)
+
+
+def run_threads(url: str, sessions: int, turns: int):
+    """Una sesión por hilo, cada una con su cliente y sus sockets. Devuelve las latencias en ms."""
+    latencies = []
+    lock = threading.Lock()
+
+    def session(number: int):
+        client = GroqClient(api_key="mock", base_url=url, scheduler=unlimited_scheduler())
+        client.client = Groq(api_key="mock", base_url=url, max_retries=0)
+        for turn in range(turns):
+            start = time.perf_counter()
+            "".join(client.chat_stream([{"role": "user", "content": f"Sesión {number}, turno {turn}"}]))
+            with lock:
+                latencies.append((time.perf_counter() - start) * 1000)
+        client.client.close()
+
+    threads = [threading.Thread(target=session, args=(i,)) for i in range(sessions)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies
+
+
+async def run_async(url: str, sessions: int, turns: int):
+    """Todas las sesiones en un bucle de eventos sobre el pool compartido. Devuelve las latencias en ms."""
+    latencies = []
+
+    async def session(number: int):
+        client = AsyncGroqClient(api_key="mock", base_url=url, scheduler=unlimited_scheduler())
+        for turn in range(turns):
+            start = time.perf_counter()
+            async for _ in client.chat_stream([{"role": "user", "content": f"Sesión {number}, turno {turn}"}]):
+                pass
+            latencies.append((time.perf_counter() - start) * 1000)
+
+    await asyncio.gather(*(session(i) for i in range(sessions)))
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sessions", type=int, default=50, help="Sesiones simultáneas")
+    parser.add_argument("--turns", type=int, default=5, help="Turnos por sesión")
+    parser.add_argument("--concurrency", type=int, default=32, help="Peticiones simultáneas del pool asíncrono")
+    parser.add_argument("--latency", type=float, default=0.05, help="Segundos hasta el primer token")
+    parser.add_argument("--tokens-per-second", type=float, default=2000)
+    args = parser.parse_args()
+
+    configure_http_pool(max_concurrent_requests=args.concurrency)
+    config = MockGroqConfig(latency=args.latency, tokens_per_second=args.tokens_per_second)
+    server, url = start_mock_server(config)
+    total = args.sessions * args.turns
+
+    for name, runner in (
+        ("cliente por sesión", lambda: run_threads(url, args.sessions, args.turns)),
+        ("pool compartido", lambda: asyncio.run(run_async(url, args.sessions, args.turns))),
+    ):
+        start = time.perf_counter()
+        latencies = runner()
+        elapsed = time.perf_counter() - start
+        p95 = statistics.quantiles(latencies, n=20)[-1]
+        print(f"{name:>18}: {total / elapsed:7.1f} turnos/s, "
+              f"p50 {statistics.median(latencies):.0f} ms, p95 {p95:.0f} ms")
+
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""
+Benchmark de inicio de sesión.
+Mide inicios de sesión por segundo con contraseña (bcrypt) para varios
+costes, en serie y a través del pool de autenticación, frente a reanudar
+la sesión con un token firmado.
+
+Uso: python -m bench.bench_auth [--rounds 10,12] [--logins 20]
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import auth
+from database import Database
+
+
+def logins_per_second(func, count: int) -> float:
+    """Ejecuta func count veces en serie y devuelve las ejecuciones por segundo."""
+    start = time.perf_counter()
+    for _ in range(count):
+        func()
+    return count / (time.perf_counter() - start)
+
+
+def pooled_logins_per_second(func, count: int) -> float:
+    """Lanza count ejecuciones de func en el pool de autenticación y devuelve las ejecuciones por segundo."""
+    start = time.perf_counter()
+    futures = [auth.run_in_background(func) for _ in range(count)]
+    for future in futures:
+        future.result()
+    return count / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rounds", default="10,12", help="Costes de bcrypt a comparar")
+    parser.add_argument("--logins", type=int, default=20, help="Inicios de sesión por medida")
+    args = parser.parse_args()
+
+    print(f"Pool de autenticación: {auth.AUTH_WORKERS} hilos, {os.cpu_count()} núcleos")
+    print(f"{'método':>28} {'logins/s':>10} {'ms/login':>10}")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db = Database(os.path.join(tmp, "bench.db"))
+
+        for rounds in (int(value) for value in args.rounds.split(",")):
+            auth.BCRYPT_ROUNDS = rounds
+            username = f"usuario{rounds}"
+            db.create_user(username, "contraseña")
+
+            def login():
+                valid, _ = db.validate_user(username, "contraseña")
+                assert valid
+
+            for name, measure in (("serie", logins_per_second), ("pool", pooled_logins_per_second)):
+                rate = measure(login, args.logins)
+                print(f"{f'contraseña coste {rounds} ({name})':>28} {rate:10.1f} {1000 / rate:10.1f}")
+
+        # Primer inicio de sesión tras subir el coste: verifica y regenera el hash
+        auth.BCRYPT_ROUNDS += 1
+        start = time.perf_counter()
+        db.validate_user(username, "contraseña")
+        rehash_ms = (time.perf_counter() - start) * 1000
+        print(f"{f'con rehash a coste {auth.BCRYPT_ROUNDS}':>28} {1000 / rehash_ms:10.1f} {rehash_ms:10.1f}")
+
+        _, user_id = db.validate_user(username, "contraseña")
+        token = db.create_session(user_id)
+        rate = logins_per_second(lambda: db.validate_session(token), args.logins * 100)
+        print(f"{'token de sesión':>28} {rate:10.1f} {1000 / rate:10.3f}")
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""
+Benchmark de apertura de la pantalla de chat para una cuenta con historial largo.
+Compara cargar y dibujar todo el historial (comportamiento anterior) con
+cargar el historial reciente y dibujar solo la última página.
+
+Uso: python -m bench.bench_chat_open [--messages 10000]
+"""
+import argparse
+import os
+import statistics
+import tempfile
+import time
+import tracemalloc
+
+from conversation import ConversationBuffer
+from database import Database
+from chat_engine import HISTORY_SEED_LIMIT
+from main import HISTORY_PAGE_SIZE, create_message_bubble
+from bench.bench_history import fill_messages
+
+
+def open_full(db: Database, user_id: int) -> list:
+    """Carga todo el historial y crea una burbuja por mensaje."""
+    messages = db.get_user_messages(user_id)
+    return [create_message_bubble(msg["role"], msg["content"])[0] for msg in messages]
+
+
+def open_paged(db: Database, user_id: int) -> list:
+    """Carga el historial reciente y crea solo las burbujas de la última página."""
+    conversation = ConversationBuffer(db.get_user_messages(user_id, limit=HISTORY_SEED_LIMIT))
+    messages = conversation.messages()
+    return [
+        create_message_bubble(msg["role"], msg["content"])[0]
+        for msg in messages[-HISTORY_PAGE_SIZE:]
+    ]
+
+
+def measure(func, db: Database, user_id: int, repeat: int):
+    """Devuelve (mediana en ms, pico de memoria en MB) de abrir la pantalla."""
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(db, user_id)
+        samples.append((time.perf_counter() - start) * 1000)
+
+    tracemalloc.start()
+    func(db, user_id)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return statistics.median(samples), peak / (1024 * 1024)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--messages", type=int, default=10000, help="Mensajes de la cuenta")
+    parser.add_argument("--repeat", type=int, default=5, help="Repeticiones por medida")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db = Database(os.path.join(tmp, "bench.db"))
+        fill_messages(db, 1, args.messages)
+
+        full_ms, full_mb = measure(open_full, db, 1, args.repeat)
+        paged_ms, paged_mb = measure(open_paged, db, 1, args.repeat)
+
+        # Coste de cargar una página antigua al hacer scroll hacia arriba
+        middle_id = args.messages // 2
+        start = time.perf_counter()
+        db.get_messages_page(1, before_id=middle_id, limit=HISTORY_PAGE_SIZE)
+        page_ms = (time.perf_counter() - start) * 1000
+        db.close()
+
+    print(f"Historial de {args.messages} mensajes")
+    print(f"Todo el historial:  {full_ms:9.1f} ms  {full_mb:8.1f} MB")
+    print(f"Última página:      {paged_ms:9.1f} ms  {paged_mb:8.1f} MB")
+    print(f"Página anterior:    {page_ms:9.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""
+Benchmark de la capa de conexiones de Database.
+Compara operaciones/segundo abriendo una conexión por llamada (comportamiento
+anterior) frente a las conexiones persistentes por hilo.
+
+Uso: python -m bench.bench_connections [--turns N] [--threads N]
+"""
+import argparse
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+from database import Database
+
+
+class UnpooledDatabase(Database):
+    """Database que abre y descarta una conexión en cada llamada."""
+
+    def get_connection(self) -> sqlite3.Connection:
+        """Obtiene una nueva conexión a la base de datos."""
+        return self._connect()
+
+
+def run_turns(db: Database, user_id: int, turns: int):
+    """Simula los accesos a BD de un turno de chat."""
+    for i in range(turns):
+        db.save_message(user_id, "user", f"Pregunta número {i}")
+        db.get_user_messages(user_id, limit=20)
+        db.save_message(user_id, "assistant", f"Respuesta número {i}")
+        db.get_user_avatar(user_id)
+
+
+def measure(db_class, turns: int, threads: int) -> float:
+    """
+    Mide las operaciones por segundo de una implementación.
+
+    Args:
+        db_class: Clase de base de datos a medir
+        turns: Turnos de chat por hilo
+        threads: Número de hilos concurrentes
+
+    Returns:
+        Operaciones por segundo
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        db = db_class(os.path.join(tmp, "bench.db"))
+        user_ids = []
+        for t in range(threads):
+            db.create_user(f"bench{t}", "password")
+            _, user_id = db.validate_user(f"bench{t}", "password")
+            db.initialize_user_profile(user_id)
+            user_ids.append(user_id)
+
+        workers = [
+            threading.Thread(target=run_turns, args=(db, user_id, turns))
+            for user_id in user_ids
+        ]
+        start = time.perf_counter()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        elapsed = time.perf_counter() - start
+        db.close()
+
+    # Cinco operaciones de BD por turno
+    return turns * threads * 5 / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--turns", type=int, default=500, help="Turnos por hilo")
+    parser.add_argument("--threads", type=int, default=1, help="Hilos concurrentes")
+    args = parser.parse_args()
+
+    before = measure(UnpooledDatabase, args.turns, args.threads)
+    after = measure(Database, args.turns, args.threads)
+
+    print(f"Conexión por llamada:  {before:10.0f} ops/s")
+    print(f"Conexiones por hilo:   {after:10.0f} ops/s")
+    print(f"Mejora:                {after / before:10.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+Benchmark del tamaño y coste de construir el contexto enviado a Groq.
+Compara enviar el historial completo (comportamiento anterior) con el
+contexto limitado por presupuesto de tokens.
+
+Uso: python -m bench.bench_context [--lengths 10,100,1000,10000,100000]
+"""
+import argparse
+import json
+import random
+import statistics
+import time
+
+from conversation import ConversationBuffer
+from groq_client import GroqClient, DEFAULT_SYSTEM_PROMPT
+
+
+def make_history(length: int, seed: int = 0) -> ConversationBuffer:
+    """Genera una conversación sintética con mensajes de longitud variable."""
+    rng = random.Random(seed)
+    buffer = ConversationBuffer()
+    for i in range(length):
+        role = "user" if i % 2 == 0 else "assistant"
+        size = rng.randint(20, 200) if role == "user" else rng.randint(100, 1500)
+        buffer.append(role, "palabra " * (size // 8))
+    return buffer
+
+
+def payload_bytes(messages) -> int:
+    """Tamaño en bytes del cuerpo JSON de la petición."""
+    body = [{"role": "system", "content": DEFAULT_SYSTEM_PROMPT}] + messages
+    return len(json.dumps({"messages": body}).encode("utf-8"))
+
+
+def median_ms(func, repeat: int) -> float:
+    """Mediana en milisegundos de ejecutar func."""
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--lengths", default="10,100,1000,10000,100000",
+                        help="Longitudes de historial a medir, separadas por comas")
+    parser.add_argument("--budget", type=int, default=None,
+                        help="Presupuesto de tokens (por defecto el de GroqClient)")
+    parser.add_argument("--repeat", type=int, default=20, help="Repeticiones por medida")
+    args = parser.parse_args()
+
+    client = GroqClient(api_key="bench")
+    if args.budget:
+        client.set_context_token_budget(args.budget)
+    question = "¿Puedes resumir lo que hemos hablado?"
+
+    print(f"{'mensajes':>9} {'completo (KB)':>14} {'limitado (KB)':>14} "
+          f"{'completo (ms)':>14} {'limitado (ms)':>14}")
+    for length in [int(value) for value in args.lengths.split(",")]:
+        history = make_history(length)
+
+        def full_context():
+            messages = history.messages().copy()
+            messages.append({"role": "user", "content": question})
+            return messages
+
+        def budget_context():
+            return client.build_context(question, history)
+
+        full_kb = payload_bytes(full_context()) / 1024
+        budget_kb = payload_bytes(budget_context()) / 1024
+        full_ms = median_ms(full_context, args.repeat)
+        budget_ms = median_ms(budget_context, args.repeat)
+        print(f"{length:>9} {full_kb:>14.1f} {budget_kb:>14.1f} "
+              f"{full_ms:>14.3f} {budget_ms:>14.3f}")
+
+
+if __name__ == "__main__":
+    main()
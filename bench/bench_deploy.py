@@ -0,0 +1,152 @@
+"""
+Prueba de carga del despliegue con varios procesos.
+Reparte un número fijo de usuarios simultáneos (un hilo cada uno, con
+ChatSession.run_turn como la aplicación) entre 1..N procesos y mide los
+turnos por segundo y la latencia de cada turno contra el servidor Groq
+simulado. Compara cada proceso escribiendo en SQLite con su propia cola
+(modo "directo") con todos enviando los mensajes al proceso escritor
+único de db_writer.py (modo "escritor", el de deploy.py).
+
+Uso: python -m bench.bench_deploy [--users 32] [--turns 10] [--max-workers 4]
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import secrets
+import tempfile
+import threading
+import time
+
+from chat_engine import ChatEngine
+from database import Database
+from db_writer import WriterService
+from groq_client import GroqClient
+from retrieval import MessageRetriever
+from bench.bench_async_pool import unlimited_scheduler
+from bench.bench_search import make_vocabulary
+from bench.mock_groq import MockGroqConfig, start_mock_server
+from bench.suite import generate_database, load_history, percentile, random_text, run_turn
+
+
+def writer_main(db_path: str, address: str, authkey: bytes, ready):
+    """Proceso escritor del modo "escritor"."""
+    service = WriterService(db_path, address, authkey)
+    ready.set()
+    service.serve_forever()
+
+
+def worker_main(db_path: str, url: str, user_ids: list, turns: int, seed: int, writer, results):
+    """
+    Proceso de la aplicación: un hilo por usuario, cada uno con su ChatSession.
+
+    Args:
+        writer: Tupla (dirección, clave) del proceso escritor, o None para escribir directamente
+        results: Cola donde se deja la lista de ms de cada turno
+    """
+    address, authkey = writer or (None, None)
+    db = Database(db_path, write_behind=True, writer_address=address, writer_authkey=authkey)
+    client = GroqClient(api_key="mock", base_url=url, scheduler=unlimited_scheduler())
+    engine = ChatEngine(db, client, MessageRetriever(db))
+    vocabulary = make_vocabulary(5000, seed)
+    weights = [1 / (rank + 1) for rank in range(len(vocabulary))]
+    turn_ms = []
+    lock = threading.Lock()
+
+    def session(user_id: int):
+        rng = random.Random(seed * 1000 + user_id)
+        chat = load_history(engine, user_id)
+        for _ in range(turns):
+            start = time.perf_counter()
+            run_turn(chat, random_text(rng, vocabulary, weights, "user"))
+            with lock:
+                turn_ms.append((time.perf_counter() - start) * 1000)
+
+    threads = [threading.Thread(target=session, args=(user_id,)) for user_id in user_ids]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    db.close()
+    results.put(turn_ms)
+
+
+def run(mode: str, workers: int, db_path: str, url: str, user_ids: list, turns: int, seed: int) -> dict:
+    """Reparte los usuarios entre los procesos y mide el conjunto."""
+    writer_process, writer = None, None
+    if mode == "escritor":
+        address = os.path.join(tempfile.gettempdir(), f"bench-writer-{os.getpid()}.sock")
+        authkey = secrets.token_bytes(32)
+        ready = multiprocessing.Event()
+        writer_process = multiprocessing.Process(target=writer_main, args=(db_path, address, authkey, ready))
+        writer_process.start()
+        ready.wait()
+        writer = (address, authkey)
+
+    results = multiprocessing.Queue()
+    processes = [
+        multiprocessing.Process(
+            target=worker_main,
+            args=(db_path, url, user_ids[i::workers], turns, seed, writer, results)
+        )
+        for i in range(workers)
+    ]
+    start = time.perf_counter()
+    for process in processes:
+        process.start()
+    turn_ms = [ms for _ in processes for ms in results.get()]
+    elapsed = time.perf_counter() - start
+    for process in processes:
+        process.join()
+
+    if writer_process is not None:
+        writer_process.terminate()
+        writer_process.join()
+        if os.path.exists(writer[0]):
+            os.unlink(writer[0])
+
+    return {
+        "turns_s": len(turn_ms) / elapsed,
+        "p50": percentile(turn_ms, 0.5),
+        "p99": percentile(turn_ms, 0.99),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--users", type=int, default=32, help="Usuarios simultáneos")
+    parser.add_argument("--turns", type=int, default=10, help="Turnos por usuario")
+    parser.add_argument("--messages", type=int, default=500, help="Mensajes previos por usuario")
+    parser.add_argument("--max-workers", type=int, default=os.cpu_count() or 1, help="Procesos máximos")
+    parser.add_argument("--latency", type=float, default=0.05, help="Segundos del servidor simulado hasta el primer token")
+    parser.add_argument("--tokens-per-second", type=float, default=1000, help="Velocidad de generación simulada")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    server, url = start_mock_server(MockGroqConfig(latency=args.latency, tokens_per_second=args.tokens_per_second))
+    worker_counts = sorted({1, *range(2, args.max_workers + 1, 2), args.max_workers})
+    print(f"{args.users} usuarios x {args.turns} turnos, {os.cpu_count()} núcleos")
+    print(f"{'modo':>9} {'procesos':>9} {'turnos/s':>9} {'p50 ms':>8} {'p99 ms':>8}")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        template = os.path.join(tmp, "plantilla.db")
+        db = Database(template)
+        user_ids = generate_database(db, args.users, args.messages, args.seed)
+        MessageRetriever(db).index_pending()
+        db.get_connection().execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        db.close()
+
+        for mode in ("directo", "escritor"):
+            for workers in worker_counts:
+                # Cada medida parte de la misma base de datos
+                db_path = os.path.join(tmp, f"{mode}-{workers}.db")
+                with open(template, "rb") as src, open(db_path, "wb") as dst:
+                    dst.write(src.read())
+                result = run(mode, workers, db_path, url, user_ids, args.turns, args.seed)
+                print(f"{mode:>9} {workers:>9} {result['turns_s']:9.1f} {result['p50']:8.1f} {result['p99']:8.1f}")
+
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""
+Benchmark de carga de historial a medida que crece la tabla messages.
+Mide get_user_messages para un usuario con historial fijo mientras otros
+usuarios llenan la tabla, con y sin el índice (user_id, id).
+
+Uso: python -m bench.bench_history [--sizes 10000,100000,1000000]
+"""
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import time
+
+from database import Database
+
+
+def fill_messages(db: Database, users: int, count: int, seed: int = 0):
+    """
+    Inserta mensajes sintéticos repartidos entre varios usuarios.
+
+    Args:
+        db: Base de datos destino
+        users: Número de usuarios entre los que repartir los mensajes
+        count: Número de mensajes a insertar
+        seed: Semilla para la generación aleatoria
+    """
+    rng = random.Random(seed)
+    batch = []
+    for i in range(count):
+        user_id = rng.randint(1, users)
+        role = "user" if i % 2 == 0 else "assistant"
+        content = "x" * rng.randint(20, 400)
+        batch.append((user_id, role, content))
+        if len(batch) == 10000:
+            with db.transaction() as cursor:
+                cursor.executemany(
+                    'INSERT INTO messages (user_id, role, content) VALUES (?, ?, ?)',
+                    batch
+                )
+            batch = []
+    if batch:
+        with db.transaction() as cursor:
+            cursor.executemany(
+                'INSERT INTO messages (user_id, role, content) VALUES (?, ?, ?)',
+                batch
+            )
+
+
+def time_loads(db: Database, user_id: int, limit, repeat: int) -> float:
+    """Devuelve la mediana en milisegundos de cargar el historial."""
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        db.get_user_messages(user_id, limit=limit)
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", default="10000,100000,1000000",
+                        help="Tamaños de la tabla a medir, separados por comas")
+    parser.add_argument("--users", type=int, default=1000, help="Usuarios sintéticos")
+    parser.add_argument("--repeat", type=int, default=20, help="Repeticiones por medida")
+    args = parser.parse_args()
+    sizes = [int(size) for size in args.sizes.split(",")]
+
+    print(f"{'filas':>10} {'índice':>7} {'últimos 50 (ms)':>16} {'completo (ms)':>14}")
+    with tempfile.TemporaryDirectory() as tmp:
+        db = Database(os.path.join(tmp, "bench.db"))
+        # El usuario medido tiene siempre 200 mensajes
+        target_user = args.users + 1
+        fill_messages(db, 1, 200, seed=1)
+        with db.transaction() as cursor:
+            cursor.execute('UPDATE messages SET user_id = ?', (target_user,))
+
+        current = 200
+        for size in sizes:
+            fill_messages(db, args.users, size - current, seed=size)
+            current = size
+
+            for indexed in (True, False):
+                if not indexed:
+                    with db.transaction() as cursor:
+                        cursor.execute('DROP INDEX idx_messages_user_id')
+                recent = time_loads(db, target_user, 50, args.repeat)
+                full = time_loads(db, target_user, None, args.repeat)
+                print(f"{size:>10} {'sí' if indexed else 'no':>7} {recent:>16.2f} {full:>14.2f}")
+
+            with db.transaction() as cursor:
+                cursor.execute(
+                    'CREATE INDEX idx_messages_user_id ON messages (user_id, id)'
+                )
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
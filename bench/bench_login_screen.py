@@ -0,0 +1,92 @@
+"""
+Benchmark del tiempo hasta dibujar la pantalla de selección de usuario.
+Compara cargar todos los usuarios y consultar el avatar de cada uno por
+separado (comportamiento anterior) con cargar la primera página con los
+avatares en una sola consulta, con el buscador por prefijo y la paginación.
+
+Uso: python -m bench.bench_login_screen [--users 200,5000]
+"""
+import argparse
+import os
+import statistics
+import tempfile
+import time
+
+from database import Database
+from main import USER_PAGE_SIZE, create_user_card
+
+
+def fill_users(db: Database, start: int, count: int):
+    """Inserta usuarios con perfil (sin bcrypt, que no se mide aquí)."""
+    with db.transaction() as cursor:
+        cursor.executemany(
+            "INSERT INTO users (username, password_hash) VALUES (?, 'x')",
+            [(f"usuario{i:06d}",) for i in range(start, start + count)]
+        )
+        cursor.execute(
+            'INSERT OR IGNORE INTO user_profiles (user_id, avatar_id) SELECT id, id % 10 + 1 FROM users'
+        )
+
+
+def first_paint_full(db_path: str) -> int:
+    """Abre la BD, carga todos los usuarios con un avatar por consulta y crea todas las tarjetas."""
+    db = Database(db_path)
+    users = db.get_all_users()
+    cards = [
+        create_user_card(dict(user, avatar_id=db.get_user_avatar(user['id'])), print)
+        for user in users
+    ]
+    db.close()
+    return len(cards)
+
+
+def first_paint_paged(db_path: str) -> int:
+    """Abre la BD, carga la primera página con los avatares y crea sus tarjetas."""
+    db = Database(db_path)
+    users = db.get_users_page(limit=USER_PAGE_SIZE + 1)
+    cards = [create_user_card(user, print) for user in users[:USER_PAGE_SIZE]]
+    db.close()
+    return len(cards)
+
+
+def median_ms(func, repeat: int) -> float:
+    """Mediana en milisegundos de ejecutar func."""
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--users", default="200,5000", help="Número de usuarios registrados")
+    parser.add_argument("--repeat", type=int, default=5, help="Repeticiones por medida")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "bench.db")
+        db = Database(db_path)
+        filled = 0
+        print(f"{'usuarios':>9} {'todos ms':>10} {'1ª página ms':>13} {'buscar ms':>10} {'pág. 50 ms':>11}")
+        for size in (int(value) for value in args.users.split(",")):
+            fill_users(db, filled, size - filled)
+            filled = size
+
+            full_ms = median_ms(lambda: first_paint_full(db_path), args.repeat)
+            paged_ms = median_ms(lambda: first_paint_paged(db_path), args.repeat)
+            search_ms = median_ms(lambda: db.get_users_page("usuario0012", limit=USER_PAGE_SIZE + 1), args.repeat)
+
+            # Página lejana: la paginación por clave no recorre las anteriores
+            last = db.get_users_page(limit=USER_PAGE_SIZE * 50)[-1]
+            deep_ms = median_ms(
+                lambda: db.get_users_page(after=(last['username'], last['id']), limit=USER_PAGE_SIZE + 1),
+                args.repeat
+            )
+            print(f"{size:>9} {full_ms:10.1f} {paged_ms:13.1f} {search_ms:10.2f} {deep_ms:11.2f}")
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+"""
+Benchmark del borrado de una cuenta con un historial grande.
+Mide cuánto tardan en confirmarse los mensajes que otro usuario guarda
+mientras se borra la cuenta, comparando el borrado en una sola transacción
+(comportamiento anterior) con el borrado por lotes, y el espacio que
+devuelve después el vaciado incremental.
+
+Uso: python -m bench.bench_purge [--messages 100000] [--batch 500]
+"""
+import argparse
+import os
+import statistics
+import tempfile
+import threading
+import time
+from functools import partial
+
+import database
+from database import Database, DURABILITY_COMMITTED
+from purge import PurgeJob
+from retrieval import MessageRetriever
+from bench.bench_search import fill_text_messages, make_vocabulary
+
+
+def delete_user_single(db: Database, user_id: int, on_progress=None):
+    """Borrado anterior: todos los datos del usuario en una sola transacción."""
+    db.flush()
+    with db.transaction() as cursor:
+        cursor.execute('DELETE FROM messages WHERE user_id = ?', (user_id,))
+        cursor.execute('DELETE FROM conversations WHERE user_id = ?', (user_id,))
+        cursor.execute('DELETE FROM user_daily_stats WHERE user_id = ?', (user_id,))
+        cursor.execute('DELETE FROM users WHERE id = ?', (user_id,))
+    return True, "Usuario eliminado exitosamente"
+
+
+def writer_loop(db: Database, user_id: int, stop: threading.Event, latencies: list, failures: list):
+    """Guarda un mensaje confirmado cada 10 ms y anota cuánto tarda cada uno."""
+    while not stop.is_set():
+        start = time.perf_counter()
+        if db.save_message(user_id, "user", "hola, ¿sigues ahí?", durability=DURABILITY_COMMITTED):
+            latencies.append((time.perf_counter() - start) * 1000)
+        else:
+            failures.append(1)
+        time.sleep(0.01)
+
+
+def file_mb(path: str) -> float:
+    """Tamaño del archivo de la base de datos y su WAL, en MB."""
+    return sum(
+        os.path.getsize(name) for name in (path, path + "-wal") if os.path.exists(name)
+    ) / 1e6
+
+
+def run(mode: str, messages: int, vocabulary: list) -> dict:
+    """Llena una base de datos nueva, borra la cuenta grande con el modo indicado y mide al otro usuario."""
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "bench.db")
+        db = Database(db_path)
+        db.create_user("grande", "x")
+        db.create_user("activo", "x")
+        fill_text_messages(db, vocabulary, 1, 0, messages)
+        MessageRetriever(db).index_pending()
+        db.get_connection().execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        size_before = file_mb(db_path)
+
+        latencies, failures = [], []
+        stop = threading.Event()
+        writer = threading.Thread(target=writer_loop, args=(db, 2, stop, latencies, failures))
+        writer.start()
+        time.sleep(0.2)
+        idle_writes = len(latencies)
+
+        purge = partial(delete_user_single, db) if mode == "una transacción" else db.delete_user
+        start = time.perf_counter()
+        job = PurgeJob(db, purge, 1, vacuum=False).start()
+        job.wait()
+        purge_s = time.perf_counter() - start
+
+        stop.set()
+        writer.join()
+        during = latencies[idle_writes:]
+
+        start = time.perf_counter()
+        freed = db.incremental_vacuum()
+        vacuum_s = time.perf_counter() - start
+        db.get_connection().execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        size_after = file_mb(db_path)
+        db.close()
+
+    during.sort()
+    return {
+        "purge_s": purge_s,
+        "writes": len(during),
+        "failures": len(failures),
+        "p50": statistics.median(during) if during else 0.0,
+        "p99": during[int(len(during) * 0.99) - 1] if during else 0.0,
+        "max": during[-1] if during else 0.0,
+        "vacuum_s": vacuum_s,
+        "freed": freed,
+        "size_before": size_before,
+        "size_after": size_after,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--messages", type=int, default=100000, help="Mensajes de la cuenta que se borra")
+    parser.add_argument("--batch", type=int, default=database.PURGE_BATCH_SIZE, help="Mensajes por lote")
+    args = parser.parse_args()
+
+    database.PURGE_BATCH_SIZE = args.batch
+    vocabulary = make_vocabulary(5000)
+    print(f"Cuenta con {args.messages} mensajes; otro usuario guarda un mensaje cada 10 ms")
+    print(f"{'modo':>16} {'borrado s':>10} {'escrituras':>11} {'fallos':>7} "
+          f"{'p50 ms':>8} {'p99 ms':>8} {'máx ms':>8} {'vacuum s':>9} {'MB antes':>9} {'MB después':>11}")
+    for mode in ("una transacción", f"lotes de {args.batch}"):
+        result = run(mode, args.messages, vocabulary)
+        print(f"{mode:>16} {result['purge_s']:10.2f} {result['writes']:>11} {result['failures']:>7} "
+              f"{result['p50']:8.2f} {result['p99']:8.2f} {result['max']:8.1f} {result['vacuum_s']:9.2f} "
+              f"{result['size_before']:9.1f} {result['size_after']:11.1f}")
+
+
+if __name__ == "__main__":
+    main()
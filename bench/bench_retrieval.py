@@ -0,0 +1,59 @@
+"""
+Benchmark de la recuperación semántica de mensajes.
+Mide la velocidad de indexado (vectorizar y guardar) y la latencia de las
+consultas top-k, la primera (carga los vectores de la BD) y las siguientes
+(índice ya en memoria), a medida que crece el historial del usuario.
+
+Uso: python -m bench.bench_retrieval [--sizes 10000,100000] [--k 4]
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+
+from database import Database
+from retrieval import MessageRetriever
+from bench.bench_search import fill_text_messages, make_vocabulary, median_ms
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", default="10000,100000", help="Mensajes del historial del usuario")
+    parser.add_argument("--k", type=int, default=4, help="Mensajes recuperados por consulta")
+    parser.add_argument("--repeat", type=int, default=50, help="Repeticiones por medida")
+    args = parser.parse_args()
+
+    sizes = [int(size) for size in args.sizes.split(",")]
+    vocabulary = make_vocabulary(5000)
+    rng = random.Random(1)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db = Database(os.path.join(tmp, "bench.db"))
+        retriever = MessageRetriever(db)
+        filled = 0
+        print(f"{'mensajes':>10} {'indexado msg/s':>15} {'1ª consulta ms':>15} {'consulta ms':>12} {'resultados':>11}")
+        for size in sizes:
+            fill_text_messages(db, vocabulary, 1, filled, size - filled)
+            filled = size
+
+            start = time.perf_counter()
+            indexed = retriever.index_pending()
+            index_rate = indexed / (time.perf_counter() - start)
+
+            queries = [" ".join(rng.choices(vocabulary[:1000], k=8)) for _ in range(args.repeat)]
+
+            # Primera consulta tras arrancar: lee todos los vectores del usuario
+            retriever.forget(1)
+            start = time.perf_counter()
+            results = retriever.search(1, queries[0], k=args.k)
+            cold_ms = (time.perf_counter() - start) * 1000
+
+            pending = iter(queries * 2)
+            query_ms = median_ms(lambda: retriever.search(1, next(pending), k=args.k), args.repeat)
+            print(f"{size:>10} {index_rate:15.0f} {cold_ms:15.1f} {query_ms:12.2f} {len(results):>11}")
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+"""
+Benchmark del planificador de peticiones frente a un servidor Groq con fallos.
+Compara la tasa de éxito y la latencia sin reintentos y con el planificador.
+
+Uso: python -m bench.bench_scheduler [--requests 50] [--failure-rate 0.3]
+"""
+import argparse
+import statistics
+import time
+
+from bench.mock_groq import MockGroqConfig, start_mock_server
+from groq_client import GroqClient
+from request_scheduler import RequestScheduler
+
+
+def run(url: str, scheduler: RequestScheduler, requests: int):
+    """Devuelve (éxitos, errores por tipo, latencias en ms)."""
+    client = GroqClient(api_key="mock", base_url=url, scheduler=scheduler)
+    successes = 0
+    errors = {}
+    latencies = []
+    for i in range(requests):
+        start = time.perf_counter()
+        result = client.chat([{"role": "user", "content": f"Pregunta {i}"}])
+        latencies.append((time.perf_counter() - start) * 1000)
+        if result.ok:
+            successes += 1
+        else:
+            errors[result.error.kind] = errors.get(result.error.kind, 0) + 1
+    return successes, errors, latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--requests", type=int, default=50)
+    parser.add_argument("--failure-rate", type=float, default=0.3, help="Probabilidad de 503")
+    parser.add_argument("--rate-limit-every", type=int, default=7, help="Un 429 cada N peticiones")
+    args = parser.parse_args()
+
+    for name, scheduler in (
+        ("sin reintentos", RequestScheduler(requests_per_minute=6000, max_retries=0)),
+        ("planificador", RequestScheduler(requests_per_minute=6000, base_delay=0.05)),
+    ):
+        config = MockGroqConfig(
+            latency=0.01,
+            failure_rate=args.failure_rate,
+            rate_limit_every=args.rate_limit_every,
+            retry_after=0.2,
+            seed=1,
+        )
+        server, url = start_mock_server(config)
+        successes, errors, latencies = run(url, scheduler, args.requests)
+        server.shutdown()
+        print(f"{name:>15}: {successes}/{args.requests} correctas, errores {errors or '-'}, "
+              f"p50 {statistics.median(latencies):.0f} ms, máx {max(latencies):.0f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""
+Benchmark de la búsqueda de texto completo en el historial.
+Mide search_messages (índice FTS5) frente a cargar y filtrar todo el
+historial del usuario a medida que crece la tabla messages.
+
+Uso: python -m bench.bench_search [--sizes 100000,1000000] [--users 100]
+"""
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import time
+
+from database import Database
+
+
+def make_vocabulary(size: int, seed: int = 0) -> list:
+    """Genera palabras sintéticas con sílabas en español."""
+    rng = random.Random(seed)
+    syllables = ["ca", "de", "lo", "ma", "ri", "sa", "to", "ne", "pu", "ba", "le", "mi", "co", "ra", "tu"]
+    words = set()
+    while len(words) < size:
+        words.add("".join(rng.choice(syllables) for _ in range(rng.randint(2, 4))))
+    return sorted(words)
+
+
+def fill_text_messages(db: Database, vocabulary: list, users: int, start: int, count: int, seed: int = 0):
+    """Inserta mensajes con texto sintético (frecuencia de palabras tipo Zipf)."""
+    rng = random.Random(seed + start)
+    weights = [1 / (rank + 1) for rank in range(len(vocabulary))]
+    batch = []
+    for i in range(start, start + count):
+        words = rng.choices(vocabulary, weights, k=rng.randint(5, 60))
+        batch.append((rng.randint(1, users), "user" if i % 2 == 0 else "assistant", " ".join(words)))
+        if len(batch) == 10000:
+            with db.transaction() as cursor:
+                cursor.executemany(
+                    'INSERT INTO messages (user_id, role, content) VALUES (?, ?, ?)', batch
+                )
+            batch = []
+    if batch:
+        with db.transaction() as cursor:
+            cursor.executemany(
+                'INSERT INTO messages (user_id, role, content) VALUES (?, ?, ?)', batch
+            )
+
+
+def full_history_search(db: Database, user_id: int, query: str, limit: int) -> list:
+    """Búsqueda sin índice: carga todo el historial del usuario y lo filtra (única vía anterior)."""
+    words = query.lower().split()
+    messages = db.get_user_messages(user_id)
+    return [msg for msg in messages if all(word in msg["content"].lower() for word in words)][:limit]
+
+
+def median_ms(func, repeat: int) -> float:
+    """Mediana en milisegundos de ejecutar func."""
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", default="100000,1000000", help="Tamaños de la tabla messages")
+    parser.add_argument("--users", type=int, default=100, help="Usuarios entre los que repartir los mensajes")
+    parser.add_argument("--repeat", type=int, default=20, help="Repeticiones por medida")
+    args = parser.parse_args()
+
+    sizes = [int(size) for size in args.sizes.split(",")]
+    vocabulary = make_vocabulary(5000)
+    queries = {
+        "muy frecuente": vocabulary[0],
+        "frecuencia media": vocabulary[100],
+        "rara": vocabulary[-1],
+        "dos palabras": f"{vocabulary[10]} {vocabulary[500]}",
+    }
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db = Database(os.path.join(tmp, "bench.db"))
+        filled = 0
+        print(f"{'mensajes':>10} {'consulta':>16} {'FTS5 ms':>9} {'historial ms':>13} {'resultados':>11}")
+        for size in sizes:
+            fill_text_messages(db, vocabulary, args.users, filled, size - filled)
+            filled = size
+            db.get_connection().execute('ANALYZE')
+
+            for name, query in queries.items():
+                results = db.search_messages(1, query, limit=20)
+                fts_ms = median_ms(lambda: db.search_messages(1, query, limit=20), args.repeat)
+                full_ms = median_ms(lambda: full_history_search(db, 1, query, 20), args.repeat)
+                print(f"{size:>10} {name:>16} {fts_ms:9.2f} {full_ms:13.2f} {len(results):>11}")
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""
+Benchmark de escritura concurrente según el número de fragmentos.
+Varios escritores (un hilo por usuario) guardan mensajes a la vez en una
+base de datos de un solo archivo y en ShardedDatabase con 1..K fragmentos,
+con un COMMIT por llamada y con la cola de escritura diferida, y mide los
+mensajes por segundo y la latencia p50/p99 de cada save_message.
+
+Uso: python -m bench.bench_shards [--threads 16] [--messages 300] [--max-shards 8]
+                                  [--durability committed]
+"""
+import argparse
+import os
+import tempfile
+import threading
+import time
+
+from database import DURABILITY_COMMITTED, DURABILITY_SYNCED, Database
+from sharded_database import ShardedDatabase
+from bench.suite import percentile
+
+
+def write_turns(db: Database, user_id: int, messages: int, durability: str, latencies: list):
+    """Guarda mensajes como lo hace un turno de chat, anotando los ms de cada uno."""
+    conversation_id = db.create_conversation(user_id)
+    for i in range(messages):
+        role = "user" if i % 2 == 0 else "assistant"
+        start = time.perf_counter()
+        db.save_message(user_id, role, f"Mensaje número {i} del usuario {user_id}", durability, conversation_id)
+        latencies.append((time.perf_counter() - start) * 1000)
+
+
+def measure(shards: int, write_behind: bool, durability: str, threads: int, messages: int) -> dict:
+    """
+    Mide una configuración sobre una base de datos nueva.
+
+    Args:
+        shards: Número de fragmentos (0 para un solo archivo con Database)
+
+    Returns:
+        Diccionario con messages_s, p50 y p99 (ms por mensaje)
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        if shards:
+            db = ShardedDatabase(os.path.join(tmp, "shards"), shards, write_behind=write_behind)
+        else:
+            db = Database(os.path.join(tmp, "bench.db"), write_behind=write_behind)
+        for user_id in range(1, threads + 1):
+            db.initialize_user_profile(user_id)
+
+        latencies = [[] for _ in range(threads)]
+        workers = [
+            threading.Thread(target=write_turns, args=(db, user_id, messages, durability, latencies[user_id - 1]))
+            for user_id in range(1, threads + 1)
+        ]
+        start = time.perf_counter()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        db.flush()
+        elapsed = time.perf_counter() - start
+
+        saved = sum(
+            shard.get_connection().execute('SELECT COUNT(*) FROM messages').fetchone()[0]
+            for shard in db.shards
+        )
+        db.close()
+
+    assert saved == threads * messages, saved
+    samples = [ms for thread_latencies in latencies for ms in thread_latencies]
+    return {
+        "messages_s": saved / elapsed,
+        "p50": percentile(samples, 0.5),
+        "p99": percentile(samples, 0.99),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--threads", type=int, default=16, help="Escritores concurrentes")
+    parser.add_argument("--messages", type=int, default=300, help="Mensajes por escritor")
+    parser.add_argument("--max-shards", type=int, default=8, help="Fragmentos máximos")
+    parser.add_argument(
+        "--durability", choices=(DURABILITY_COMMITTED, DURABILITY_SYNCED), default=DURABILITY_COMMITTED,
+        help="Garantía que espera cada escritor"
+    )
+    args = parser.parse_args()
+
+    shard_counts = [0] + [count for count in (1, 2, 4, 8, 16, 32) if count <= args.max_shards]
+    print(f"{args.threads} escritores x {args.messages} mensajes, {args.durability}, {os.cpu_count()} núcleos")
+    print(f"{'escritura':>18} {'fragmentos':>10} {'mensajes/s':>11} {'p50 ms':>8} {'p99 ms':>8}")
+    for name, write_behind in (("COMMIT por llamada", False), ("diferida", True)):
+        for shards in shard_counts:
+            result = measure(shards, write_behind, args.durability, args.threads, args.messages)
+            label = str(shards) if shards else "un archivo"
+            print(f"{name:>18} {label:>10} {result['messages_s']:11.0f} {result['p50']:8.2f} {result['p99']:8.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""
+Benchmark de persistencia de mensajes con varios escritores concurrentes.
+Compara un COMMIT por llamada (comportamiento anterior) con la cola de
+escritura diferida en cada nivel de durabilidad.
+
+Uso: python -m bench.bench_write_behind [--threads 8] [--messages 500]
+"""
+import argparse
+import os
+import tempfile
+import threading
+import time
+
+from database import (
+    DURABILITY_BUFFERED,
+    DURABILITY_COMMITTED,
+    DURABILITY_SYNCED,
+    Database,
+)
+
+
+def write_turns(db: Database, user_id: int, messages: int, durability: str):
+    """Guarda mensajes como lo hace un turno de chat (los triggers mantienen el contador)."""
+    for i in range(messages):
+        role = "user" if i % 2 == 0 else "assistant"
+        db.save_message(user_id, role, f"Mensaje número {i} del usuario {user_id}", durability)
+
+
+def measure(write_behind: bool, durability: str, threads: int, messages: int) -> float:
+    """Devuelve los mensajes por segundo guardados (incluido el volcado final)."""
+    with tempfile.TemporaryDirectory() as tmp:
+        db = Database(os.path.join(tmp, "bench.db"), write_behind=write_behind)
+        for user_id in range(1, threads + 1):
+            db.initialize_user_profile(user_id)
+
+        workers = [
+            threading.Thread(target=write_turns, args=(db, user_id, messages, durability))
+            for user_id in range(1, threads + 1)
+        ]
+        start = time.perf_counter()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        db.flush()
+        elapsed = time.perf_counter() - start
+
+        saved = db.get_connection().execute('SELECT COUNT(*) FROM messages').fetchone()[0]
+        counted = db.get_connection().execute('SELECT SUM(total_messages) FROM user_stats').fetchone()[0]
+        db.close()
+
+    assert saved == counted == threads * messages, (saved, counted)
+    return saved / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--threads", type=int, default=8, help="Escritores concurrentes")
+    parser.add_argument("--messages", type=int, default=500, help="Mensajes por escritor")
+    args = parser.parse_args()
+
+    print(f"{args.threads} escritores x {args.messages} mensajes")
+    for name, write_behind, durability in (
+        ("COMMIT por llamada", False, DURABILITY_COMMITTED),
+        ("diferida, buffered", True, DURABILITY_BUFFERED),
+        ("diferida, committed", True, DURABILITY_COMMITTED),
+        ("diferida, synced", True, DURABILITY_SYNCED),
+    ):
+        rate = measure(write_behind, durability, args.threads, args.messages)
+        print(f"{name:>20}: {rate:9.0f} mensajes/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,217 @@
+"""
+Servidor Groq simulado para pruebas y benchmarks sin red ni API key.
+Implementa POST /openai/v1/chat/completions (normal y en streaming SSE) con
+latencia, velocidad de generación y fallos configurables.
+
+Uso: python -m bench.mock_groq [--port 8765] [--latency 0.2] [--tokens-per-second 500]
+Después: GroqClient(api_key="mock", base_url="http://127.0.0.1:8765")
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional, Tuple
+
+
+class MockGroqConfig:
+    """Comportamiento del servidor simulado."""
+
+    def __init__(
+        self,
+        latency: float = 0.0,
+        tokens_per_second: float = 0.0,
+        response_tokens: int = 50,
+        failure_rate: float = 0.0,
+        rate_limit_every: int = 0,
+        retry_after: float = 1.0,
+        seed: Optional[int] = None
+    ):
+        """
+        Inicializa la configuración.
+
+        Args:
+            latency: Segundos hasta el primer token
+            tokens_per_second: Velocidad de generación (0 para instantánea)
+            response_tokens: Tokens de cada respuesta
+            failure_rate: Probabilidad de responder con un 503
+            rate_limit_every: Responder 429 a una de cada N peticiones (0 para nunca)
+            retry_after: Valor de la cabecera Retry-After de los 429 (segundos)
+            seed: Semilla para los fallos aleatorios
+        """
+        self.latency = latency
+        self.tokens_per_second = tokens_per_second
+        self.response_tokens = response_tokens
+        self.failure_rate = failure_rate
+        self.rate_limit_every = rate_limit_every
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+        self.requests = 0
+        self.lock = threading.Lock()
+
+
+class MockGroqHandler(BaseHTTPRequestHandler):
+    """Atiende las peticiones de completado con respuestas sintéticas."""
+
+    protocol_version = "HTTP/1.1"
+    config: MockGroqConfig = MockGroqConfig()
+
+    def log_message(self, format, *args):
+        """Silencia el log de cada petición."""
+
+    def _send_json(self, status: int, body: dict, headers: Optional[dict] = None):
+        """Envía una respuesta JSON completa."""
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        """Responde a /openai/v1/chat/completions."""
+        length = int(self.headers.get("Content-Length", 0))
+        request = json.loads(self.rfile.read(length) or b"{}")
+
+        if not self.path.endswith("/chat/completions"):
+            self._send_json(404, {"error": {"message": "Not found"}})
+            return
+
+        config = self.config
+        with config.lock:
+            config.requests += 1
+            number = config.requests
+            fail = config.random.random() < config.failure_rate
+
+        if config.rate_limit_every and number % config.rate_limit_every == 0:
+            self._send_json(
+                429,
+                {"error": {"message": "Rate limit reached", "type": "tokens"}},
+                {"Retry-After": str(config.retry_after)}
+            )
+            return
+        if fail:
+            self._send_json(503, {"error": {"message": "Service unavailable"}})
+            return
+
+        prompt_tokens = sum(len(msg.get("content", "")) // 4 + 4 for msg in request.get("messages", []))
+        tokens = [f"palabra{i} " for i in range(config.response_tokens)]
+        time.sleep(config.latency)
+
+        if request.get("stream"):
+            self._stream(request, tokens, prompt_tokens)
+        else:
+            if config.tokens_per_second:
+                time.sleep(len(tokens) / config.tokens_per_second)
+            self._send_json(200, {
+                "id": f"chatcmpl-mock-{number}",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": request.get("model", "mock"),
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": "".join(tokens)},
+                    "finish_reason": "stop",
+                }],
+                "usage": {
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": len(tokens),
+                    "total_tokens": prompt_tokens + len(tokens),
+                    "queue_time": config.latency,
+                },
+            })
+
+    def _stream(self, request: dict, tokens: list, prompt_tokens: int):
+        """Envía la respuesta como eventos SSE, un token por evento."""
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        def write_event(payload: str):
+            data = f"data: {payload}\n\n".encode("utf-8")
+            self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+            self.wfile.flush()
+
+        base = {
+            "id": "chatcmpl-mock",
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": request.get("model", "mock"),
+        }
+        delay = 1 / self.config.tokens_per_second if self.config.tokens_per_second else 0
+        try:
+            for token in tokens:
+                chunk = dict(base, choices=[{"index": 0, "delta": {"content": token}, "finish_reason": None}])
+                write_event(json.dumps(chunk))
+                if delay:
+                    time.sleep(delay)
+            final = dict(
+                base,
+                choices=[{"index": 0, "delta": {}, "finish_reason": "stop"}],
+                x_groq={"usage": {
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": len(tokens),
+                    "total_tokens": prompt_tokens + len(tokens),
+                    "queue_time": self.config.latency,
+                }},
+            )
+            write_event(json.dumps(final))
+            write_event("[DONE]")
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            # El cliente canceló el stream
+            pass
+
+
+def start_mock_server(
+    config: Optional[MockGroqConfig] = None,
+    port: int = 0
+) -> Tuple[ThreadingHTTPServer, str]:
+    """
+    Arranca el servidor simulado en un hilo de fondo.
+
+    Args:
+        config: Comportamiento del servidor
+        port: Puerto a usar (0 para uno libre)
+
+    Returns:
+        Tupla (servidor, URL base para GroqClient)
+    """
+    handler = type("ConfiguredMockGroqHandler", (MockGroqHandler,), {"config": config or MockGroqConfig()})
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.2, help="Segundos hasta el primer token")
+    parser.add_argument("--tokens-per-second", type=float, default=500)
+    parser.add_argument("--response-tokens", type=int, default=50)
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="Probabilidad de 503")
+    parser.add_argument("--rate-limit-every", type=int, default=0, help="Un 429 cada N peticiones")
+    args = parser.parse_args()
+
+    config = MockGroqConfig(
+        latency=args.latency,
+        tokens_per_second=args.tokens_per_second,
+        response_tokens=args.response_tokens,
+        failure_rate=args.failure_rate,
+        rate_limit_every=args.rate_limit_every,
+    )
+    server, url = start_mock_server(config, args.port)
+    print(f"Servidor Groq simulado en {url} (Ctrl+C para salir)")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
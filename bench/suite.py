@@ -0,0 +1,297 @@
+"""
+Suite de benchmarks reproducible de extremo a extremo.
+Genera con Database una base de datos sintética (usuarios x mensajes con
+longitudes realistas), arranca el servidor Groq simulado y mide el inicio
+de sesión, la carga del historial al abrir una conversación, los turnos de
+chat completos (p50/p99, con el desglose por etapas de metrics) y el tamaño
+de la base de datos. Escribe los resultados en JSON y, con --baseline,
+termina con error si alguna medida empeora más que la tolerancia.
+
+Uso: python -m bench.suite [--users 50] [--messages 2000] [--output resultados.json]
+                           [--baseline referencia.json] [--tolerance 0.25]
+"""
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import sys
+import tempfile
+import threading
+import time
+
+import auth
+import metrics
+from chat_engine import ChatEngine, ChatSession
+from database import Database, DURABILITY_BUFFERED
+from groq_client import GroqClient
+from main import HISTORY_PAGE_SIZE
+from retrieval import MessageRetriever
+from bench.bench_async_pool import unlimited_scheduler
+from bench.bench_search import make_vocabulary
+from bench.mock_groq import MockGroqConfig, start_mock_server
+
+
+PASSWORD = "contraseña-de-prueba"
+
+# Palabras por mensaje: mediana y dispersión (log-normal) según el rol
+MESSAGE_WORDS = {"user": (12, 0.8), "assistant": (60, 0.7)}
+MAX_MESSAGE_WORDS = 800
+
+# Coste de bcrypt al generar los usuarios (el del login se mide aparte)
+GENERATION_ROUNDS = 4
+
+# Medidas que se comparan con la referencia (menor es mejor)
+COMPARED_FIELDS = ("p50", "p99")
+
+
+def percentile(samples: list, q: float) -> float:
+    """Percentil por rango más cercano (0 si no hay muestras)."""
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[max(0, math.ceil(q * len(ordered)) - 1)]
+
+
+def summarize(samples: list) -> dict:
+    """Número de muestras, p50, p99 y máximo en ms."""
+    return {
+        "count": len(samples),
+        "p50": round(percentile(samples, 0.5), 3),
+        "p99": round(percentile(samples, 0.99), 3),
+        "max": round(max(samples, default=0.0), 3),
+    }
+
+
+def timed(func, *args) -> float:
+    """Ejecuta func y devuelve los ms que ha tardado."""
+    start = time.perf_counter()
+    func(*args)
+    return (time.perf_counter() - start) * 1000
+
+
+def random_text(rng: random.Random, vocabulary: list, weights: list, role: str) -> str:
+    """Texto con un número de palabras log-normal (frecuencia de palabras tipo Zipf)."""
+    median, sigma = MESSAGE_WORDS[role]
+    words = min(MAX_MESSAGE_WORDS, max(1, int(rng.lognormvariate(math.log(median), sigma))))
+    return " ".join(rng.choices(vocabulary, weights, k=words))
+
+
+def generate_database(db: Database, users: int, messages: int, seed: int) -> list:
+    """
+    Crea usuarios con varias conversaciones y mensajes a través de Database.
+
+    Args:
+        db: Base de datos vacía
+        users: Número de usuarios
+        messages: Mensajes por usuario
+        seed: Semilla de la generación
+
+    Returns:
+        IDs de los usuarios creados
+    """
+    rng = random.Random(seed)
+    vocabulary = make_vocabulary(5000, seed)
+    weights = [1 / (rank + 1) for rank in range(len(vocabulary))]
+
+    rounds, auth.BCRYPT_ROUNDS = auth.BCRYPT_ROUNDS, GENERATION_ROUNDS
+    try:
+        user_ids = []
+        for number in range(users):
+            username = f"usuario{number:04d}"
+            db.create_user(username, PASSWORD)
+            user_id = db.get_users_page(username, limit=1)[0]["id"]
+            user_ids.append(user_id)
+
+            conversations = [db.create_conversation(user_id) for _ in range(rng.randint(1, 5))]
+            for i in range(messages):
+                role = "user" if i % 2 == 0 else "assistant"
+                db.save_message(
+                    user_id, role, random_text(rng, vocabulary, weights, role),
+                    DURABILITY_BUFFERED, rng.choice(conversations)
+                )
+        db.flush()
+    finally:
+        auth.BCRYPT_ROUNDS = rounds
+    return user_ids
+
+
+def load_history(engine: ChatEngine, user_id: int) -> ChatSession:
+    """Abre la conversación más reciente como la pantalla de chat: historial reciente, resumen y primera página."""
+    session = ChatSession(engine, user_id, engine.db.get_username(user_id))
+    session.open_conversation()
+    engine.db.get_messages_page(user_id, limit=HISTORY_PAGE_SIZE, conversation_id=session.conversation_id)
+    return session
+
+
+def run_turn(session: ChatSession, user_message: str) -> float:
+    """
+    Un turno completo sin interfaz, con el mismo ChatSession.run_turn que main.py.
+
+    Returns:
+        Milisegundos hasta el primer fragmento de la respuesta
+    """
+    start = time.perf_counter()
+    first = []
+
+    def on_delta(delta: str):
+        if not first:
+            first.append((time.perf_counter() - start) * 1000)
+
+    result = session.run_turn(user_message, on_delta=on_delta)
+    if result.error is not None:
+        raise result.error
+    return first[0] if first else 0.0
+
+
+def measure_login(db: Database, user_id: int, username: str, repeat: int) -> dict:
+    """Inicio de sesión con contraseña (bcrypt al coste configurado) y reanudación con token."""
+    # El primer inicio regenera el hash generado con GENERATION_ROUNDS
+    db.validate_user(username, PASSWORD)
+    password_ms = [timed(db.validate_user, username, PASSWORD) for _ in range(repeat)]
+    token = db.create_session(user_id)
+    token_ms = [timed(db.validate_session, token) for _ in range(repeat * 100)]
+    return {"login_password_ms": summarize(password_ms), "login_token_ms": summarize(token_ms)}
+
+
+def measure_turns(
+    db: Database,
+    retriever: MessageRetriever,
+    url: str,
+    user_ids: list,
+    sessions: int,
+    turns: int,
+    seed: int
+) -> dict:
+    """Sesiones simultáneas (un hilo cada una) que envían turnos contra el servidor simulado."""
+    vocabulary = make_vocabulary(5000, seed)
+    weights = [1 / (rank + 1) for rank in range(len(vocabulary))]
+    turn_ms, ttft_ms = [], []
+    lock = threading.Lock()
+
+    def session(number: int):
+        rng = random.Random(seed * 1000 + number)
+        client = GroqClient(api_key="mock", base_url=url, scheduler=unlimited_scheduler())
+        chat = load_history(ChatEngine(db, client, retriever), user_ids[number % len(user_ids)])
+        for _ in range(turns):
+            text = random_text(rng, vocabulary, weights, "user")
+            start = time.perf_counter()
+            ttft = run_turn(chat, text)
+            elapsed = (time.perf_counter() - start) * 1000
+            with lock:
+                turn_ms.append(elapsed)
+                ttft_ms.append(ttft)
+
+    threads = [threading.Thread(target=session, args=(i,)) for i in range(sessions)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return {"turn_ms": summarize(turn_ms), "turn_ttft_ms": summarize(ttft_ms)}
+
+
+def database_size_mb(db: Database) -> float:
+    """Tamaño del archivo de la base de datos tras volcar el WAL."""
+    db.flush()
+    db.get_connection().execute('PRAGMA wal_checkpoint(TRUNCATE)')
+    return os.path.getsize(db.db_path) / 1e6
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    """
+    Medidas que han empeorado respecto a la referencia.
+
+    Returns:
+        Lista de textos con cada regresión
+    """
+    regressions = []
+    for name, value in results.items():
+        reference = baseline.get(name)
+        if isinstance(value, dict) and isinstance(reference, dict):
+            pairs = [(f"{name}.{field}", value.get(field), reference.get(field)) for field in COMPARED_FIELDS]
+        else:
+            pairs = [(name, value, reference)]
+        for label, current, previous in pairs:
+            if isinstance(current, (int, float)) and isinstance(previous, (int, float)) and previous > 0:
+                if current > previous * (1 + tolerance):
+                    regressions.append(f"{label}: {previous:g} -> {current:g} (+{current / previous - 1:.0%})")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--users", type=int, default=50, help="Usuarios de la base de datos sintética")
+    parser.add_argument("--messages", type=int, default=2000, help="Mensajes por usuario")
+    parser.add_argument("--sessions", type=int, default=8, help="Sesiones de chat simultáneas")
+    parser.add_argument("--turns", type=int, default=10, help="Turnos por sesión")
+    parser.add_argument("--repeat", type=int, default=5, help="Repeticiones de login y carga del historial")
+    parser.add_argument("--latency", type=float, default=0.05, help="Segundos del servidor simulado hasta el primer token")
+    parser.add_argument("--tokens-per-second", type=float, default=500, help="Velocidad de generación simulada")
+    parser.add_argument("--response-tokens", type=int, default=50, help="Fragmentos por respuesta simulada")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="Archivo JSON de resultados (por defecto, salida estándar)")
+    parser.add_argument("--baseline", help="Resultados de referencia con los que comparar")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Empeoramiento admitido (0.25 = 25 %%)")
+    args = parser.parse_args()
+
+    config = MockGroqConfig(
+        latency=args.latency,
+        tokens_per_second=args.tokens_per_second,
+        response_tokens=args.response_tokens,
+        seed=args.seed,
+    )
+    server, url = start_mock_server(config)
+    results = {}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db = Database(os.path.join(tmp, "bench.db"))
+
+        start = time.perf_counter()
+        user_ids = generate_database(db, args.users, args.messages, args.seed)
+        # Los vectores de recuperación forman parte del tamaño real de la base de datos
+        retriever = MessageRetriever(db)
+        retriever.index_pending()
+        results["generate_s"] = round(time.perf_counter() - start, 2)
+        results["db_size_mb"] = round(database_size_mb(db), 2)
+
+        results.update(measure_login(db, user_ids[0], "usuario0000", args.repeat))
+
+        sample = user_ids[:args.repeat * 4]
+        engine = ChatEngine(db, GroqClient(api_key="mock", base_url=url), retriever)
+        results["history_load_ms"] = summarize([timed(load_history, engine, user_id) for user_id in sample])
+
+        # Las métricas están desactivadas por defecto fuera de las herramientas de medida
+        metrics.configure(enabled=True)
+        metrics.reset()
+        results.update(measure_turns(db, retriever, url, user_ids, args.sessions, args.turns, args.seed))
+        stages = metrics.snapshot()
+        results["db_size_after_turns_mb"] = round(database_size_mb(db), 2)
+        db.close()
+
+    server.shutdown()
+    report = {
+        "config": dict(vars(args), bcrypt_rounds=auth.BCRYPT_ROUNDS),
+        "machine": {"python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count()},
+        "results": results,
+        "stages": stages,
+    }
+
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare(results, json.load(f)["results"], args.tolerance)
+        for regression in regressions:
+            print(f"REGRESIÓN {regression}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
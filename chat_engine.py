@@ -0,0 +1,463 @@
+"""
+Lógica del chatbot independiente de la interfaz.
+ChatEngine reúne los recursos compartidos del proceso (base de datos,
+recuperador de mensajes y cliente de Groq) y se encarga de la
+autenticación; cada usuario autenticado obtiene una ChatSession, que
+mantiene la conversación abierta, procesa los turnos y gestiona los
+borrados. La interfaz de Flet (main.py), los benchmarks o cualquier otro
+transporte solo tienen que mostrar lo que devuelven.
+"""
+import atexit
+import os
+import threading
+import time
+from dataclasses import dataclass
+from typing import Callable, Optional, Set, Tuple
+
+import metrics
+from conversation import ConversationBuffer
+from database import Database, DURABILITY_BUFFERED, WRITER_ADDRESS_ENV, WRITER_AUTHKEY_ENV
+from groq_client import DEFAULT_SYSTEM_PROMPT, AsyncGroqClient, GroqClient
+from purge import PurgeJob
+from request_scheduler import ChatError
+from retrieval import MessageRetriever
+from sharded_database import open_database
+
+
+# Mensajes del historial que se cargan en memoria al abrir una conversación
+HISTORY_SEED_LIMIT = 200
+
+# Mensajes que se cargan como máximo al abrir una conversación para enlazar
+# con su resumen guardado (si el resumen quedó más atrás, se descarta)
+SUMMARY_CATCHUP_LIMIT = 2000
+
+# Caracteres del primer mensaje que se usan como título de la conversación
+CONVERSATION_TITLE_CHARS = 40
+
+# Mensajes anteriores relevantes que se recuperan en cada turno
+RETRIEVAL_TOP_K = 4
+
+# Longitudes mínimas al registrar un usuario
+MIN_USERNAME_CHARS = 3
+MIN_PASSWORD_CHARS = 6
+
+_engine: Optional["ChatEngine"] = None
+_engine_lock = threading.Lock()
+
+
+def get_engine() -> "ChatEngine":
+    """
+    Obtiene el motor del proceso, creándolo la primera vez.
+    
+    Todas las sesiones del proceso comparten la base de datos (una sola
+    cola de escritura agrupa sus mensajes), el índice semántico y el
+    cliente de Groq. Si está definida CHATBOT_WRITER_ADDRESS, los mensajes
+    se envían al proceso escritor compartido (ver db_writer.py); con
+    CHATBOT_SHARDS se usa el almacenamiento repartido (ver sharded_database.py).
+    """
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            db = open_database(
+                write_behind=True,
+                writer_address=os.getenv(WRITER_ADDRESS_ENV),
+                writer_authkey=bytes.fromhex(os.getenv(WRITER_AUTHKEY_ENV, ""))
+            )
+            # Volcar las escrituras pendientes al salir
+            atexit.register(db.close)
+            _engine = ChatEngine(db)
+            # Mensajes guardados sin vector (por ejemplo, de antes de la búsqueda semántica)
+            _engine.retriever.index_in_background()
+        return _engine
+
+
+@dataclass
+class TurnResult:
+    """Resultado de un turno de chat."""
+    
+    content: str = ""
+    error: Optional[Exception] = None
+    cancelled: bool = False
+    
+    @property
+    def ok(self) -> bool:
+        """Indica si el turno terminó con una respuesta completa."""
+        return self.error is None and not self.cancelled
+
+
+class ChatEngine:
+    """Recursos compartidos y autenticación; crea las sesiones de los usuarios."""
+    
+    def __init__(
+        self,
+        db: Database,
+        groq_client: Optional[GroqClient] = None,
+        retriever: Optional[MessageRetriever] = None
+    ):
+        """
+        Inicializa el motor.
+        
+        Args:
+            db: Base de datos
+            groq_client: Cliente de Groq síncrono (por defecto se crea uno con
+                la API key del archivo .env; si no está configurada,
+                groq_error explica por qué y los turnos devuelven ese error)
+            retriever: Recuperador de mensajes (por defecto uno nuevo sobre db)
+        
+        Raises:
+            TypeError: Si groq_client es un AsyncGroqClient (sus métodos son
+                corrutinas y los turnos y resúmenes se ejecutan en hilos)
+        """
+        if isinstance(groq_client, AsyncGroqClient):
+            raise TypeError("ChatEngine necesita un GroqClient síncrono, no un AsyncGroqClient")
+        self.db = db
+        self.retriever = retriever or MessageRetriever(db)
+        self.groq_client = groq_client
+        self.groq_error: Optional[str] = None
+        if groq_client is None:
+            try:
+                self.groq_client = GroqClient()
+            except ValueError as e:
+                self.groq_error = str(e)
+        # Conversaciones cuyo resumen se está actualizando
+        self._summarizing: Set[int] = set()
+        self._summarizing_lock = threading.Lock()
+    
+    @staticmethod
+    def validate_registration(username: str, password: str, confirm_password: str) -> Optional[str]:
+        """
+        Comprueba los datos del formulario de registro (sin tocar la BD).
+        
+        Returns:
+            Mensaje de error, o None si los datos son válidos
+        """
+        if not username or not password or not confirm_password:
+            return "Por favor completa todos los campos"
+        if len(username) < MIN_USERNAME_CHARS:
+            return f"El usuario debe tener al menos {MIN_USERNAME_CHARS} caracteres"
+        if len(password) < MIN_PASSWORD_CHARS:
+            return f"La contraseña debe tener al menos {MIN_PASSWORD_CHARS} caracteres"
+        if password != confirm_password:
+            return "Las contraseñas no coinciden"
+        return None
+    
+    def register(self, username: str, password: str) -> Tuple[bool, str]:
+        """
+        Crea un usuario. Es lento (bcrypt): desde una UI debe llamarse con
+        auth.run_in_background.
+        
+        Returns:
+            Tupla (éxito, mensaje)
+        """
+        return self.db.create_user(username, password)
+    
+    def login(self, username: str, password: str) -> Optional["ChatSession"]:
+        """
+        Inicia sesión con contraseña. Es lento (bcrypt): desde una UI debe
+        llamarse con auth.run_in_background.
+        
+        Returns:
+            Sesión del usuario, o None si las credenciales no son válidas
+        """
+        valid, user_id = self.db.validate_user(username, password)
+        if not valid:
+            return None
+        return self.open_session(user_id, username)
+    
+    def resume(self, token: Optional[str]) -> Optional["ChatSession"]:
+        """
+        Inicia sesión con un token de ChatSession.create_token (sin bcrypt).
+        
+        Returns:
+            Sesión del usuario, o None si el token no es válido o el usuario ya no existe
+        """
+        user_id = self.db.validate_session(token)
+        username = self.db.get_username(user_id) if user_id is not None else None
+        if username is None:
+            return None
+        return self.open_session(user_id, username)
+    
+    def open_session(self, user_id: int, username: str) -> "ChatSession":
+        """
+        Crea la sesión de un usuario ya autenticado y abre su conversación más reciente.
+        
+        Args:
+            user_id: ID del usuario
+            username: Nombre de usuario
+        
+        Returns:
+            Sesión del usuario
+        """
+        self.db.initialize_user_profile(user_id)
+        self.db.update_last_login(user_id)
+        session = ChatSession(self, user_id, username)
+        session.open_conversation()
+        return session
+    
+    def summarize_in_background(self, conversation_id: int, conversation: ConversationBuffer):
+        """
+        Actualiza el resumen de una conversación larga sin retrasar los turnos.
+        
+        Args:
+            conversation_id: ID de la conversación
+            conversation: Buffer de la conversación (se actualiza en sitio)
+        """
+        if self.groq_client is None or not self.groq_client.needs_summary(conversation):
+            return
+        with self._summarizing_lock:
+            if conversation_id in self._summarizing:
+                return
+            self._summarizing.add(conversation_id)
+        
+        def summarize():
+            try:
+                revision = conversation.revision
+                result = self.groq_client.update_summary(conversation)
+                # Si se vació mientras se resumía, el resumen ya no vale; la
+                # base de datos comprueba además que sigan sus mensajes
+                if result is not None and conversation.revision == revision:
+                    summary, message_count = result
+                    self.db.save_conversation_summary(conversation_id, summary, message_count)
+            finally:
+                with self._summarizing_lock:
+                    self._summarizing.discard(conversation_id)
+                self.db.release_connection()
+        
+        threading.Thread(target=summarize, name="conversation-summary", daemon=True).start()
+
+
+class ChatSession:
+    """Sesión de un usuario autenticado: conversación abierta, turnos y borrados."""
+    
+    def __init__(self, engine: ChatEngine, user_id: int, username: str):
+        """
+        Inicializa la sesión (normalmente la crea ChatEngine).
+        
+        Args:
+            engine: Motor que comparte la sesión con las demás
+            user_id: ID del usuario
+            username: Nombre de usuario
+        """
+        self.engine = engine
+        self.db = engine.db
+        self.user_id = user_id
+        self.username = username
+        self.conversation_id: Optional[int] = None  # Conversación abierta
+        self.conversation = ConversationBuffer()  # Historial de la conversación abierta
+    
+    @property
+    def theme(self) -> str:
+        """Tema preferido del usuario ('dark' o 'light')."""
+        return self.db.get_user_theme(self.user_id)
+    
+    def set_theme(self, theme: str) -> bool:
+        """Guarda el tema preferido del usuario."""
+        return self.db.set_user_theme(self.user_id, theme)
+    
+    def create_token(self) -> Optional[str]:
+        """Token para reanudar la sesión con ChatEngine.resume sin pedir la contraseña."""
+        return self.db.create_session(self.user_id)
+    
+    def revoke_tokens(self) -> bool:
+        """Invalida los tokens de create_token de todos los dispositivos (al cerrar sesión)."""
+        return self.db.revoke_sessions(self.user_id)
+    
+    def open_conversation(self, conversation_id: Optional[int] = None):
+        """
+        Activa una conversación del usuario y carga su historial reciente.
+        
+        Args:
+            conversation_id: Conversación a abrir (None para la más reciente,
+                que se crea si el usuario no tiene ninguna)
+        """
+        if conversation_id is None:
+            conversations = self.db.get_conversations(self.user_id, limit=1)
+            if conversations:
+                conversation_id = conversations[0]["id"]
+            else:
+                conversation_id = self.db.create_conversation(self.user_id)
+        
+        # Los mensajes aún en la cola de escritura deben verse en el historial
+        self.db.flush()
+        total = self.db.count_conversation_messages(conversation_id)
+        summary = self.db.get_conversation_summary(conversation_id)
+        limit = HISTORY_SEED_LIMIT
+        if summary and summary["message_count"] <= total:
+            # Cargar desde el primer mensaje que no cubre el resumen, sin huecos entre ambos
+            limit = max(limit, min(total - summary["message_count"], SUMMARY_CATCHUP_LIMIT))
+        messages = self.db.get_user_messages(
+            self.user_id,
+            limit=limit,
+            conversation_id=conversation_id
+        )
+        
+        self.conversation_id = conversation_id
+        self.conversation = ConversationBuffer(messages, total - len(messages))
+        
+        # El resumen sustituye en el contexto a los mensajes antiguos que cubre
+        if summary and not self.conversation.set_summary(summary["summary"], summary["message_count"]):
+            print(f"Resumen obsoleto en la conversación {conversation_id}: se generará de nuevo")
+            self.db.delete_conversation_summary(conversation_id)
+    
+    def new_conversation(self) -> Optional[int]:
+        """
+        Crea una conversación vacía (sin abrirla).
+        
+        Returns:
+            ID de la conversación, o None si no se pudo crear
+        """
+        return self.db.create_conversation(self.user_id)
+    
+    def run_turn(
+        self,
+        user_message: str,
+        cancel_event: Optional[threading.Event] = None,
+        on_delta: Optional[Callable[[str], None]] = None,
+        on_title: Optional[Callable[[str], None]] = None,
+        conversation_id: Optional[int] = None,
+        conversation: Optional[ConversationBuffer] = None
+    ) -> TurnResult:
+        """
+        Procesa un turno: recupera contexto, guarda los mensajes y obtiene la respuesta.
+        
+        Bloquea hasta que termina la respuesta; una UI debe llamarlo desde un
+        hilo de fondo (por ejemplo, un ChatWorker).
+        
+        Args:
+            user_message: Mensaje del usuario
+            cancel_event: Evento que detiene la respuesta en cuanto se activa
+            on_delta: Función llamada con cada fragmento de la respuesta
+            on_title: Función llamada con el título si es el primer mensaje
+            conversation_id: Conversación del turno (por defecto la abierta;
+                indicarla permite encolar turnos y cambiar de conversación)
+            conversation: Buffer de esa conversación (se actualiza en sitio)
+        
+        Returns:
+            TurnResult con la respuesta, el error o si se canceló
+        """
+        if conversation_id is None:
+            conversation_id, conversation = self.conversation_id, self.conversation
+        groq_client = self.engine.groq_client
+        if groq_client is None:
+            return TurnResult(error=ValueError(self.engine.groq_error or "Cliente de Groq no inicializado"))
+        
+        started = time.perf_counter()
+        retriever = self.engine.retriever
+        
+        # Mensajes anteriores de cualquier conversación parecidos al actual
+        # (antes de guardarlo, para que no se recupere a sí mismo)
+        with metrics.span('retrieval'):
+            # Solo los mensajes nuevos de este usuario; los anteriores a la
+            # búsqueda semántica los indexa index_in_background
+            retriever.index_user(self.user_id)
+            retrieved = retriever.search(self.user_id, user_message, k=RETRIEVAL_TOP_K)
+        
+        # Guardar mensaje del usuario en BD (se escribe en el siguiente lote)
+        self.db.save_message(
+            self.user_id, "user", user_message, DURABILITY_BUFFERED, conversation_id
+        )
+        
+        # Historial previo de la conversación (sin el mensaje que acabamos de enviar)
+        history_length = len(conversation)
+        
+        # El primer mensaje da título a la conversación
+        if history_length == 0:
+            title = user_message.splitlines()[0][:CONVERSATION_TITLE_CHARS]
+            self.db.rename_conversation(conversation_id, title)
+            if on_title:
+                on_title(title)
+        
+        result = TurnResult()
+        try:
+            stream = groq_client.chat_with_context_stream(
+                user_message,
+                conversation,
+                DEFAULT_SYSTEM_PROMPT,
+                retrieved,
+                cancel_event
+            )
+            conversation.append("user", user_message)
+            
+            chunks = []
+            try:
+                for delta in stream:
+                    if cancel_event is not None and cancel_event.is_set():
+                        result.cancelled = True
+                        break
+                    chunks.append(delta)
+                    if on_delta:
+                        on_delta(delta)
+            finally:
+                # Aborta la petición si se ha cancelado a mitad
+                stream.close()
+            
+            result.content = "".join(chunks)
+            if result.content:
+                # Guardar respuesta en BD (también si se canceló a mitad)
+                self.db.save_message(
+                    self.user_id, "assistant", result.content, DURABILITY_BUFFERED, conversation_id
+                )
+                conversation.append("assistant", result.content)
+                
+                # Comprimir la parte antigua si la conversación ha crecido
+                self.engine.summarize_in_background(conversation_id, conversation)
+        
+        except Exception as e:
+            if isinstance(e, ChatError) and e.kind == 'cancelled':
+                # Cancelada antes de la respuesta (esperando límites o reintentos)
+                result.cancelled = True
+            else:
+                result.error = e
+            if len(conversation) == history_length:
+                conversation.append("user", user_message)
+        
+        metrics.observe('turn', (time.perf_counter() - started) * 1000)
+        metrics.export()
+        return result
+    
+    def _purge(self, purge: Callable, *args, on_progress=None, on_done=None) -> PurgeJob:
+        """Lanza un borrado por lotes y descarta el índice semántico del usuario al terminar."""
+        def finish(result):
+            self.engine.retriever.forget(self.user_id)
+            if on_done:
+                on_done(result)
+        
+        return PurgeJob(self.db, purge, *args, on_progress=on_progress, on_done=finish).start()
+    
+    def clear_conversation(self, on_done: Optional[Callable] = None) -> PurgeJob:
+        """
+        Vacía la conversación abierta en segundo plano (el buffer se vacía ya).
+        
+        Args:
+            on_done: Función llamada con el resultado cuando termina el borrado
+        """
+        self.conversation.clear()
+        return self._purge(self.db.clear_conversation_messages, self.conversation_id, on_done=on_done)
+    
+    def delete_conversation(self, conversation_id: int, on_done: Optional[Callable] = None) -> PurgeJob:
+        """
+        Elimina una conversación y sus mensajes en segundo plano.
+        
+        Args:
+            conversation_id: ID de la conversación
+            on_done: Función llamada con el resultado cuando termina el borrado
+        """
+        return self._purge(self.db.delete_conversation, conversation_id, on_done=on_done)
+    
+    def delete_account(
+        self,
+        on_progress: Optional[Callable[[int, int], None]] = None,
+        on_done: Optional[Callable[[Optional[Tuple[bool, str]]], None]] = None
+    ) -> PurgeJob:
+        """
+        Elimina el usuario y todos sus datos en segundo plano.
+        
+        Args:
+            on_progress: Función llamada con (borrados, total) tras cada lote de mensajes
+            on_done: Función llamada con la tupla (éxito, mensaje) de Database.delete_user
+        """
+        return self._purge(self.db.delete_user, self.user_id, on_progress=on_progress, on_done=on_done)
+    
+    def close(self):
+        """Cierra la sesión: guarda las escrituras pendientes del usuario."""
+        self.db.flush()
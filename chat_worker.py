@@ -0,0 +1,73 @@
+"""
+Procesamiento de turnos de chat en segundo plano.
+Ejecuta en orden las tareas de una sesión fuera de los manejadores de eventos de la UI.
+"""
+import queue
+import threading
+from typing import Callable, Optional
+
+
+# Una tarea recibe el evento que indica si el usuario ha cancelado el turno
+ChatTask = Callable[[threading.Event], None]
+
+
+class ChatWorker:
+    """Hilo de fondo que ejecuta en orden los turnos de chat de una sesión."""
+    
+    def __init__(self):
+        """Inicializa la cola de turnos y arranca el hilo de fondo."""
+        self._queue: "queue.Queue[Optional[ChatTask]]" = queue.Queue()
+        self._current_cancel: Optional[threading.Event] = None
+        self._thread = threading.Thread(target=self._run, name="chat-worker", daemon=True)
+        self._thread.start()
+    
+    @property
+    def queued(self) -> int:
+        """Número de turnos esperando a que termine el actual."""
+        return self._queue.qsize()
+    
+    def submit(self, task: ChatTask):
+        """
+        Encola un turno para ejecutarlo cuando terminen los anteriores.
+        
+        Args:
+            task: Función que procesa el turno; debe consultar el evento de
+                cancelación que recibe y terminar en cuanto esté activo
+        """
+        self._queue.put(task)
+    
+    def cancel(self):
+        """Cancela el turno en curso, si lo hay."""
+        cancel_event = self._current_cancel
+        if cancel_event is not None:
+            cancel_event.set()
+    
+    def cancel_all(self):
+        """Descarta los turnos pendientes y cancela el turno en curso."""
+        while True:
+            try:
+                self._queue.get_nowait()
+            except queue.Empty:
+                break
+        self.cancel()
+    
+    def stop(self):
+        """Cancela todo el trabajo y termina el hilo de fondo."""
+        self.cancel_all()
+        self._queue.put(None)
+    
+    def _run(self):
+        """Bucle del hilo de fondo."""
+        while True:
+            task = self._queue.get()
+            if task is None:
+                break
+            
+            cancel_event = threading.Event()
+            self._current_cancel = cancel_event
+            try:
+                task(cancel_event)
+            except Exception as e:
+                print(f"Error al procesar turno de chat: {e}")
+            finally:
+                self._current_cancel = None
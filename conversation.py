@@ -0,0 +1,200 @@
+"""
+Buffer en memoria de la conversación activa.
+Mantiene el historial de la sesión para no releerlo de la base de datos en cada turno.
+"""
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+
+# Caracteres por token aproximados (estimación conservadora para español e inglés)
+CHARS_PER_TOKEN = 4
+
+# Tokens que añade el formato de chat a cada mensaje (rol y separadores)
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Estima los tokens que ocupa un mensaje sin necesidad de un tokenizador.
+    
+    Args:
+        text: Contenido del mensaje
+    
+    Returns:
+        Número aproximado de tokens, incluyendo el formato del mensaje
+    """
+    return -(-len(text) // CHARS_PER_TOKEN) + MESSAGE_OVERHEAD_TOKENS
+
+
+def select_recent(
+    messages: Sequence[Dict[str, str]],
+    max_tokens: int,
+    token_counts: Optional[Sequence[int]] = None,
+    first: int = 0
+) -> List[Dict[str, str]]:
+    """
+    Selecciona los mensajes más recientes que caben en un presupuesto de tokens.
+    
+    Args:
+        messages: Historial en orden cronológico
+        max_tokens: Presupuesto de tokens disponible
+        token_counts: Tokens ya calculados de cada mensaje (se estiman si es None)
+        first: Índice del mensaje más antiguo que se puede seleccionar
+    
+    Returns:
+        Sufijo del historial, en orden cronológico, cuyo tamaño no supera el presupuesto
+    """
+    used = 0
+    start = len(messages)
+    while start > first:
+        if token_counts is not None:
+            tokens = token_counts[start - 1]
+        else:
+            tokens = estimate_tokens(messages[start - 1]["content"])
+        if used + tokens > max_tokens:
+            break
+        used += tokens
+        start -= 1
+    return list(messages[start:])
+
+
+class ConversationBuffer:
+    """Historial de la sesión actual en el formato que espera GroqClient."""
+    
+    def __init__(self, messages: Optional[Iterable[Dict[str, str]]] = None, offset: int = 0):
+        """
+        Inicializa el buffer.
+        
+        Args:
+            messages: Mensajes iniciales en orden cronológico (por ejemplo, el
+                historial cargado al iniciar sesión, con su 'id' de BD)
+            offset: Mensajes de la conversación anteriores al primero cargado
+        """
+        self._messages: List[Dict[str, str]] = []
+        self._token_counts: List[int] = []  # Tokens estimados de cada mensaje
+        self.total_tokens = 0
+        # ID en BD del mensaje más antiguo cargado, para paginar hacia atrás
+        self.oldest_id: Optional[int] = None
+        self.offset = offset
+        # Resumen de los mensajes anteriores a _messages[summary_end]
+        self.summary: Optional[str] = None
+        self.summary_end = 0
+        # Cambia al vaciar el buffer, para descartar resúmenes ya obsoletos
+        self.revision = 0
+        if messages:
+            messages = list(messages)
+            self.extend(messages)
+            self.oldest_id = messages[0].get("id")
+    
+    def append(self, role: str, content: str):
+        """
+        Agrega un mensaje al final de la conversación.
+        
+        Args:
+            role: Rol del mensaje ('user' o 'assistant')
+            content: Contenido del mensaje
+        """
+        tokens = estimate_tokens(content)
+        self._messages.append({"role": role, "content": content})
+        self._token_counts.append(tokens)
+        self.total_tokens += tokens
+    
+    def extend(self, messages: Iterable[Dict[str, str]]):
+        """
+        Agrega varios mensajes en orden.
+        
+        Args:
+            messages: Diccionarios con al menos las claves 'role' y 'content'
+        """
+        for msg in messages:
+            self.append(msg["role"], msg["content"])
+    
+    def messages(self) -> List[Dict[str, str]]:
+        """
+        Obtiene los mensajes de la conversación.
+        
+        Returns:
+            Lista de mensajes en formato [{"role": ..., "content": ...}]
+        """
+        return self._messages
+    
+    def recent(self, max_tokens: int) -> List[Dict[str, str]]:
+        """
+        Obtiene los mensajes más recientes que caben en un presupuesto de tokens.
+        
+        Usa los tokens calculados al agregar cada mensaje, por lo que el coste
+        solo depende del número de mensajes seleccionados.
+        
+        Args:
+            max_tokens: Presupuesto de tokens disponible
+        
+        Returns:
+            Lista de mensajes en orden cronológico
+        """
+        # Los mensajes que ya cubre el resumen no se vuelven a enviar
+        return select_recent(self._messages, max_tokens, self._token_counts, self.summary_end)
+    
+    @property
+    def summary_position(self) -> int:
+        """Número de mensajes de la conversación, desde el principio, que cubre el resumen."""
+        return self.offset + self.summary_end
+    
+    def unsummarized_tokens(self) -> int:
+        """Tokens estimados de los mensajes que aún no cubre el resumen."""
+        return sum(self._token_counts[self.summary_end:])
+    
+    def pending_summary(self, keep_tokens: int) -> Tuple[int, List[Dict[str, str]]]:
+        """
+        Obtiene los mensajes que deben pasar al resumen.
+        
+        Son los que no cubre aún el resumen, salvo los más recientes que
+        caben en keep_tokens, que se siguen enviando tal cual.
+        
+        Args:
+            keep_tokens: Tokens de mensajes recientes que no se resumen
+        
+        Returns:
+            Tupla (índice final en el buffer, mensajes a resumir en orden cronológico)
+        """
+        start = self.summary_end
+        kept = len(self.recent(keep_tokens))
+        end = max(start, len(self._messages) - kept)
+        return end, self._messages[start:end]
+    
+    def set_summary(self, summary: Optional[str], position: int) -> bool:
+        """
+        Establece el resumen de la parte antigua de la conversación.
+        
+        Si el resumen no llega al primer mensaje cargado, los mensajes
+        intermedios no estarían ni en el resumen ni en el buffer; si cubre
+        más mensajes de los que hay, es de antes de vaciar la conversación.
+        En ambos casos se considera obsoleto, no se usa y el buffer queda
+        sin resumen para que se genere otro con lo cargado.
+        
+        Args:
+            summary: Texto del resumen
+            position: Mensajes de la conversación, desde el principio, que cubre
+        
+        Returns:
+            True si se usa el resumen, False si es obsoleto
+        """
+        if summary is not None and not self.offset <= position <= self.offset + len(self._messages):
+            self.summary = None
+            self.summary_end = 0
+            return False
+        self.summary = summary
+        self.summary_end = min(len(self._messages), max(0, position - self.offset))
+        return True
+    
+    def clear(self):
+        """Vacía la conversación."""
+        self._messages.clear()
+        self._token_counts.clear()
+        self.total_tokens = 0
+        self.oldest_id = None
+        self.offset = 0
+        self.summary = None
+        self.summary_end = 0
+        self.revision += 1
+    
+    def __len__(self) -> int:
+        return len(self._messages)
@@ -2,478 +2,2163 @@
 Módulo de gestión de base de datos SQLite.
 Maneja usuarios, mensajes y conversaciones.
 """
+import os
+import queue
+import re
+import secrets
 import sqlite3
-from datetime import datetime
-from typing import List, Optional, Tuple, Dict
-from auth import hash_password, verify_password
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from multiprocessing.connection import AuthenticationError, Client
+from typing import Callable, Iterator, List, Optional, Tuple, Dict, Union
+import metrics
+from auth import (
+    create_session_token,
+    hash_password,
+    password_needs_rehash,
+    verify_password,
+    verify_session_token,
+)
+
+
+# Número de sentencias preparadas que cada conexión mantiene en caché
+STATEMENT_CACHE_SIZE = 256
+
+# Pragmas aplicados a cada conexión nueva
+CONNECTION_PRAGMAS = (
+    # Debe ir antes de activar WAL; solo tiene efecto al crear la base de datos
+    'PRAGMA auto_vacuum = INCREMENTAL',
+    'PRAGMA journal_mode = WAL',
+    'PRAGMA synchronous = NORMAL',
+    'PRAGMA cache_size = -16000',  # 16 MB de caché de páginas
+    'PRAGMA mmap_size = 268435456',  # 256 MB mapeados en memoria
+    'PRAGMA temp_store = MEMORY',
+    'PRAGMA busy_timeout = 5000',
+)
+
+# Mensajes borrados por transacción al vaciar un historial o eliminar una cuenta
+PURGE_BATCH_SIZE = 500
+
+# Pausa entre lotes de borrado (segundos) para dejar escribir a otros hilos
+PURGE_PAUSE = 0.005
+
+# Páginas libres que se devuelven al sistema en cada paso de incremental_vacuum
+VACUUM_STEP_PAGES = 1024
+
+# Recibe (mensajes borrados, mensajes a borrar) tras cada lote de un borrado
+ProgressCallback = Callable[[int, int], None]
+
+# Expresión SQL equivalente a conversation.estimate_tokens (4 caracteres por
+# token, redondeando hacia arriba, más 4 de formato)
+SQL_TOKEN_ESTIMATE = '((length({content}) + 3) / 4 + 4)'
+
+# Migraciones del esquema. La migración en la posición i deja la base de
+# datos en la versión i + 1 (guardada en PRAGMA user_version).
+MIGRATIONS = [
+    # Historial de un usuario en orden de inserción sin recorrer toda la tabla
+    [
+        'CREATE INDEX IF NOT EXISTS idx_messages_user_id ON messages (user_id, id)',
+    ],
+    # Búsqueda de texto completo sobre el historial. El índice FTS5 toma el
+    # contenido de messages (no lo duplica) y se mantiene con triggers. La
+    # columna user_id se indexa para filtrar por usuario dentro del propio índice.
+    [
+        '''CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+               content,
+               user_id,
+               content='messages',
+               content_rowid='id',
+               tokenize='unicode61 remove_diacritics 2'
+           )''',
+        '''CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages BEGIN
+               INSERT INTO messages_fts (rowid, content, user_id)
+               VALUES (new.id, new.content, new.user_id);
+           END''',
+        '''CREATE TRIGGER IF NOT EXISTS messages_fts_delete AFTER DELETE ON messages BEGIN
+               INSERT INTO messages_fts (messages_fts, rowid, content, user_id)
+               VALUES ('delete', old.id, old.content, old.user_id);
+           END''',
+        '''CREATE TRIGGER IF NOT EXISTS messages_fts_update AFTER UPDATE ON messages BEGIN
+               INSERT INTO messages_fts (messages_fts, rowid, content, user_id)
+               VALUES ('delete', old.id, old.content, old.user_id);
+               INSERT INTO messages_fts (rowid, content, user_id)
+               VALUES (new.id, new.content, new.user_id);
+           END''',
+        # Indexar los mensajes que ya existían
+        "INSERT INTO messages_fts (messages_fts) VALUES ('rebuild')",
+    ],
+    # Varias conversaciones por usuario. Los mensajes existentes pasan a una
+    # conversación por usuario y el historial se lee por (conversation_id, id).
+    [
+        '''CREATE TABLE IF NOT EXISTS conversations (
+               id INTEGER PRIMARY KEY AUTOINCREMENT,
+               user_id INTEGER NOT NULL,
+               title TEXT NOT NULL,
+               created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+               updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+               FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE
+           )''',
+        'CREATE INDEX IF NOT EXISTS idx_conversations_user ON conversations (user_id, updated_at)',
+        'ALTER TABLE messages ADD COLUMN conversation_id INTEGER REFERENCES conversations (id)',
+        'CREATE INDEX IF NOT EXISTS idx_messages_conversation ON messages (conversation_id, id)',
+        # El índice FTS solo depende del contenido y del usuario: asignar la
+        # conversación a los mensajes no debe reindexarlos
+        'DROP TRIGGER IF EXISTS messages_fts_update',
+        '''CREATE TRIGGER IF NOT EXISTS messages_fts_update
+           AFTER UPDATE OF content, user_id ON messages BEGIN
+               INSERT INTO messages_fts (messages_fts, rowid, content, user_id)
+               VALUES ('delete', old.id, old.content, old.user_id);
+               INSERT INTO messages_fts (rowid, content, user_id)
+               VALUES (new.id, new.content, new.user_id);
+           END''',
+        '''INSERT INTO conversations (user_id, title, created_at, updated_at)
+           SELECT user_id, 'Conversación anterior', MIN(timestamp), MAX(timestamp)
+           FROM messages
+           GROUP BY user_id''',
+        '''UPDATE messages
+           SET conversation_id = (
+               SELECT c.id FROM conversations c WHERE c.user_id = messages.user_id
+           )
+           WHERE conversation_id IS NULL''',
+        '''UPDATE user_stats
+           SET total_chats = (
+               SELECT COUNT(*) FROM conversations c WHERE c.user_id = user_stats.user_id
+           )''',
+    ],
+    # Resumen incremental de la parte antigua de cada conversación
+    [
+        '''CREATE TABLE IF NOT EXISTS conversation_summaries (
+               conversation_id INTEGER PRIMARY KEY,
+               summary TEXT NOT NULL,
+               message_count INTEGER NOT NULL,
+               updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+               FOREIGN KEY (conversation_id) REFERENCES conversations (id) ON DELETE CASCADE
+           )''',
+    ],
+    # Vectores para la búsqueda semántica, en una tabla aparte para no
+    # engordar las filas de messages que recorre la paginación del historial
+    [
+        '''CREATE TABLE IF NOT EXISTS message_embeddings (
+               message_id INTEGER PRIMARY KEY,
+               user_id INTEGER NOT NULL,
+               embedding BLOB NOT NULL,
+               FOREIGN KEY (message_id) REFERENCES messages (id) ON DELETE CASCADE
+           )''',
+        'CREATE INDEX IF NOT EXISTS idx_message_embeddings_user ON message_embeddings (user_id, message_id)',
+        '''CREATE TRIGGER IF NOT EXISTS message_embeddings_delete AFTER DELETE ON messages BEGIN
+               DELETE FROM message_embeddings WHERE message_id = old.id;
+           END''',
+    ],
+    # Ajustes de la aplicación (por ejemplo, la clave de firma de las sesiones)
+    [
+        '''CREATE TABLE IF NOT EXISTS app_settings (
+               key TEXT PRIMARY KEY,
+               value TEXT NOT NULL
+           )''',
+    ],
+    # Selector de usuarios: orden alfabético sin distinguir mayúsculas,
+    # búsqueda por prefijo y paginación por clave (username, id)
+    [
+        'CREATE INDEX IF NOT EXISTS idx_users_username_nocase ON users (username COLLATE NOCASE, id)',
+    ],
+    # Estadísticas mantenidas por triggers: total de mensajes de cada usuario
+    # y resumen diario (mensajes, caracteres y tokens estimados por día UTC)
+    [
+        '''CREATE TABLE IF NOT EXISTS user_daily_stats (
+               user_id INTEGER NOT NULL,
+               day TEXT NOT NULL,
+               messages INTEGER NOT NULL DEFAULT 0,
+               characters INTEGER NOT NULL DEFAULT 0,
+               tokens INTEGER NOT NULL DEFAULT 0,
+               PRIMARY KEY (user_id, day)
+           ) WITHOUT ROWID''',
+        # Tokens estimados igual que conversation.estimate_tokens
+        f'''CREATE TRIGGER IF NOT EXISTS messages_stats_insert AFTER INSERT ON messages BEGIN
+               INSERT OR IGNORE INTO user_stats (user_id) VALUES (new.user_id);
+               UPDATE user_stats SET total_messages = total_messages + 1 WHERE user_id = new.user_id;
+               INSERT INTO user_daily_stats (user_id, day, messages, characters, tokens)
+               VALUES (new.user_id, date(new.timestamp), 1, length(new.content), {SQL_TOKEN_ESTIMATE.format(content='new.content')})
+               ON CONFLICT (user_id, day) DO UPDATE SET
+                   messages = messages + 1,
+                   characters = characters + excluded.characters,
+                   tokens = tokens + excluded.tokens;
+           END''',
+        f'''CREATE TRIGGER IF NOT EXISTS messages_stats_delete AFTER DELETE ON messages BEGIN
+               UPDATE user_stats SET total_messages = total_messages - 1 WHERE user_id = old.user_id;
+               UPDATE user_daily_stats SET
+                   messages = messages - 1,
+                   characters = characters - length(old.content),
+                   tokens = tokens - {SQL_TOKEN_ESTIMATE.format(content='old.content')}
+               WHERE user_id = old.user_id AND day = date(old.timestamp);
+           END''',
+        # Corregir los contadores que se hubieran desviado y rellenar el resumen diario
+        '''UPDATE user_stats SET total_messages = (
+               SELECT COUNT(*) FROM messages m WHERE m.user_id = user_stats.user_id
+           )''',
+        f'''INSERT OR REPLACE INTO user_daily_stats (user_id, day, messages, characters, tokens)
+           SELECT user_id, date(timestamp), COUNT(*), SUM(length(content)),
+                  SUM({SQL_TOKEN_ESTIMATE.format(content='content')})
+           FROM messages
+           GROUP BY user_id, date(timestamp)''',
+    ],
+    # Versión de los tokens de sesión de cada usuario: al cerrar sesión se
+    # incrementa y los tokens recordados en cualquier dispositivo dejan de valer
+    [
+        'ALTER TABLE users ADD COLUMN session_version INTEGER NOT NULL DEFAULT 0',
+    ],
+]
+
+# Carácter mayor que cualquier otro: cota superior de una búsqueda por prefijo
+PREFIX_UPPER_BOUND = '\U0010ffff'
+
+# Título de las conversaciones nuevas hasta que se les pone uno
+DEFAULT_CONVERSATION_TITLE = 'Nueva conversación'
+
+# Caracteres de la vista previa del último mensaje de cada conversación
+CONVERSATION_PREVIEW_CHARS = 80
+
+# Marcas que rodean los términos encontrados en los fragmentos de búsqueda
+SNIPPET_START = '«'
+SNIPPET_END = '»'
+
+# Palabras de contexto que muestra cada fragmento de búsqueda
+SNIPPET_TOKENS = 12
+
+# Garantías de durabilidad de las escrituras diferidas:
+# - buffered: vuelve al encolar; se pierde si el proceso muere antes del volcado
+# - committed: espera al COMMIT del lote (sobrevive a un cierre del proceso)
+# - synced: espera al COMMIT con synchronous=FULL (sobrevive a un corte de luz)
+DURABILITY_BUFFERED = 'buffered'
+DURABILITY_COMMITTED = 'committed'
+DURABILITY_SYNCED = 'synced'
+
+# El escritor vuelca un lote al llegar a este número de operaciones...
+WRITE_BATCH_SIZE = 256
+# ...o cuando la operación más antigua lleva este tiempo encolada (segundos)
+WRITE_FLUSH_INTERVAL = 0.05
+
+# Variables de entorno con la dirección y la clave (en hexadecimal) del
+# proceso escritor compartido (ver RemoteWriteQueue y db_writer.py)
+WRITER_ADDRESS_ENV = 'CHATBOT_WRITER_ADDRESS'
+WRITER_AUTHKEY_ENV = 'CHATBOT_WRITER_AUTHKEY'
+
+# Perfiles de usuario que se mantienen en memoria como máximo
+PROFILE_CACHE_SIZE = 1024
+
+# Segundos que un perfil en caché se da por válido. Con varios procesos
+# (deploy.py) cada uno tiene su caché y no ve los cambios de los demás
+PROFILE_CACHE_TTL = 30.0
+
+# Perfil de un usuario sin fila en user_profiles/user_stats
+DEFAULT_PROFILE = {
+    'avatar_id': 1,
+    'theme_preference': 'dark',
+    'total_messages': 0,
+    'total_chats': 0,
+    'last_login': None,
+    'created_at': None,
+}
+
+
+class _PendingWrite:
+    """Operación encolada para el escritor en segundo plano."""
+    
+    __slots__ = ('kind', 'args', 'durability', 'done', 'ok')
+    
+    def __init__(self, kind: str, args: tuple = (), durability: str = DURABILITY_BUFFERED):
+        """
+        Args:
+            kind: 'message', 'flush' o 'stop'
+            args: Argumentos de la operación
+            durability: Garantía que espera quien encola la operación
+        """
+        self.kind = kind
+        self.args = args
+        self.durability = durability
+        # Solo se espera a las operaciones que no son 'buffered'
+        self.done = threading.Event() if durability != DURABILITY_BUFFERED else None
+        self.ok = False
+    
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """Espera a que se escriba el lote de la operación y devuelve si tuvo éxito."""
+        if self.done is None:
+            return True
+        return self.done.wait(timeout) and self.ok
+
+
+class WriteBehindQueue:
+    """
+    Cola de escritura diferida para mensajes.
+    
+    Un hilo de fondo agrupa las inserciones de todas las sesiones en una
+    sola transacción, de modo que muchas escrituras comparten un único
+    COMMIT (y un único fsync).
+    """
+    
+    def __init__(
+        self,
+        db: "Database",
+        max_batch: int = WRITE_BATCH_SIZE,
+        flush_interval: float = WRITE_FLUSH_INTERVAL
+    ):
+        """
+        Inicializa la cola y arranca el hilo escritor.
+        
+        Args:
+            db: Base de datos en la que escribir
+            max_batch: Operaciones máximas por transacción
+            flush_interval: Segundos máximos que una operación espera en cola
+        """
+        self.db = db
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self._queue: "queue.Queue[_PendingWrite]" = queue.Queue()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="db-writer", daemon=True)
+        self._thread.start()
+    
+    def _put(self, item: _PendingWrite) -> bool:
+        """Encola una operación y espera según su durabilidad."""
+        if self._closed:
+            print("Error al guardar: la cola de escritura está cerrada")
+            return False
+        self._queue.put(item)
+        return item.wait()
+    
+    def put_message(
+        self,
+        user_id: int,
+        role: str,
+        content: str,
+        durability: str = DURABILITY_BUFFERED,
+        conversation_id: Optional[int] = None
+    ) -> bool:
+        """
+        Encola la inserción de un mensaje.
+        
+        Args:
+            user_id: ID del usuario
+            role: Rol del mensaje ('user' o 'assistant')
+            content: Contenido del mensaje
+            durability: Garantía a esperar antes de volver
+            conversation_id: Conversación del mensaje
+        
+        Returns:
+            True si se encoló (o guardó, según la durabilidad) correctamente
+        """
+        return self._put(
+            _PendingWrite('message', (user_id, role, content, conversation_id), durability)
+        )
+    
+    def flush(self, durability: str = DURABILITY_COMMITTED) -> bool:
+        """
+        Espera a que se escriban todas las operaciones encoladas hasta ahora.
+        
+        Returns:
+            True si todos los lotes se guardaron correctamente
+        """
+        if self._closed:
+            return True
+        return self._put(_PendingWrite('flush', durability=durability))
+    
+    def close(self):
+        """Vuelca lo pendiente y detiene el hilo escritor."""
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(_PendingWrite('stop', durability=DURABILITY_COMMITTED))
+        self._thread.join()
+    
+    def _next_batch(self) -> List[_PendingWrite]:
+        """Espera a la primera operación y reúne el resto del lote."""
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.flush_interval
+        # Si alguien espera al COMMIT se vuelca ya con lo que haya en cola
+        urgent = batch[0].done is not None
+        
+        while len(batch) < self.max_batch:
+            timeout = 0 if urgent else deadline - time.monotonic()
+            try:
+                item = self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            batch.append(item)
+            urgent = urgent or item.done is not None
+        return batch
+    
+    def _run(self):
+        """Bucle del hilo escritor."""
+        while True:
+            batch = self._next_batch()
+            ok = self._write_batch(batch)
+            for item in batch:
+                item.ok = ok
+                if item.done is not None:
+                    item.done.set()
+            if any(item.kind == 'stop' for item in batch):
+                break
+    
+    def _write_batch(self, batch: List[_PendingWrite]) -> bool:
+        """Escribe un lote en una sola transacción."""
+        messages = [item.args for item in batch if item.kind == 'message']
+        if not messages:
+            return True
+        
+        conn = self.db.get_connection()
+        synced = any(item.durability == DURABILITY_SYNCED for item in batch)
+        try:
+            if synced:
+                conn.execute('PRAGMA synchronous = FULL')
+            # Incluye el COMMIT: es lo que espera quien pide DURABILITY_COMMITTED
+            with metrics.span('db_write', rows=len(messages)), self.db.transaction() as cursor:
+                cursor.executemany(
+                    '''INSERT INTO messages (user_id, role, content, conversation_id)
+                       VALUES (?, ?, ?, ?)''',
+                    messages
+                )
+                self.db._touch_conversations(cursor, {args[3] for args in messages})
+            return True
+        
+        except sqlite3.Error as e:
+            print(f"Error al guardar lote de {len(batch)} escrituras: {e}")
+            return False
+        
+        finally:
+            if synced:
+                conn.execute('PRAGMA synchronous = NORMAL')
+
+
+def parse_writer_address(address: str) -> Union[str, Tuple[str, int]]:
+    """
+    Convierte la dirección del proceso escritor al formato de multiprocessing.
+    
+    Args:
+        address: 'host:puerto' para TCP o la ruta de un socket Unix
+    
+    Returns:
+        Tupla (host, puerto) o la ruta tal cual
+    """
+    host, separator, port = address.rpartition(':')
+    if separator and port.isdigit() and '/' not in address:
+        return host, int(port)
+    return address
+
+
+class RemoteWriteQueue:
+    """
+    Cola de escritura diferida atendida por otro proceso (ver db_writer.py).
+    
+    Tiene los mismos métodos que WriteBehindQueue. Con varios procesos de
+    la aplicación, todos envían sus mensajes a un único proceso escritor,
+    que los agrupa en las mismas transacciones en lugar de competir por el
+    bloqueo de escritura de SQLite. Solo se envían los mensajes; el resto
+    de escrituras se hacen en el propio proceso. Cada hilo usa su propia
+    conexión.
+    """
+    
+    def __init__(self, address: str, authkey: bytes):
+        """
+        Inicializa la cola (las conexiones se abren al usarlas).
+        
+        Args:
+            address: Dirección del proceso escritor ('host:puerto' o socket Unix)
+            authkey: Clave compartida con el proceso escritor
+        """
+        self.address = parse_writer_address(address)
+        self.authkey = authkey
+        self._local = threading.local()
+        self._connections = []
+        self._connections_lock = threading.Lock()
+        self._closed = False
+    
+    def _connection(self):
+        """Conexión del hilo actual con el proceso escritor."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = Client(self.address, authkey=self.authkey)
+            self._local.conn = conn
+            with self._connections_lock:
+                self._connections.append(conn)
+        return conn
+    
+    def _request(self, kind: str, args: tuple, durability: str) -> bool:
+        """
+        Envía una operación y espera la respuesta del proceso escritor.
+        
+        También las operaciones 'buffered' esperan respuesta: así, al volver,
+        el mensaje ya está en la cola del escritor y un flush() posterior
+        desde cualquier hilo o proceso lo incluye.
+        """
+        if self._closed:
+            print("Error al guardar: la cola de escritura está cerrada")
+            return False
+        try:
+            conn = self._connection()
+            conn.send((kind, args, durability))
+            return conn.recv()
+        
+        except (OSError, EOFError, AuthenticationError) as e:
+            # La próxima operación del hilo abrirá una conexión nueva
+            conn = getattr(self._local, 'conn', None)
+            self._local.conn = None
+            if conn is not None:
+                conn.close()
+            print(f"Error al comunicar con el proceso escritor: {e}")
+            return False
+    
+    def put_message(
+        self,
+        user_id: int,
+        role: str,
+        content: str,
+        durability: str = DURABILITY_BUFFERED,
+        conversation_id: Optional[int] = None
+    ) -> bool:
+        """Encola la inserción de un mensaje (ver WriteBehindQueue.put_message)."""
+        return self._request('message', (user_id, role, content, conversation_id), durability)
+    
+    def flush(self, durability: str = DURABILITY_COMMITTED) -> bool:
+        """Espera a que el escritor guarde todo lo encolado hasta ahora."""
+        if self._closed:
+            return True
+        return self._request('flush', (), durability)
+    
+    def close(self):
+        """Vuelca lo pendiente y cierra las conexiones (el proceso escritor sigue)."""
+        if self._closed:
+            return
+        self.flush()
+        self._closed = True
+        with self._connections_lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            conn.close()
+
+
+class ProfileCache:
+    """
+    Perfiles de usuario (avatar, tema y estadísticas) en memoria.
+    
+    Database los carga con una sola consulta y los actualiza en cada
+    escritura, de modo que leer el perfil de un usuario activo no toca disco.
+    La caché es de cada proceso: los perfiles caducan a los ttl segundos
+    para recoger los cambios hechos desde otros procesos de la aplicación.
+    """
+    
+    def __init__(
+        self,
+        max_entries: int = PROFILE_CACHE_SIZE,
+        ttl: float = PROFILE_CACHE_TTL,
+        clock: Callable[[], float] = time.monotonic
+    ):
+        """
+        Inicializa la caché vacía.
+        
+        Args:
+            max_entries: Perfiles como máximo (se descartan los menos usados)
+            ttl: Segundos que un perfil se da por válido desde que se carga
+            clock: Reloj monotónico en segundos
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._clock = clock
+        self._profiles: "OrderedDict[int, Dict]" = OrderedDict()
+        self._expires_at: Dict[int, float] = {}
+        # Reentrante: Database carga el perfil de la BD sin soltarlo
+        self.lock = threading.RLock()
+    
+    def get(self, user_id: int) -> Optional[Dict]:
+        """Obtiene el perfil en caché de un usuario, o None si no está o ha caducado."""
+        with self.lock:
+            profile = self._profiles.get(user_id)
+            if profile is None:
+                return None
+            if self._expires_at[user_id] <= self._clock():
+                self.invalidate(user_id)
+                return None
+            self._profiles.move_to_end(user_id)
+            return profile
+    
+    def put(self, user_id: int, profile: Dict):
+        """Guarda el perfil de un usuario."""
+        with self.lock:
+            self._profiles[user_id] = profile
+            self._profiles.move_to_end(user_id)
+            self._expires_at[user_id] = self._clock() + self.ttl
+            while len(self._profiles) > self.max_entries:
+                evicted, _ = self._profiles.popitem(last=False)
+                del self._expires_at[evicted]
+    
+    def update(self, user_id: int, **fields):
+        """Actualiza campos del perfil si está en caché."""
+        with self.lock:
+            profile = self._profiles.get(user_id)
+            if profile is not None:
+                profile.update(fields)
+    
+    def add_stat(self, user_id: int, column: str, amount: int = 1):
+        """Suma a un contador de estadísticas si el perfil está en caché."""
+        with self.lock:
+            profile = self._profiles.get(user_id)
+            if profile is not None:
+                profile[column] += amount
+    
+    def invalidate(self, user_id: int):
+        """Descarta el perfil de un usuario."""
+        with self.lock:
+            self._profiles.pop(user_id, None)
+            self._expires_at.pop(user_id, None)
 
 
 class Database:
     """Clase para gestionar la base de datos SQLite."""
     
-    def __init__(self, db_path: str = "chatbot.db"):
+    def __init__(
+        self,
+        db_path: str = "chatbot.db",
+        write_behind: bool = False,
+        writer_address: Optional[str] = None,
+        writer_authkey: Optional[bytes] = None
+    ):
         """
         Inicializa la conexión a la base de datos.
         
+        Las conexiones se abren una sola vez por hilo y se reutilizan en
+        todas las llamadas posteriores, conservando la caché de sentencias
+        preparadas y la caché de páginas de SQLite.
+        
         Args:
             db_path: Ruta al archivo de base de datos
+            write_behind: Guardar mensajes a través de una
+                cola de escritura diferida (ver WriteBehindQueue)
+            writer_address: Dirección de un proceso escritor compartido;
+                si se indica, los mensajes se guardan a través de él
+                (ver RemoteWriteQueue) en lugar de con write_behind
+            writer_authkey: Clave del proceso escritor
         """
         self.db_path = db_path
+        self._session_secret: Optional[bytes] = None
+        self.profiles = ProfileCache()
+        self._local = threading.local()
+        self._connections: List[sqlite3.Connection] = []
+        self._connections_lock = threading.Lock()
         self.create_tables()
+        self.migrate()
+        if writer_address:
+            self.writer = RemoteWriteQueue(writer_address, writer_authkey or b'')
+        else:
+            self.writer = WriteBehindQueue(self) if write_behind else None
     
-    def get_connection(self) -> sqlite3.Connection:
-        """Obtiene una nueva conexión a la base de datos."""
-        conn = sqlite3.connect(self.db_path)
+    def _connect(self) -> sqlite3.Connection:
+        """Abre una conexión nueva configurada para este módulo."""
+        conn = sqlite3.connect(
+            self.db_path,
+            check_same_thread=False,
+            cached_statements=STATEMENT_CACHE_SIZE,
+        )
         conn.row_factory = sqlite3.Row
+        for pragma in CONNECTION_PRAGMAS:
+            conn.execute(pragma)
         return conn
     
+    def get_connection(self) -> sqlite3.Connection:
+        """
+        Obtiene la conexión del hilo actual.
+        
+        La primera llamada desde cada hilo abre la conexión; las siguientes
+        devuelven la misma. No debe cerrarse manualmente: usa close().
+        """
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._connect()
+            self._local.conn = conn
+            with self._connections_lock:
+                self._connections.append(conn)
+        return conn
+    
+    def release_connection(self):
+        """
+        Cierra la conexión del hilo actual, si la tiene.
+        
+        Cada conexión reserva su caché de páginas y su mapa de memoria: los
+        hilos de corta duración (resúmenes, borrados, clientes del escritor)
+        deben llamarlo al terminar para no dejarla abierta hasta close().
+        """
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            return
+        self._local.conn = None
+        with self._connections_lock:
+            if conn in self._connections:
+                self._connections.remove(conn)
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+    
+    @contextmanager
+    def transaction(self) -> Iterator[sqlite3.Cursor]:
+        """
+        Ejecuta un bloque dentro de una transacción.
+        
+        Confirma los cambios al salir del bloque y los deshace si se produce
+        una excepción. Las transacciones anidadas forman parte de la exterior.
+        
+        Yields:
+            Cursor sobre la conexión del hilo actual
+        """
+        conn = self.get_connection()
+        depth = getattr(self._local, 'depth', 0)
+        if depth == 0:
+            # Reservar el bloqueo de escritura desde el inicio evita
+            # interbloqueos al pasar de lectura a escritura en modo WAL
+            conn.execute('BEGIN IMMEDIATE')
+        self._local.depth = depth + 1
+        try:
+            yield conn.cursor()
+            if depth == 0:
+                conn.commit()
+        except BaseException:
+            if depth == 0:
+                conn.rollback()
+            raise
+        finally:
+            self._local.depth = depth
+    
+    @property
+    def shards(self) -> List["Database"]:
+        """Archivos donde se guardan los mensajes (uno; ver ShardedDatabase)."""
+        return [self]
+    
+    def flush(self, durability: str = DURABILITY_COMMITTED) -> bool:
+        """
+        Espera a que se guarden las escrituras diferidas pendientes.
+        
+        Args:
+            durability: Garantía a esperar (DURABILITY_COMMITTED o DURABILITY_SYNCED)
+        
+        Returns:
+            True si no había escrituras pendientes o se guardaron correctamente
+        """
+        if self.writer is None:
+            return True
+        return self.writer.flush(durability)
+    
+    def close(self):
+        """Vuelca las escrituras pendientes y cierra todas las conexiones."""
+        if self.writer is not None:
+            self.writer.close()
+        with self._connections_lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+        self._local = threading.local()
+    
     def create_tables(self):
         """Crea las tablas necesarias si no existen."""
+        with self.transaction() as cursor:
+            # Tabla de usuarios
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS users (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    username TEXT UNIQUE NOT NULL,
+                    password_hash TEXT NOT NULL,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+            
+            # Tabla de mensajes
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS messages (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id INTEGER NOT NULL,
+                    role TEXT NOT NULL,
+                    content TEXT NOT NULL,
+                    timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE
+                )
+            ''')
+            
+            # Tabla de perfiles de usuario
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS user_profiles (
+                    user_id INTEGER PRIMARY KEY,
+                    avatar_id INTEGER DEFAULT 1,
+                    theme_preference TEXT DEFAULT 'dark',
+                    FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+                )
+            ''')
+            
+            # Tabla de estadísticas de usuario
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS user_stats (
+                    user_id INTEGER PRIMARY KEY,
+                    total_messages INTEGER DEFAULT 0,
+                    total_chats INTEGER DEFAULT 0,
+                    last_login TIMESTAMP,
+                    FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+                )
+            ''')
+    
+    def migrate(self):
+        """
+        Aplica las migraciones de esquema pendientes.
+        
+        Varios procesos pueden abrir la base de datos a la vez (deploy.py),
+        así que cada migración vuelve a leer user_version dentro de su
+        transacción y se salta si otro proceso ya la ha aplicado.
+        """
+        conn = self.get_connection()
+        if conn.execute('PRAGMA user_version').fetchone()[0] >= len(MIGRATIONS):
+            return
+        
+        while True:
+            with self.transaction() as cursor:
+                version = cursor.execute('PRAGMA user_version').fetchone()[0]
+                if version >= len(MIGRATIONS):
+                    return
+                for statement in MIGRATIONS[version]:
+                    cursor.execute(statement)
+                cursor.execute(f'PRAGMA user_version = {version + 1}')
+    
+    def enable_incremental_vacuum(self) -> bool:
+        """
+        Activa el vaciado incremental en una base de datos creada sin él.
+        
+        Reescribe el archivo completo con VACUUM, así que solo conviene
+        ejecutarlo una vez y sin la aplicación abierta (por ejemplo, desde
+        init_db.py). Las bases de datos nuevas ya se crean con él activado.
+        
+        Returns:
+            True si el vaciado incremental queda activado
+        """
+        try:
+            conn = self.get_connection()
+            if conn.execute('PRAGMA auto_vacuum').fetchone()[0] != 2:
+                self.flush()
+                conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+                conn.execute('VACUUM')
+            return conn.execute('PRAGMA auto_vacuum').fetchone()[0] == 2
+        
+        except Exception as e:
+            print(f"Error al activar el vaciado incremental: {e}")
+            return False
+    
+    def incremental_vacuum(self, step_pages: int = VACUUM_STEP_PAGES, pause: float = PURGE_PAUSE) -> int:
+        """
+        Devuelve al sistema las páginas libres del archivo, por pasos.
+        
+        Cada paso es una transacción corta, así que puede ejecutarse con la
+        aplicación en uso, pero no dentro de transaction(). No hace nada si
+        la base de datos no tiene activado el vaciado incremental.
+        
+        Args:
+            step_pages: Páginas liberadas por paso
+            pause: Pausa entre pasos (segundos)
+        
+        Returns:
+            Número de páginas liberadas
+        """
         conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        # Tabla de usuarios
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS users (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                username TEXT UNIQUE NOT NULL,
-                password_hash TEXT NOT NULL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        # Tabla de mensajes
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS messages (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER NOT NULL,
-                role TEXT NOT NULL,
-                content TEXT NOT NULL,
-                timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE
-            )
-        ''')
-        
-        # Tabla de perfiles de usuario
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS user_profiles (
-                user_id INTEGER PRIMARY KEY,
-                avatar_id INTEGER DEFAULT 1,
-                theme_preference TEXT DEFAULT 'dark',
-                FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
-            )
-        ''')
-        
-        # Tabla de estadísticas de usuario
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS user_stats (
-                user_id INTEGER PRIMARY KEY,
-                total_messages INTEGER DEFAULT 0,
-                total_chats INTEGER DEFAULT 0,
-                last_login TIMESTAMP,
-                FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
-            )
-        ''')
-        
-        conn.commit()
-        conn.close()
+        if conn.execute('PRAGMA auto_vacuum').fetchone()[0] != 2:
+            return 0
+        
+        freed = 0
+        try:
+            while True:
+                free_pages = conn.execute('PRAGMA freelist_count').fetchone()[0]
+                if not free_pages:
+                    break
+                # execute() solo avanza un paso del pragma (una página);
+                # executescript() lo ejecuta completo en su propia transacción
+                conn.executescript(f'PRAGMA incremental_vacuum({int(step_pages)})')
+                step_freed = free_pages - conn.execute('PRAGMA freelist_count').fetchone()[0]
+                if step_freed <= 0:
+                    break
+                freed += step_freed
+                time.sleep(pause)
+        except Exception as e:
+            print(f"Error en el vaciado incremental: {e}")
+        return freed
+    
+    def _purge_messages(
+        self,
+        user_id: Optional[int] = None,
+        conversation_id: Optional[int] = None,
+        on_progress: Optional[ProgressCallback] = None,
+        batch_size: Optional[int] = None,
+        pause: float = PURGE_PAUSE
+    ) -> int:
+        """
+        Borra los mensajes de un usuario o de una conversación por lotes.
+        
+        Cada lote es una transacción corta con los mensajes de id más bajo,
+        de modo que el bloqueo de escritura se libera entre lotes y los
+        demás usuarios pueden seguir guardando mensajes. Los triggers
+        mantienen al día el índice FTS, los vectores y las estadísticas.
+        
+        Args:
+            user_id: ID del usuario (si no se indica conversación)
+            conversation_id: ID de la conversación
+            on_progress: Función llamada tras cada lote
+            batch_size: Mensajes por transacción (por defecto PURGE_BATCH_SIZE)
+            pause: Pausa mínima entre lotes (segundos)
+        
+        Returns:
+            Número de mensajes borrados
+        """
+        condition, value = self._history_filter(user_id, conversation_id)
+        # Solo los mensajes que ya existían: los que lleguen durante el borrado se conservan
+        total, last_id = self.get_connection().execute(
+            f'SELECT COUNT(*), MAX(id) FROM messages WHERE {condition}', (value,)
+        ).fetchone()
+        
+        deleted = 0
+        while deleted < total:
+            started = time.perf_counter()
+            with self.transaction() as cursor:
+                cursor.execute(
+                    f'''DELETE FROM messages WHERE id IN (
+                           SELECT id FROM messages WHERE {condition} AND id <= ?
+                           ORDER BY id LIMIT ?
+                       )''',
+                    (value, last_id, batch_size or PURGE_BATCH_SIZE)
+                )
+                count = cursor.rowcount
+            if count <= 0:
+                break
+            
+            deleted += count
+            if on_progress:
+                on_progress(deleted, total)
+            # Pausa al menos tan larga como el lote: los demás hilos esperan el
+            # bloqueo con reintentos espaciados y una pausa corta no les llega
+            time.sleep(max(pause, time.perf_counter() - started))
+        return deleted
+    
+    def create_user(self, username: str, password: str) -> Tuple[bool, str]:
+        """
+        Crea un nuevo usuario.
+        
+        Args:
+            username: Nombre de usuario
+            password: Contraseña en texto plano
+        
+        Returns:
+            Tupla (éxito, mensaje)
+        """
+        try:
+            # Hash de la contraseña (fuera de la transacción: es lento)
+            password_hash = hash_password(password)
+            
+            with self.transaction() as cursor:
+                # Verificar si el usuario ya existe
+                cursor.execute('SELECT id FROM users WHERE username = ?', (username,))
+                if cursor.fetchone():
+                    return False, "El usuario ya existe"
+                
+                # Insertar usuario
+                cursor.execute(
+                    'INSERT INTO users (username, password_hash) VALUES (?, ?)',
+                    (username, password_hash)
+                )
+            
+            return True, "Usuario creado exitosamente"
+        
+        except Exception as e:
+            return False, f"Error al crear usuario: {str(e)}"
+    
+    def delete_user(self, user_id: int, on_progress: Optional[ProgressCallback] = None) -> Tuple[bool, str]:
+        """
+        Elimina un usuario y todos sus mensajes.
+        
+        Los mensajes se borran por lotes (ver _purge_messages) y el resto de
+        datos del usuario en una última transacción corta.
+        
+        Args:
+            user_id: ID del usuario a eliminar
+            on_progress: Función llamada tras cada lote de mensajes borrados
+        
+        Returns:
+            Tupla (éxito, mensaje)
+        """
+        try:
+            # Que no queden inserciones diferidas del usuario por escribir
+            self.flush()
+            
+            # Verificar si el usuario existe
+            conn = self.get_connection()
+            if not conn.execute('SELECT id FROM users WHERE id = ?', (user_id,)).fetchone():
+                return False, "El usuario no existe"
+            
+            self._purge_messages(user_id=user_id, on_progress=on_progress)
+            
+            with self.transaction() as cursor:
+                # Eliminar primero los mensajes restantes y las conversaciones del usuario (por integridad referencial)
+                cursor.execute('DELETE FROM messages WHERE user_id = ?', (user_id,))
+                cursor.execute(
+                    '''DELETE FROM conversation_summaries
+                       WHERE conversation_id IN (SELECT id FROM conversations WHERE user_id = ?)''',
+                    (user_id,)
+                )
+                cursor.execute('DELETE FROM conversations WHERE user_id = ?', (user_id,))
+                cursor.execute('DELETE FROM user_daily_stats WHERE user_id = ?', (user_id,))
+                
+                # Luego eliminar el usuario
+                cursor.execute('DELETE FROM users WHERE id = ?', (user_id,))
+            
+            self.profiles.invalidate(user_id)
+            return True, "Usuario eliminado exitosamente"
+        
+        except Exception as e:
+            return False, f"Error al eliminar usuario: {str(e)}"
+    
+    def get_all_users(self) -> List[Dict[str, any]]:
+        """
+        Obtiene la lista de todos los usuarios registrados.
+        
+        Returns:
+            Lista de diccionarios con información de usuarios
+        """
+        try:
+            rows = self.get_connection().execute(
+                'SELECT id, username, created_at FROM users ORDER BY username ASC'
+            ).fetchall()
+            
+            users = [
+                {
+                    'id': row['id'],
+                    'username': row['username'],
+                    'created_at': row['created_at']
+                }
+                for row in rows
+            ]
+            
+            return users
+        
+        except Exception as e:
+            print(f"Error al obtener usuarios: {e}")
+            return []
+    
+    def get_users_page(
+        self,
+        prefix: str = '',
+        after: Optional[Tuple[str, int]] = None,
+        limit: int = 24
+    ) -> List[Dict[str, any]]:
+        """
+        Obtiene una página de usuarios en orden alfabético con su avatar.
+        
+        La paginación es por clave: cada página empieza justo después del
+        último usuario de la anterior, así que su coste no depende de cuántas
+        páginas se hayan cargado ya.
+        
+        Args:
+            prefix: Devolver solo usuarios cuyo nombre empieza por este texto
+                (sin distinguir mayúsculas)
+            after: Tupla (username, id) del último usuario de la página anterior
+            limit: Número máximo de usuarios
+        
+        Returns:
+            Lista de diccionarios con id, username, created_at y avatar_id
+        """
+        # La página siguiente empieza en el último usuario visto, que ya cumple el prefijo
+        lower = after[0] if after else prefix
+        last_username, last_id = after if after else ('', 0)
+        
+        try:
+            rows = self.get_connection().execute(
+                '''SELECT u.id, u.username, u.created_at, COALESCE(p.avatar_id, 1) AS avatar_id
+                   FROM users u
+                   LEFT JOIN user_profiles p ON p.user_id = u.id
+                   WHERE u.username COLLATE NOCASE >= ?
+                     AND u.username COLLATE NOCASE < ?
+                     AND (u.username COLLATE NOCASE, u.id) > (?, ?)
+                   ORDER BY u.username COLLATE NOCASE, u.id
+                   LIMIT ?''',
+                (lower, prefix + PREFIX_UPPER_BOUND, last_username, last_id, limit)
+            ).fetchall()
+            return [dict(row) for row in rows]
+        
+        except Exception as e:
+            print(f"Error al obtener usuarios: {e}")
+            return []
+    
+    def validate_user(self, username: str, password: str) -> Tuple[bool, Optional[int]]:
+        """
+        Valida las credenciales del usuario.
+        
+        Es lento (bcrypt): desde la UI debe llamarse con auth.run_in_background.
+        Si el hash se generó con otro coste de bcrypt, se regenera con el
+        configurado ahora que se conoce la contraseña.
+        
+        Args:
+            username: Nombre de usuario
+            password: Contraseña en texto plano
+        
+        Returns:
+            Tupla (válido, user_id o None)
+        """
+        try:
+            row = self.get_connection().execute(
+                'SELECT id, password_hash FROM users WHERE username = ?',
+                (username,)
+            ).fetchone()
+            
+            if not row:
+                return False, None
+            
+            user_id = row['id']
+            password_hash = row['password_hash']
+            
+            if not verify_password(password, password_hash):
+                return False, None
+            
+            if password_needs_rehash(password_hash):
+                # Hash nuevo fuera de la transacción: es lento
+                new_hash = hash_password(password)
+                with self.transaction() as cursor:
+                    cursor.execute(
+                        'UPDATE users SET password_hash = ? WHERE id = ?',
+                        (new_hash, user_id)
+                    )
+            
+            return True, user_id
+        
+        except Exception as e:
+            print(f"Error al validar usuario: {e}")
+            return False, None
+    
+    def get_session_secret(self) -> bytes:
+        """
+        Obtiene la clave con la que se firman los tokens de sesión.
+        
+        Se toma de la variable de entorno SESSION_SECRET o, si no existe,
+        de app_settings, donde se genera la primera vez.
+        
+        Returns:
+            Clave de firma
+        """
+        if self._session_secret is None:
+            secret = os.getenv('SESSION_SECRET')
+            if not secret:
+                with self.transaction() as cursor:
+                    cursor.execute(
+                        'INSERT OR IGNORE INTO app_settings (key, value) VALUES (?, ?)',
+                        ('session_secret', secrets.token_hex(32))
+                    )
+                    cursor.execute("SELECT value FROM app_settings WHERE key = 'session_secret'")
+                    secret = cursor.fetchone()['value']
+            self._session_secret = secret.encode('utf-8')
+        return self._session_secret
+    
+    def create_session(self, user_id: int) -> Optional[str]:
+        """
+        Genera un token de sesión para no pedir la contraseña al volver.
+        
+        Args:
+            user_id: ID del usuario autenticado
+        
+        Returns:
+            Token firmado, o None si hubo un error
+        """
+        try:
+            version = self.get_session_version(user_id)
+            if version is None:
+                return None
+            return create_session_token(user_id, self.get_session_secret(), version)
+        
+        except Exception as e:
+            print(f"Error al crear sesión: {e}")
+            return None
+    
+    def get_session_version(self, user_id: int) -> Optional[int]:
+        """
+        Obtiene la versión vigente de los tokens de sesión de un usuario.
+        
+        Args:
+            user_id: ID del usuario
+        
+        Returns:
+            Versión, o None si el usuario no existe
+        """
+        row = self.get_connection().execute(
+            'SELECT session_version FROM users WHERE id = ?', (user_id,)
+        ).fetchone()
+        return row['session_version'] if row else None
+    
+    def revoke_sessions(self, user_id: int) -> bool:
+        """
+        Invalida todos los tokens de sesión emitidos para un usuario.
+        
+        Args:
+            user_id: ID del usuario
+        
+        Returns:
+            True si se revocaron correctamente
+        """
+        try:
+            with self.transaction() as cursor:
+                cursor.execute(
+                    'UPDATE users SET session_version = session_version + 1 WHERE id = ?',
+                    (user_id,)
+                )
+            return True
+        
+        except Exception as e:
+            print(f"Error al revocar sesiones: {e}")
+            return False
+    
+    def validate_session(self, token: Optional[str]) -> Optional[int]:
+        """
+        Valida un token de sesión sin usar bcrypt.
+        
+        Args:
+            token: Token generado con create_session
+        
+        Returns:
+            ID del usuario, o None si el token no es válido, ha caducado,
+            está revocado o el usuario ya no existe
+        """
+        if not token:
+            return None
+        
+        try:
+            # get_session_version devuelve None si el usuario ya no existe
+            return verify_session_token(token, self.get_session_secret(), self.get_session_version)
+        
+        except Exception as e:
+            print(f"Error al validar sesión: {e}")
+            return None
+    
+    def save_message(
+        self,
+        user_id: int,
+        role: str,
+        content: str,
+        durability: str = DURABILITY_COMMITTED,
+        conversation_id: Optional[int] = None
+    ) -> bool:
+        """
+        Guarda un mensaje en la base de datos.
+        
+        Con escritura diferida el mensaje se escribe en el siguiente lote;
+        durability indica a qué esperar antes de volver. Los mensajes aún no
+        volcados no aparecen en las consultas hasta llamar a flush().
+        
+        Args:
+            user_id: ID del usuario
+            role: Rol del mensaje ('user' o 'assistant')
+            content: Contenido del mensaje
+            durability: DURABILITY_BUFFERED, DURABILITY_COMMITTED o DURABILITY_SYNCED
+            conversation_id: Conversación del mensaje
+        
+        Returns:
+            True si se guardó correctamente, False en caso contrario
+        """
+        # Los triggers de messages mantienen user_stats y user_daily_stats;
+        # la caché de perfiles se actualiza aquí
+        if self.writer is not None:
+            saved = self.writer.put_message(user_id, role, content, durability, conversation_id)
+            if saved:
+                self.profiles.add_stat(user_id, 'total_messages')
+            return saved
+        
+        try:
+            with metrics.span('db_write', rows=1), self.transaction() as cursor:
+                cursor.execute(
+                    '''INSERT INTO messages (user_id, role, content, conversation_id)
+                       VALUES (?, ?, ?, ?)''',
+                    (user_id, role, content, conversation_id)
+                )
+                self._touch_conversations(cursor, {conversation_id})
+            self.profiles.add_stat(user_id, 'total_messages')
+            return True
+        
+        except Exception as e:
+            print(f"Error al guardar mensaje: {e}")
+            return False
+    
+    @staticmethod
+    def _history_filter(user_id: int, conversation_id: Optional[int]) -> Tuple[str, int]:
+        """Condición SQL (y su valor) para leer el historial de un usuario o de una conversación."""
+        if conversation_id is not None:
+            return 'conversation_id = ?', conversation_id
+        return 'user_id = ?', user_id
+    
+    def get_user_messages(
+        self,
+        user_id: int,
+        limit: Optional[int] = None,
+        conversation_id: Optional[int] = None
+    ) -> List[Dict[str, str]]:
+        """
+        Obtiene los mensajes de un usuario.
+        
+        Args:
+            user_id: ID del usuario
+            limit: Límite de mensajes a recuperar (None para todos)
+            conversation_id: Leer solo esta conversación (None para todas)
+        
+        Returns:
+            Lista de diccionarios con los mensajes
+        """
+        where, key = self._history_filter(user_id, conversation_id)
+        try:
+            conn = self.get_connection()
+            
+            with metrics.span('history_read', query='recent'):
+                if limit:
+                    rows = conn.execute(
+                        f'''SELECT id, role, content, timestamp
+                            FROM messages
+                            WHERE {where}
+                            ORDER BY id DESC
+                            LIMIT ?''',
+                        (key, limit)
+                    ).fetchall()
+                else:
+                    rows = conn.execute(
+                        f'''SELECT id, role, content, timestamp
+                            FROM messages
+                            WHERE {where}
+                            ORDER BY id ASC''',
+                        (key,)
+                    ).fetchall()
+            
+            messages = [
+                {
+                    'id': row['id'],
+                    'role': row['role'],
+                    'content': row['content'],
+                    'timestamp': row['timestamp']
+                }
+                for row in rows
+            ]
+            
+            # Si usamos LIMIT, los mensajes vienen en orden descendente
+            if limit:
+                messages.reverse()
+            
+            return messages
+        
+        except Exception as e:
+            print(f"Error al obtener mensajes: {e}")
+            return []
+    
+    def get_messages_page(
+        self,
+        user_id: int,
+        before_id: Optional[int] = None,
+        limit: int = 50,
+        conversation_id: Optional[int] = None
+    ) -> List[Dict[str, str]]:
+        """
+        Obtiene una página del historial anterior a un mensaje dado.
+        
+        Pagina por id de mensaje (keyset), de modo que el coste no depende de
+        cuántas páginas se hayan cargado antes.
+        
+        Args:
+            user_id: ID del usuario
+            before_id: Devolver solo mensajes con id menor (None para la última página)
+            limit: Número máximo de mensajes de la página
+            conversation_id: Leer solo esta conversación (None para todas)
+            
+        Returns:
+            Lista de diccionarios con los mensajes en orden cronológico
+        """
+        # Sin referencia se parte del final (mayor id posible en SQLite)
+        if before_id is None:
+            before_id = 2 ** 63 - 1
+        
+        where, key = self._history_filter(user_id, conversation_id)
+        try:
+            with metrics.span('history_read', query='page'):
+                rows = self.get_connection().execute(
+                    f'''SELECT id, role, content, timestamp
+                        FROM messages
+                        WHERE {where} AND id < ?
+                        ORDER BY id DESC
+                        LIMIT ?''',
+                    (key, before_id, limit)
+                ).fetchall()
+            
+            messages = [
+                {
+                    'id': row['id'],
+                    'role': row['role'],
+                    'content': row['content'],
+                    'timestamp': row['timestamp']
+                }
+                for row in reversed(rows)
+            ]
+            
+            return messages
+        
+        except Exception as e:
+            print(f"Error al obtener mensajes: {e}")
+            return []
+    
+    def get_messages_after(
+        self,
+        user_id: int,
+        after_id: int,
+        limit: int = 50,
+        conversation_id: Optional[int] = None
+    ) -> List[Dict[str, str]]:
+        """
+        Obtiene una página del historial posterior a un mensaje dado.
+        
+        Args:
+            user_id: ID del usuario
+            after_id: Devolver solo mensajes con id mayor
+            limit: Número máximo de mensajes de la página
+            conversation_id: Leer solo esta conversación (None para todas)
+            
+        Returns:
+            Lista de diccionarios con los mensajes en orden cronológico
+        """
+        where, key = self._history_filter(user_id, conversation_id)
+        try:
+            with metrics.span('history_read', query='after'):
+                rows = self.get_connection().execute(
+                    f'''SELECT id, role, content, timestamp
+                        FROM messages
+                        WHERE {where} AND id > ?
+                        ORDER BY id ASC
+                        LIMIT ?''',
+                    (key, after_id, limit)
+                ).fetchall()
+            
+            messages = [
+                {
+                    'id': row['id'],
+                    'role': row['role'],
+                    'content': row['content'],
+                    'timestamp': row['timestamp']
+                }
+                for row in rows
+            ]
+            
+            return messages
+        
+        except Exception as e:
+            print(f"Error al obtener mensajes: {e}")
+            return []
+    
+    @staticmethod
+    def _fts_query(query: str) -> Optional[str]:
+        """
+        Convierte el texto escrito por el usuario en una consulta FTS5.
+        
+        Cada palabra se busca como término literal, sin operadores FTS5. No se
+        buscan prefijos: una consulta de prefijo combina las listas de todas
+        las palabras que empiezan igual y deja de ser rápida con tablas grandes.
+        """
+        words = re.findall(r'\w+', query)
+        if not words:
+            return None
+        return ' '.join(f'"{word}"' for word in words)
+    
+    def search_messages(self, user_id: int, query: str, limit: int = 20) -> List[Dict[str, str]]:
+        """
+        Busca en el historial de un usuario.
+        
+        Usa el índice FTS5: el coste depende de lo frecuentes que sean los
+        términos buscados, no del tamaño del historial.
+        
+        Args:
+            user_id: ID del usuario
+            query: Texto a buscar
+            limit: Número máximo de resultados
+        
+        Returns:
+            Lista de diccionarios (id, conversation_id, role, snippet, timestamp) ordenada por
+            relevancia; el snippet marca los términos con SNIPPET_START/SNIPPET_END
+        """
+        fts_query = self._fts_query(query)
+        if fts_query is None:
+            return []
+        
+        # Pendientes de la cola diferida incluidos en los resultados
+        self.flush()
+        
+        try:
+            # Primero se ordenan las coincidencias y solo después se generan los
+            # fragmentos, que son caros, para los resultados que se devuelven
+            rows = self.get_connection().execute(
+                '''WITH hits AS (
+                       SELECT rowid AS id, bm25(messages_fts, 1.0, 0.0) AS score
+                       FROM messages_fts
+                       WHERE messages_fts MATCH :query
+                       ORDER BY score
+                       LIMIT :limit
+                   )
+                   SELECT m.id, m.conversation_id, m.role, m.timestamp,
+                          snippet(messages_fts, 0, :start, :end, '…', :tokens) AS snippet
+                   FROM hits
+                   CROSS JOIN messages_fts ON messages_fts.rowid = hits.id
+                   JOIN messages m ON m.id = hits.id
+                   WHERE messages_fts MATCH :query
+                   ORDER BY hits.score''',
+                {
+                    'query': f'user_id : "{int(user_id)}" AND content : ({fts_query})',
+                    'limit': limit,
+                    'start': SNIPPET_START,
+                    'end': SNIPPET_END,
+                    'tokens': SNIPPET_TOKENS,
+                }
+            ).fetchall()
+            
+            results = [
+                {
+                    'id': row['id'],
+                    'conversation_id': row['conversation_id'],
+                    'role': row['role'],
+                    'snippet': row['snippet'],
+                    'timestamp': row['timestamp']
+                }
+                for row in rows
+            ]
+            
+            return results
+        
+        except Exception as e:
+            print(f"Error al buscar mensajes: {e}")
+            return []
+    
+    def clear_user_messages(self, user_id: int, on_progress: Optional[ProgressCallback] = None) -> bool:
+        """
+        Elimina todos los mensajes de un usuario, por lotes.
+        
+        Args:
+            user_id: ID del usuario
+            on_progress: Función llamada tras cada lote de mensajes borrados
+        
+        Returns:
+            True si se eliminaron correctamente, False en caso contrario
+        """
+        try:
+            self.flush()
+            self._purge_messages(user_id=user_id, on_progress=on_progress)
+            self.profiles.invalidate(user_id)
+            return True
+        
+        except Exception as e:
+            print(f"Error al eliminar mensajes: {e}")
+            return False
+    
+    def get_username(self, user_id: int) -> Optional[str]:
+        """
+        Obtiene el nombre de usuario por ID.
+        
+        Args:
+            user_id: ID del usuario
+        
+        Returns:
+            Nombre de usuario o None si no existe
+        """
+        try:
+            row = self.get_connection().execute(
+                'SELECT username FROM users WHERE id = ?', (user_id,)
+            ).fetchone()
+            
+            return row['username'] if row else None
+        
+        except Exception as e:
+            print(f"Error al obtener nombre de usuario: {e}")
+            return None
+    
+    # ===============================
+    # Funciones para Conversaciones
+    # ===============================
+    
+    def _touch_conversations(self, cursor: sqlite3.Cursor, conversation_ids):
+        """Marca como recién usadas las conversaciones que reciben mensajes."""
+        cursor.executemany(
+            'UPDATE conversations SET updated_at = CURRENT_TIMESTAMP WHERE id = ?',
+            [(conversation_id,) for conversation_id in conversation_ids if conversation_id is not None]
+        )
+    
+    def create_conversation(
+        self,
+        user_id: int,
+        title: str = DEFAULT_CONVERSATION_TITLE
+    ) -> Optional[int]:
+        """
+        Crea una conversación vacía y la cuenta en las estadísticas del usuario.
+        
+        Args:
+            user_id: ID del usuario
+            title: Título de la conversación
+        
+        Returns:
+            ID de la conversación o None si hubo un error
+        """
+        try:
+            with self.transaction() as cursor:
+                cursor.execute(
+                    'INSERT INTO conversations (user_id, title) VALUES (?, ?)',
+                    (user_id, title)
+                )
+                conversation_id = cursor.lastrowid
+                cursor.execute('INSERT OR IGNORE INTO user_stats (user_id) VALUES (?)', (user_id,))
+                cursor.execute(
+                    'UPDATE user_stats SET total_chats = total_chats + 1 WHERE user_id = ?',
+                    (user_id,)
+                )
+            self.profiles.add_stat(user_id, 'total_chats')
+            return conversation_id
+        
+        except Exception as e:
+            print(f"Error al crear conversación: {e}")
+            return None
+    
+    def get_conversations(self, user_id: int, limit: int = 100) -> List[Dict[str, str]]:
+        """
+        Obtiene las conversaciones de un usuario, de la más reciente a la más antigua.
+        
+        No incluye el contenido de los mensajes; las vistas previas se piden
+        aparte con get_conversation_previews.
+        
+        Args:
+            user_id: ID del usuario
+            limit: Número máximo de conversaciones
+        
+        Returns:
+            Lista de diccionarios con id, title y updated_at
+        """
+        try:
+            rows = self.get_connection().execute(
+                '''SELECT id, title, updated_at
+                   FROM conversations
+                   WHERE user_id = ?
+                   ORDER BY updated_at DESC, id DESC
+                   LIMIT ?''',
+                (user_id, limit)
+            ).fetchall()
+            
+            conversations = [
+                {
+                    'id': row['id'],
+                    'title': row['title'],
+                    'updated_at': row['updated_at']
+                }
+                for row in rows
+            ]
+            
+            return conversations
+        
+        except Exception as e:
+            print(f"Error al obtener conversaciones: {e}")
+            return []
     
-    def create_user(self, username: str, password: str) -> Tuple[bool, str]:
+    def get_conversation_previews(self, conversation_ids: List[int]) -> Dict[int, str]:
         """
-        Crea un nuevo usuario.
+        Obtiene el comienzo del último mensaje de varias conversaciones.
         
         Args:
-            username: Nombre de usuario
-            password: Contraseña en texto plano
-            
+            conversation_ids: IDs de las conversaciones
+        
         Returns:
-            Tupla (éxito, mensaje)
+            Diccionario {conversation_id: vista previa}; las conversaciones
+            sin mensajes no aparecen
         """
+        if not conversation_ids:
+            return {}
+        
+        placeholders = ', '.join('?' for _ in conversation_ids)
         try:
-            conn = self.get_connection()
-            cursor = conn.cursor()
-            
-            # Verificar si el usuario ya existe
-            cursor.execute('SELECT id FROM users WHERE username = ?', (username,))
-            if cursor.fetchone():
-                conn.close()
-                return False, "El usuario ya existe"
-            
-            # Hash de la contraseña
-            password_hash = hash_password(password)
-            
-            # Insertar usuario
-            cursor.execute(
-                'INSERT INTO users (username, password_hash) VALUES (?, ?)',
-                (username, password_hash)
-            )
-            conn.commit()
-            conn.close()
+            # Una búsqueda en el índice (conversation_id, id) por conversación
+            rows = self.get_connection().execute(
+                f'''SELECT c.id AS conversation_id,
+                           (SELECT substr(m.content, 1, ?)
+                            FROM messages m
+                            WHERE m.conversation_id = c.id
+                            ORDER BY m.id DESC
+                            LIMIT 1) AS preview
+                    FROM conversations c
+                    WHERE c.id IN ({placeholders})''',
+                (CONVERSATION_PREVIEW_CHARS, *conversation_ids)
+            ).fetchall()
             
-            return True, "Usuario creado exitosamente"
+            return {
+                row['conversation_id']: row['preview']
+                for row in rows
+                if row['preview'] is not None
+            }
         
         except Exception as e:
-            return False, f"Error al crear usuario: {str(e)}"
+            print(f"Error al obtener vistas previas: {e}")
+            return {}
+    
+    def rename_conversation(self, conversation_id: int, title: str) -> bool:
+        """Cambia el título de una conversación."""
+        try:
+            with self.transaction() as cursor:
+                cursor.execute(
+                    'UPDATE conversations SET title = ? WHERE id = ?',
+                    (title, conversation_id)
+                )
+            return True
+        except sqlite3.Error:
+            return False
+    
+    def _conversation_owner(self, conversation_id: int) -> Optional[int]:
+        """ID del usuario dueño de una conversación, o None si no existe."""
+        row = self.get_connection().execute(
+            'SELECT user_id FROM conversations WHERE id = ?', (conversation_id,)
+        ).fetchone()
+        return row['user_id'] if row else None
     
-    def delete_user(self, user_id: int) -> Tuple[bool, str]:
+    def clear_conversation_messages(
+        self,
+        conversation_id: int,
+        on_progress: Optional[ProgressCallback] = None
+    ) -> bool:
         """
-        Elimina un usuario y todos sus mensajes.
+        Elimina los mensajes de una conversación, por lotes, conservando la conversación.
         
         Args:
-            user_id: ID del usuario a eliminar
-            
+            conversation_id: ID de la conversación
+            on_progress: Función llamada tras cada lote de mensajes borrados
+        
         Returns:
-            Tupla (éxito, mensaje)
+            True si se eliminaron correctamente, False en caso contrario
         """
         try:
-            conn = self.get_connection()
-            cursor = conn.cursor()
-            
-            # Verificar si el usuario existe
-            cursor.execute('SELECT id FROM users WHERE id = ?', (user_id,))
-            if not cursor.fetchone():
-                conn.close()
-                return False, "El usuario no existe"
-            
-            # Eliminar primero todos los mensajes del usuario (por integridad referencial)
-            cursor.execute('DELETE FROM messages WHERE user_id = ?', (user_id,))
-            
-            # Luego eliminar el usuario
-            cursor.execute('DELETE FROM users WHERE id = ?', (user_id,))
-            
-            conn.commit()
-            conn.close()
-            
-            return True, "Usuario eliminado exitosamente"
+            self.flush()
+            self._purge_messages(conversation_id=conversation_id, on_progress=on_progress)
+            with self.transaction() as cursor:
+                cursor.execute('DELETE FROM conversation_summaries WHERE conversation_id = ?', (conversation_id,))
+            # Los triggers han restado los mensajes borrados de las estadísticas
+            self.profiles.invalidate(self._conversation_owner(conversation_id))
+            return True
         
         except Exception as e:
-            return False, f"Error al eliminar usuario: {str(e)}"
+            print(f"Error al eliminar mensajes: {e}")
+            return False
     
-    def get_all_users(self) -> List[Dict[str, any]]:
+    def delete_conversation(
+        self,
+        conversation_id: int,
+        on_progress: Optional[ProgressCallback] = None
+    ) -> bool:
         """
-        Obtiene la lista de todos los usuarios registrados.
+        Elimina una conversación y sus mensajes (estos, por lotes).
+        
+        Args:
+            conversation_id: ID de la conversación
+            on_progress: Función llamada tras cada lote de mensajes borrados
         
         Returns:
-            Lista de diccionarios con información de usuarios
+            True si se eliminó correctamente, False en caso contrario
         """
         try:
-            conn = self.get_connection()
-            cursor = conn.cursor()
-            
-            cursor.execute(
-                'SELECT id, username, created_at FROM users ORDER BY username ASC'
-            )
-            rows = cursor.fetchall()
-            conn.close()
-            
-            users = [
-                {
-                    'id': row['id'],
-                    'username': row['username'],
-                    'created_at': row['created_at']
-                }
-                for row in rows
-            ]
-            
-            return users
+            self.flush()
+            # El dueño se busca antes de borrar la conversación
+            user_id = self._conversation_owner(conversation_id)
+            self._purge_messages(conversation_id=conversation_id, on_progress=on_progress)
+            with self.transaction() as cursor:
+                cursor.execute('DELETE FROM messages WHERE conversation_id = ?', (conversation_id,))
+                cursor.execute('DELETE FROM conversation_summaries WHERE conversation_id = ?', (conversation_id,))
+                cursor.execute('DELETE FROM conversations WHERE id = ?', (conversation_id,))
+                if cursor.rowcount > 0:
+                    # Contrapartida de create_conversation
+                    cursor.execute(
+                        'UPDATE user_stats SET total_chats = MAX(total_chats - 1, 0) WHERE user_id = ?',
+                        (user_id,)
+                    )
+            self.profiles.invalidate(user_id)
+            return True
         
         except Exception as e:
-            print(f"Error al obtener usuarios: {e}")
-            return []
+            print(f"Error al eliminar conversación: {e}")
+            return False
     
-    def validate_user(self, username: str, password: str) -> Tuple[bool, Optional[int]]:
+    def count_conversation_messages(self, conversation_id: int) -> int:
+        """Cuenta los mensajes guardados de una conversación."""
+        try:
+            row = self.get_connection().execute(
+                'SELECT COUNT(*) FROM messages WHERE conversation_id = ?', (conversation_id,)
+            ).fetchone()
+            return row[0]
+        except sqlite3.Error:
+            return 0
+    
+    def get_conversation_summary(self, conversation_id: int) -> Optional[Dict]:
         """
-        Valida las credenciales del usuario.
+        Obtiene el resumen guardado de una conversación.
         
         Args:
-            username: Nombre de usuario
-            password: Contraseña en texto plano
-            
+            conversation_id: ID de la conversación
+        
         Returns:
-            Tupla (válido, user_id o None)
+            Diccionario con summary y message_count (mensajes que cubre, desde
+            el principio de la conversación), o None si no hay resumen
         """
         try:
-            conn = self.get_connection()
-            cursor = conn.cursor()
-            
-            cursor.execute(
-                'SELECT id, password_hash FROM users WHERE username = ?',
-                (username,)
-            )
-            row = cursor.fetchone()
-            conn.close()
+            row = self.get_connection().execute(
+                'SELECT summary, message_count FROM conversation_summaries WHERE conversation_id = ?',
+                (conversation_id,)
+            ).fetchone()
             
             if not row:
-                return False, None
-            
-            user_id = row['id']
-            password_hash = row['password_hash']
+                return None
             
-            if verify_password(password, password_hash):
-                return True, user_id
-            
-            return False, None
+            return {'summary': row['summary'], 'message_count': row['message_count']}
         
         except Exception as e:
-            print(f"Error al validar usuario: {e}")
-            return False, None
+            print(f"Error al obtener resumen: {e}")
+            return None
     
-    def save_message(self, user_id: int, role: str, content: str) -> bool:
+    def delete_conversation_summary(self, conversation_id: int) -> bool:
         """
-        Guarda un mensaje en la base de datos.
+        Elimina el resumen guardado de una conversación (por ejemplo, si está obsoleto).
         
         Args:
-            user_id: ID del usuario
-            role: Rol del mensaje ('user' o 'assistant')
-            content: Contenido del mensaje
-            
+            conversation_id: ID de la conversación
+        
         Returns:
-            True si se guardó correctamente, False en caso contrario
+            True si se eliminó correctamente, False en caso contrario
         """
         try:
-            conn = self.get_connection()
-            cursor = conn.cursor()
-            
-            cursor.execute(
-                'INSERT INTO messages (user_id, role, content) VALUES (?, ?, ?)',
-                (user_id, role, content)
-            )
-            
-            conn.commit()
-            conn.close()
+            with self.transaction() as cursor:
+                cursor.execute('DELETE FROM conversation_summaries WHERE conversation_id = ?', (conversation_id,))
             return True
         
         except Exception as e:
-            print(f"Error al guardar mensaje: {e}")
+            print(f"Error al eliminar resumen: {e}")
             return False
     
-    def get_user_messages(self, user_id: int, limit: Optional[int] = None) -> List[Dict[str, str]]:
+    def save_conversation_summary(self, conversation_id: int, summary: str, message_count: int) -> bool:
         """
-        Obtiene los mensajes de un usuario.
+        Guarda (o sustituye) el resumen de una conversación.
+        
+        El resumen se genera en segundo plano: si mientras tanto la
+        conversación se ha vaciado o borrado y ya no tiene los mensajes que
+        cubre, no se guarda.
         
         Args:
-            user_id: ID del usuario
-            limit: Límite de mensajes a recuperar (None para todos)
-            
+            conversation_id: ID de la conversación
+            summary: Texto del resumen
+            message_count: Mensajes que cubre, desde el principio de la conversación
+        
         Returns:
-            Lista de diccionarios con los mensajes
+            True si se guardó correctamente, False en caso contrario
         """
         try:
-            conn = self.get_connection()
-            cursor = conn.cursor()
-            
-            if limit:
+            # Los mensajes aún en la cola de escritura también cuentan
+            self.flush()
+            with self.transaction() as cursor:
                 cursor.execute(
-                    '''SELECT role, content, timestamp 
-                       FROM messages 
-                       WHERE user_id = ? 
-                       ORDER BY timestamp DESC 
-                       LIMIT ?''',
-                    (user_id, limit)
+                    '''INSERT INTO conversation_summaries (conversation_id, summary, message_count)
+                       SELECT ?, ?, ?
+                       WHERE (SELECT COUNT(*) FROM messages WHERE conversation_id = ?) >= ?
+                       ON CONFLICT (conversation_id) DO UPDATE SET
+                           summary = excluded.summary,
+                           message_count = excluded.message_count,
+                           updated_at = CURRENT_TIMESTAMP''',
+                    (conversation_id, summary, message_count, conversation_id, message_count)
                 )
-            else:
-                cursor.execute(
-                    '''SELECT role, content, timestamp 
-                       FROM messages 
-                       WHERE user_id = ? 
-                       ORDER BY timestamp ASC''',
-                    (user_id,)
-                )
-            
-            rows = cursor.fetchall()
-            conn.close()
-            
-            messages = [
-                {
-                    'role': row['role'],
-                    'content': row['content'],
-                    'timestamp': row['timestamp']
-                }
-                for row in rows
-            ]
-            
-            # Si usamos LIMIT, los mensajes vienen en orden descendente
-            if limit:
-                messages.reverse()
-            
-            return messages
+                return cursor.rowcount > 0
         
         except Exception as e:
-            print(f"Error al obtener mensajes: {e}")
+            print(f"Error al guardar resumen: {e}")
+            return False
+    
+    # ===============================
+    # Funciones para Búsqueda Semántica
+    # ===============================
+    
+    def get_unindexed_messages(
+        self,
+        after_id: int = 0,
+        limit: int = 256,
+        user_id: Optional[int] = None
+    ) -> List[Dict]:
+        """
+        Obtiene mensajes que aún no tienen vector, en orden de id.
+        
+        Args:
+            after_id: Devolver solo mensajes con id mayor
+            limit: Número máximo de mensajes
+            user_id: Devolver solo los de este usuario (None para todos)
+        
+        Returns:
+            Lista de diccionarios con id, user_id y content
+        """
+        user_filter = 'm.user_id = ? AND' if user_id is not None else ''
+        params = (user_id, after_id, limit) if user_id is not None else (after_id, limit)
+        try:
+            rows = self.get_connection().execute(
+                f'''SELECT m.id, m.user_id, m.content
+                    FROM messages m
+                    LEFT JOIN message_embeddings e ON e.message_id = m.id
+                    WHERE {user_filter} m.id > ? AND e.message_id IS NULL
+                    ORDER BY m.id
+                    LIMIT ?''',
+                params
+            ).fetchall()
+            return [dict(row) for row in rows]
+        
+        except Exception as e:
+            print(f"Error al obtener mensajes sin indexar: {e}")
             return []
     
-    def clear_user_messages(self, user_id: int) -> bool:
+    def save_embeddings(self, embeddings: List[Tuple[int, int, bytes]]) -> bool:
         """
-        Elimina todos los mensajes de un usuario.
+        Guarda los vectores de varios mensajes en una transacción.
         
         Args:
-            user_id: ID del usuario
-            
+            embeddings: Tuplas (message_id, user_id, vector float32 en bytes)
+        
         Returns:
-            True si se eliminaron correctamente, False en caso contrario
+            True si se guardaron correctamente, False en caso contrario
         """
         try:
-            conn = self.get_connection()
-            cursor = conn.cursor()
-            
-            cursor.execute('DELETE FROM messages WHERE user_id = ?', (user_id,))
-            
-            conn.commit()
-            conn.close()
+            with self.transaction() as cursor:
+                cursor.executemany(
+                    '''INSERT OR REPLACE INTO message_embeddings (message_id, user_id, embedding)
+                       VALUES (?, ?, ?)''',
+                    embeddings
+                )
             return True
         
         except Exception as e:
-            print(f"Error al eliminar mensajes: {e}")
+            print(f"Error al guardar vectores: {e}")
             return False
     
-    def get_username(self, user_id: int) -> Optional[str]:
+    def get_embeddings(self, user_id: int, after_id: int = 0) -> List[Tuple[int, bytes]]:
         """
-        Obtiene el nombre de usuario por ID.
+        Obtiene los vectores de los mensajes de un usuario.
         
         Args:
             user_id: ID del usuario
-            
+            after_id: Devolver solo los de mensajes con id mayor (para cargas incrementales)
+        
         Returns:
-            Nombre de usuario o None si no existe
+            Lista de tuplas (message_id, vector en bytes) en orden de id
         """
         try:
-            conn = self.get_connection()
-            cursor = conn.cursor()
-            
-            cursor.execute('SELECT username FROM users WHERE id = ?', (user_id,))
-            row = cursor.fetchone()
-            conn.close()
-            
-            return row['username'] if row else None
+            rows = self.get_connection().execute(
+                '''SELECT message_id, embedding
+                   FROM message_embeddings
+                   WHERE user_id = ? AND message_id > ?
+                   ORDER BY message_id''',
+                (user_id, after_id)
+            ).fetchall()
+            return [(row[0], row[1]) for row in rows]
         
         except Exception as e:
-            print(f"Error al obtener nombre de usuario: {e}")
-            return None
+            print(f"Error al obtener vectores: {e}")
+            return []
+    
+    def get_messages_by_ids(self, message_ids: List[int]) -> Dict[int, Dict[str, str]]:
+        """
+        Obtiene varios mensajes por su id.
+        
+        Args:
+            message_ids: IDs de los mensajes
+        
+        Returns:
+            Diccionario {id: mensaje}; los mensajes que ya no existen no aparecen
+        """
+        if not message_ids:
+            return {}
+        
+        placeholders = ', '.join('?' for _ in message_ids)
+        try:
+            rows = self.get_connection().execute(
+                f'''SELECT id, conversation_id, role, content, timestamp
+                    FROM messages
+                    WHERE id IN ({placeholders})''',
+                list(message_ids)
+            ).fetchall()
+            return {row['id']: dict(row) for row in rows}
+        
+        except Exception as e:
+            print(f"Error al obtener mensajes: {e}")
+            return {}
     
     # ===============================
     # Funciones para Perfiles de Usuario
     # ===============================
     
     def initialize_user_profile(self, user_id: int) -> bool:
-        """Inicializa el perfil de un usuario recién creado."""
+        """
+        Inicializa el perfil de un usuario (si no existe) y lo carga en la caché.
+        
+        Se llama al iniciar sesión: a partir de aquí avatar, tema y
+        estadísticas se leen de memoria.
+        """
         try:
-            conn = self.get_connection()
-            cursor = conn.cursor()
-            
-            cursor.execute('INSERT OR IGNORE INTO user_profiles (user_id) VALUES (?)', (user_id,))
-            cursor.execute('INSERT OR IGNORE INTO user_stats (user_id, last_login) VALUES (?, CURRENT_TIMESTAMP)', (user_id,))
-            
-            conn.commit()
-            conn.close()
+            with self.transaction() as cursor:
+                cursor.execute('INSERT OR IGNORE INTO user_profiles (user_id) VALUES (?)', (user_id,))
+                cursor.execute('INSERT OR IGNORE INTO user_stats (user_id, last_login) VALUES (?, CURRENT_TIMESTAMP)', (user_id,))
+            self.profiles.invalidate(user_id)
+            self.get_user_profile(user_id)
             return True
         except sqlite3.Error as e:
             print(f"Error al inicializar perfil: {e}")
             return False
     
+    def _load_profile_row(self, user_id: int) -> Optional[Dict]:
+        """Lee de la BD el perfil completo de un usuario (None si no existe)."""
+        row = self.get_connection().execute(
+            '''SELECT u.created_at, p.avatar_id, p.theme_preference,
+                      s.total_messages, s.total_chats, s.last_login
+               FROM users u
+               LEFT JOIN user_profiles p ON p.user_id = u.id
+               LEFT JOIN user_stats s ON s.user_id = u.id
+               WHERE u.id = ?''',
+            (user_id,)
+        ).fetchone()
+        return dict(row) if row else None
+    
+    def get_user_profile(self, user_id: int) -> Dict:
+        """
+        Obtiene el perfil de un usuario (avatar, tema, estadísticas y fecha de alta).
+        
+        Se sirve de la caché; si el usuario no está, se carga con una sola consulta.
+        
+        Args:
+            user_id: ID del usuario
+        
+        Returns:
+            Diccionario con avatar_id, theme_preference, total_messages,
+            total_chats, last_login y created_at (el que devuelve la caché:
+            no debe modificarse)
+        """
+        profile = self.profiles.get(user_id)
+        if profile is not None:
+            return profile
+        
+        with self.profiles.lock:
+            profile = self.profiles.get(user_id)
+            if profile is not None:
+                return profile
+            
+            try:
+                # Que los contadores incluyan los incrementos aún encolados
+                self.flush()
+                row = self._load_profile_row(user_id)
+            except sqlite3.Error as e:
+                print(f"Error al cargar perfil: {e}")
+                return DEFAULT_PROFILE
+            
+            if row is None:
+                # Usuario inexistente: no se guarda en caché
+                return DEFAULT_PROFILE
+            
+            profile = {
+                key: DEFAULT_PROFILE[key] if row[key] is None else row[key]
+                for key in DEFAULT_PROFILE
+            }
+            # Fecha de alta ya interpretada, para no parsearla en cada get_user_stats
+            try:
+                profile['created_datetime'] = datetime.strptime(profile['created_at'], '%Y-%m-%d %H:%M:%S')
+            except (TypeError, ValueError):
+                profile['created_datetime'] = None
+            self.profiles.put(user_id, profile)
+            return profile
+    
     def get_user_avatar(self, user_id: int) -> int:
         """Obtiene el ID del avatar del usuario."""
-        try:
-            conn = self.get_connection()
-            cursor = conn.cursor()
-            cursor.execute('SELECT avatar_id FROM user_profiles WHERE user_id = ?', (user_id,))
-            result = cursor.fetchone()
-            conn.close()
-            
-            if result:
-                return result['avatar_id']
-            else:
-                self.initialize_user_profile(user_id)
-                return 1
-        except sqlite3.Error:
-            return 1
+        return self.get_user_profile(user_id)['avatar_id']
     
     def set_user_avatar(self, user_id: int, avatar_id: int) -> bool:
         """Establece el avatar del usuario."""
         if avatar_id < 1 or avatar_id > 10:
             return False
         try:
-            conn = self.get_connection()
-            cursor = conn.cursor()
-            cursor.execute('UPDATE user_profiles SET avatar_id = ? WHERE user_id = ?', (avatar_id, user_id))
-            conn.commit()
-            conn.close()
+            with self.transaction() as cursor:
+                cursor.execute(
+                    '''INSERT INTO user_profiles (user_id, avatar_id) VALUES (?, ?)
+                       ON CONFLICT (user_id) DO UPDATE SET avatar_id = excluded.avatar_id''',
+                    (user_id, avatar_id)
+                )
+            self.profiles.update(user_id, avatar_id=avatar_id)
             return True
         except sqlite3.Error:
             return False
     
     def get_user_theme(self, user_id: int) -> str:
         """Obtiene la preferencia de tema del usuario."""
-        try:
-            conn = self.get_connection()
-            cursor = conn.cursor()
-            cursor.execute('SELECT theme_preference FROM user_profiles WHERE user_id = ?', (user_id,))
-            result = cursor.fetchone()
-            conn.close()
-            return result['theme_preference'] if result else 'dark'
-        except sqlite3.Error:
-            return 'dark'
+        return self.get_user_profile(user_id)['theme_preference']
     
     def set_user_theme(self, user_id: int, theme: str) -> bool:
         """Establece la preferencia de tema del usuario."""
         if theme not in ['dark', 'light']:
             return False
         try:
-            conn = self.get_connection()
-            cursor = conn.cursor()
-            cursor.execute('UPDATE user_profiles SET theme_preference = ? WHERE user_id = ?', (theme, user_id))
-            conn.commit()
-            conn.close()
+            with self.transaction() as cursor:
+                cursor.execute(
+                    '''INSERT INTO user_profiles (user_id, theme_preference) VALUES (?, ?)
+                       ON CONFLICT (user_id) DO UPDATE SET theme_preference = excluded.theme_preference''',
+                    (user_id, theme)
+                )
+            self.profiles.update(user_id, theme_preference=theme)
             return True
         except sqlite3.Error:
             return False
     
     def update_last_login(self, user_id: int) -> bool:
         """Actualiza la fecha/hora del último login."""
+        # Mismo formato que CURRENT_TIMESTAMP (UTC), para guardar el mismo valor en caché
+        now = datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
         try:
-            conn = self.get_connection()
-            cursor = conn.cursor()
-            cursor.execute('UPDATE user_stats SET last_login = CURRENT_TIMESTAMP WHERE user_id = ?', (user_id,))
-            conn.commit()
-            conn.close()
-            return True
-        except sqlite3.Error:
-            return False
-    
-    def increment_message_count(self, user_id: int) -> bool:
-        """Incrementa el contador de mensajes del usuario."""
-        try:
-            conn = self.get_connection()
-            cursor = conn.cursor()
-            cursor.execute('UPDATE user_stats SET total_messages = total_messages + 1 WHERE user_id = ?', (user_id,))
-            conn.commit()
-            conn.close()
+            with self.transaction() as cursor:
+                cursor.execute('UPDATE user_stats SET last_login = ? WHERE user_id = ?', (now, user_id))
+            self.profiles.update(user_id, last_login=now)
             return True
         except sqlite3.Error:
             return False
     
     def get_user_stats(self, user_id: int) -> Dict:
         """Obtiene las estadísticas del usuario."""
+        profile = self.get_user_profile(user_id)
+        created = profile.get('created_datetime')
+        days_active = (datetime.now() - created).days + 1 if created else 1
+        return {
+            'total_messages': profile['total_messages'],
+            'total_chats': profile['total_chats'],
+            'last_login': profile['last_login'],
+            'days_active': days_active,
+            'avg_messages_per_day': round(profile['total_messages'] / days_active, 1) if days_active > 0 else 0
+        }
+    
+    def get_daily_stats(self, user_id: int, days: int = 30) -> List[Dict]:
+        """
+        Obtiene el uso diario de un usuario (resumen mantenido por triggers).
+        
+        Args:
+            user_id: ID del usuario
+            days: Días a devolver, contando hacia atrás desde hoy (UTC)
+        
+        Returns:
+            Lista de diccionarios con day, messages, characters y tokens, en
+            orden cronológico; los días sin mensajes no aparecen
+        """
         try:
-            conn = self.get_connection()
-            cursor = conn.cursor()
-            cursor.execute('SELECT total_messages, total_chats, last_login FROM user_stats WHERE user_id = ?', (user_id,))
-            stats_row = cursor.fetchone()
-            cursor.execute('SELECT created_at FROM users WHERE id = ?', (user_id,))
-            user_row = cursor.fetchone()
-            conn.close()
-            
-            if stats_row and user_row:
-                created_at = datetime.strptime(user_row['created_at'], '%Y-%m-%d %H:%M:%S')
-                days_active = (datetime.now() - created_at).days + 1
-                return {
-                    'total_messages': stats_row['total_messages'],
-                    'total_chats': stats_row['total_chats'],
-                    'last_login': stats_row['last_login'],
-                    'days_active': days_active,
-                    'avg_messages_per_day': round(stats_row['total_messages'] / days_active, 1) if days_active > 0 else 0
-                }
-            else:
-                self.initialize_user_profile(user_id)
-                return {'total_messages': 0, 'total_chats': 0, 'last_login': None, 'days_active': 1, 'avg_messages_per_day': 0}
-        except Exception:
-            return {'total_messages': 0, 'total_chats': 0, 'last_login': None, 'days_active': 1, 'avg_messages_per_day': 0}
+            # Que el resumen incluya los mensajes aún encolados
+            self.flush()
+            rows = self.get_connection().execute(
+                '''SELECT day, messages, characters, tokens
+                   FROM user_daily_stats
+                   WHERE user_id = ? AND day > date('now', ?) AND messages > 0
+                   ORDER BY day''',
+                (user_id, f'-{days} days')
+            ).fetchall()
+            return [dict(row) for row in rows]
+        
+        except Exception as e:
+            print(f"Error al obtener estadísticas diarias: {e}")
+            return []
@@ -0,0 +1,116 @@
+"""
+Proceso escritor único para el despliegue con varios procesos.
+Recibe los mensajes que guardan todos los procesos de la aplicación (ver
+RemoteWriteQueue en database.py) y los escribe con una sola
+WriteBehindQueue, de modo que un único proceso confirma los lotes de
+mensajes en SQLite. Solo los mensajes pasan por el escritor: las lecturas
+y el resto de escrituras (cuentas, perfiles, conversaciones, resúmenes,
+vectores de búsqueda y la purga) las hace cada proceso directamente, en
+transacciones cortas que esperan el bloqueo de escritura de SQLite
+(busy_timeout) cuando coinciden con un lote del escritor.
+Con CHATBOT_SHARDS el escritor abre el almacenamiento repartido y cada
+mensaje va a la cola del fragmento de su usuario.
+
+Uso: python db_writer.py --address /tmp/chatbot-writer.sock
+     (la clave se lee de CHATBOT_WRITER_AUTHKEY, en hexadecimal)
+"""
+import argparse
+import os
+import signal
+import sys
+import threading
+from multiprocessing.connection import AuthenticationError, Listener
+
+from database import WRITER_AUTHKEY_ENV, parse_writer_address
+from sharded_database import open_database
+
+
+class WriterService:
+    """Servidor que atiende las RemoteWriteQueue de los procesos de la aplicación."""
+    
+    def __init__(self, db_path: str, address: str, authkey: bytes):
+        """
+        Abre la base de datos (aplicando las migraciones) y empieza a escuchar.
+        
+        Args:
+            db_path: Ruta de la base de datos (sin CHATBOT_SHARDS)
+            address: 'host:puerto' o ruta del socket Unix donde escuchar
+            authkey: Clave que deben presentar los procesos de la aplicación
+        """
+        self.db = open_database(db_path, write_behind=True)
+        address = parse_writer_address(address)
+        if isinstance(address, str) and os.path.exists(address):
+            # Socket de una ejecución anterior que no se cerró bien
+            os.unlink(address)
+        self.listener = Listener(address, authkey=authkey)
+        self._closed = threading.Event()
+    
+    def serve_forever(self):
+        """Acepta conexiones, cada una atendida por su propio hilo, hasta close()."""
+        while not self._closed.is_set():
+            try:
+                conn = self.listener.accept()
+            except (OSError, EOFError, AuthenticationError) as e:
+                if not self._closed.is_set():
+                    print(f"Error al aceptar una conexión del escritor: {e}")
+                continue
+            threading.Thread(target=self._serve, args=(conn,), name="writer-client", daemon=True).start()
+    
+    def _serve(self, conn):
+        """Atiende las operaciones de una conexión en orden, respondiendo a cada una."""
+        with conn:
+            try:
+                while True:
+                    try:
+                        kind, args, durability = conn.recv()
+                    except (OSError, EOFError):
+                        break
+                    
+                    if kind == 'message':
+                        user_id, role, content, conversation_id = args
+                        ok = self.db.save_message(user_id, role, content, durability, conversation_id)
+                    elif kind == 'flush':
+                        ok = self.db.flush(durability)
+                    else:
+                        print(f"Operación desconocida para el escritor: {kind}")
+                        ok = False
+                    
+                    try:
+                        conn.send(ok)
+                    except OSError:
+                        break
+            finally:
+                # Un hilo por cliente: su conexión con SQLite se cierra con él
+                self.db.release_connection()
+    
+    def close(self):
+        """Deja de aceptar conexiones y vuelca las escrituras pendientes."""
+        self._closed.set()
+        self.listener.close()
+        self.db.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--db", default="chatbot.db", help="Ruta de la base de datos")
+    parser.add_argument("--address", required=True, help="'host:puerto' o ruta del socket Unix")
+    args = parser.parse_args()
+    
+    authkey = bytes.fromhex(os.environ.get(WRITER_AUTHKEY_ENV, ""))
+    if not authkey:
+        print(f"Falta {WRITER_AUTHKEY_ENV} (clave compartida en hexadecimal)")
+        sys.exit(1)
+    
+    service = WriterService(args.db, args.address, authkey)
+    # Terminar con SIGTERM igual que con Ctrl+C, volcando lo pendiente
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        service.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,293 @@
+"""
+Despliegue web con varios procesos.
+Arranca un proceso escritor único para SQLite (db_writer.py), N procesos
+de la aplicación de Flet en modo web, cada uno en su propio puerto local,
+y un proxy que reparte a los navegadores entre ellos. El proxy es
+"pegajoso": la primera respuesta fija una cookie con el proceso elegido,
+de modo que todas las peticiones de un navegador (también la conexión
+WebSocket de la sesión de Flet y sus reconexiones) van al mismo proceso.
+Cada proceso tiene su propio GIL, así que las sesiones se reparten entre
+los núcleos; los mensajes de todos se escriben en lotes desde el escritor.
+Los límites de la cuenta de Groq se reparten a partes iguales entre los
+procesos (ver PROCESSES_ENV en request_scheduler.py).
+
+Uso: python deploy.py [--workers 4] [--host 0.0.0.0] [--port 8550] [--metrics-dir metrics]
+"""
+import argparse
+import asyncio
+import os
+import re
+import secrets
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+from typing import List, Optional, Tuple
+
+from database import WRITER_ADDRESS_ENV, WRITER_AUTHKEY_ENV
+from request_scheduler import PROCESSES_ENV
+
+
+# Cookie con el índice del proceso asignado a cada navegador
+WORKER_COOKIE = "chatbot_worker"
+
+# Primer puerto local de los procesos de la aplicación (uno por proceso)
+FIRST_WORKER_PORT = 8600
+
+# Tamaño máximo de la cabecera de una petición o respuesta HTTP
+MAX_HEADER_BYTES = 65536
+
+# Segundos entre comprobaciones de que los procesos siguen vivos
+SUPERVISE_INTERVAL = 1.0
+
+# Segundos máximos esperando a que el escritor cree su socket
+WRITER_START_TIMEOUT = 30.0
+
+_COOKIE_PATTERN = re.compile(
+    rb'^cookie:[^\r\n]*\b' + WORKER_COOKIE.encode() + rb'=(\d+)',
+    re.IGNORECASE | re.MULTILINE
+)
+
+
+class StickyProxy:
+    """Proxy TCP que envía cada navegador siempre al mismo proceso de la aplicación."""
+    
+    def __init__(self, backends: List[Tuple[str, int]]):
+        """
+        Inicializa el proxy.
+        
+        Args:
+            backends: Direcciones (host, puerto) de los procesos de la aplicación
+        """
+        self.backends = backends
+        # Los navegadores nuevos se asignan por turnos
+        self._next = 0
+    
+    def _sticky_backend(self, head: bytes) -> Optional[int]:
+        """Proceso indicado por la cookie de la petición, si es válido."""
+        match = _COOKIE_PATTERN.search(head)
+        if match:
+            index = int(match.group(1))
+            if index < len(self.backends):
+                return index
+        return None
+    
+    async def _connect(self, head: bytes):
+        """
+        Conecta con el proceso de la cookie o, si no hay o no responde, con el siguiente por turno.
+        
+        Returns:
+            Tupla (índice, lector, escritor, si hay que fijar la cookie), o None si ninguno responde
+        """
+        sticky = self._sticky_backend(head)
+        count = len(self.backends)
+        if sticky is None:
+            first = self._next
+            self._next = (self._next + 1) % count
+        else:
+            first = sticky
+        candidates = [(first + offset) % count for offset in range(count)]
+        
+        for index in candidates:
+            try:
+                reader, writer = await asyncio.open_connection(*self.backends[index])
+            except OSError:
+                continue
+            return index, reader, writer, index != sticky
+        return None
+    
+    async def handle(self, client_reader: asyncio.StreamReader, client_writer: asyncio.StreamWriter):
+        """Atiende una conexión de un navegador hasta que se cierra."""
+        try:
+            head = await client_reader.readuntil(b'\r\n\r\n')
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+            client_writer.close()
+            return
+        
+        connection = await self._connect(head)
+        if connection is None:
+            client_writer.write(
+                b'HTTP/1.1 503 Service Unavailable\r\nContent-Length: 0\r\nConnection: close\r\n\r\n'
+            )
+            client_writer.close()
+            return
+        
+        index, backend_reader, backend_writer, set_cookie = connection
+        try:
+            backend_writer.write(head)
+            tasks = [
+                asyncio.ensure_future(self._pipe(client_reader, backend_writer)),
+                asyncio.ensure_future(
+                    self._pipe_response(backend_reader, client_writer, index if set_cookie else None)
+                ),
+            ]
+            # Cuando un extremo cierra, se cierra también el otro
+            done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            for task in pending:
+                task.cancel()
+        finally:
+            backend_writer.close()
+            client_writer.close()
+    
+    async def _pipe(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """Copia datos de un extremo al otro hasta el final de la conexión."""
+        try:
+            while True:
+                data = await reader.read(65536)
+                if not data:
+                    break
+                writer.write(data)
+                await writer.drain()
+        except ConnectionError:
+            pass
+    
+    async def _pipe_response(
+        self,
+        reader: asyncio.StreamReader,
+        writer: asyncio.StreamWriter,
+        cookie_index: Optional[int]
+    ):
+        """Copia la respuesta del proceso, añadiendo la cookie a la primera cabecera si hace falta."""
+        if cookie_index is not None:
+            try:
+                head = await reader.readuntil(b'\r\n\r\n')
+            except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+                return
+            cookie = f'Set-Cookie: {WORKER_COOKIE}={cookie_index}; Path=/; HttpOnly; SameSite=Lax\r\n'
+            writer.write(head[:-2] + cookie.encode() + b'\r\n')
+        await self._pipe(reader, writer)
+    
+    async def serve(self, host: str, port: int):
+        """Escucha en host:port hasta que se cancela."""
+        server = await asyncio.start_server(self.handle, host, port, limit=MAX_HEADER_BYTES)
+        async with server:
+            await server.serve_forever()
+
+
+class Deployment:
+    """Procesos del despliegue: el escritor y los de la aplicación, que se reinician si terminan."""
+    
+    def __init__(
+        self,
+        workers: int,
+        first_port: int = FIRST_WORKER_PORT,
+        metrics_dir: Optional[str] = None
+    ):
+        """
+        Prepara el despliegue (no arranca nada hasta start()).
+        
+        Args:
+            workers: Número de procesos de la aplicación
+            first_port: Puerto local del primer proceso (los demás, consecutivos)
+            metrics_dir: Carpeta donde cada proceso escribe sus métricas de
+                Prometheus (None para no medir)
+        """
+        self.ports = [first_port + i for i in range(workers)]
+        self.metrics_dir = metrics_dir
+        self.directory = os.path.dirname(os.path.abspath(__file__))
+        self.writer_address = os.path.join(tempfile.gettempdir(), f"chatbot-writer-{os.getpid()}.sock")
+        self.authkey = secrets.token_hex(32)
+        self.writer: Optional[subprocess.Popen] = None
+        self.workers: List[Optional[subprocess.Popen]] = [None] * workers
+    
+    def _start_writer(self):
+        """Arranca el escritor y espera a que escuche (antes, aplica las migraciones)."""
+        env = dict(os.environ, **{WRITER_AUTHKEY_ENV: self.authkey})
+        self.writer = subprocess.Popen(
+            [sys.executable, "db_writer.py", "--address", self.writer_address],
+            cwd=self.directory,
+            env=env,
+        )
+        deadline = time.monotonic() + WRITER_START_TIMEOUT
+        while not os.path.exists(self.writer_address):
+            if self.writer.poll() is not None or time.monotonic() > deadline:
+                raise RuntimeError("El proceso escritor no arrancó")
+            time.sleep(0.05)
+    
+    def _start_worker(self, index: int):
+        """Arranca un proceso de la aplicación en modo web en su puerto local."""
+        env = dict(
+            os.environ,
+            FLET_FORCE_WEB_SERVER="true",
+            FLET_SERVER_IP="127.0.0.1",
+            FLET_SERVER_PORT=str(self.ports[index]),
+            # Cada proceso exporta sus métricas a su propio archivo (ver metrics.py)
+            METRICS_WORKER=str(index),
+            **{
+                WRITER_ADDRESS_ENV: self.writer_address,
+                WRITER_AUTHKEY_ENV: self.authkey,
+                PROCESSES_ENV: str(len(self.workers)),
+            },
+        )
+        if self.metrics_dir:
+            env.update(METRICS_ENABLED="1", METRICS_PROMETHEUS=os.path.join(self.metrics_dir, "metrics.prom"))
+        self.workers[index] = subprocess.Popen([sys.executable, "main.py"], cwd=self.directory, env=env)
+    
+    def start(self):
+        """Arranca el escritor y después los procesos de la aplicación."""
+        self._start_writer()
+        for index in range(len(self.workers)):
+            self._start_worker(index)
+    
+    async def supervise(self):
+        """Reinicia los procesos de la aplicación que terminen (sus navegadores se reconectan)."""
+        while True:
+            await asyncio.sleep(SUPERVISE_INTERVAL)
+            if self.writer.poll() is not None:
+                raise RuntimeError("El proceso escritor ha terminado")
+            for index, worker in enumerate(self.workers):
+                if worker.poll() is not None:
+                    print(f"El proceso {index} terminó con código {worker.returncode}; reiniciando")
+                    self._start_worker(index)
+    
+    def stop(self):
+        """Detiene los procesos de la aplicación y después el escritor, que vuelca lo pendiente."""
+        for worker in self.workers:
+            if worker is not None and worker.poll() is None:
+                worker.terminate()
+        for worker in self.workers:
+            if worker is not None:
+                worker.wait()
+        if self.writer is not None and self.writer.poll() is None:
+            self.writer.terminate()
+            self.writer.wait()
+        if os.path.exists(self.writer_address):
+            os.unlink(self.writer_address)
+
+
+async def run(deployment: Deployment, host: str, port: int):
+    """Sirve el proxy mientras se vigilan los procesos."""
+    proxy = StickyProxy([("127.0.0.1", worker_port) for worker_port in deployment.ports])
+    await asyncio.gather(proxy.serve(host, port), deployment.supervise())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Procesos de la aplicación")
+    parser.add_argument("--host", default="0.0.0.0", help="Dirección donde escucha el proxy")
+    parser.add_argument("--port", type=int, default=8550, help="Puerto del proxy")
+    parser.add_argument("--first-worker-port", type=int, default=FIRST_WORKER_PORT)
+    parser.add_argument(
+        "--metrics-dir", default=None,
+        help="Carpeta para las métricas de Prometheus de cada proceso (metrics.worker-N.prom)"
+    )
+    args = parser.parse_args()
+    
+    if args.metrics_dir:
+        os.makedirs(args.metrics_dir, exist_ok=True)
+    deployment = Deployment(args.workers, args.first_worker_port, args.metrics_dir)
+    # Terminar con SIGTERM igual que con Ctrl+C, deteniendo todos los procesos
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        deployment.start()
+        print(f"{args.workers} procesos detrás de http://{args.host}:{args.port} (Ctrl+C para salir)")
+        asyncio.run(run(deployment, args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        deployment.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -2,19 +2,380 @@
 Cliente para interactuar con la API de Groq.
 Maneja las conversaciones con el modelo de IA.
 """
+import asyncio
+import hashlib
+import importlib.util
+import json
 import os
-from typing import List, Dict, Optional
+import sqlite3
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from dataclasses import dataclass
+from functools import partial
+from typing import AsyncIterator, Iterator, List, Dict, Optional, Set, Tuple, Union
+import httpx
 from dotenv import load_dotenv
-from groq import Groq
+from groq import AsyncGroq, DefaultAsyncHttpxClient, DefaultHttpxClient, Groq
+import metrics
+from conversation import ConversationBuffer, estimate_tokens, select_recent
+from request_scheduler import ChatError, RequestScheduler, classify_error
+
+
+# Tokens de historial que se envían como máximo junto al mensaje del usuario
+DEFAULT_CONTEXT_TOKEN_BUDGET = 4096
+
+# Mensajes finales de la conversación que forman parte de la clave de caché
+# (además de todos los mensajes de sistema: resumen y contexto recuperado)
+CACHE_CONTEXT_MESSAGES = 3
+
+# Cuando los mensajes sin resumir superan estos tokens se resume la parte antigua...
+DEFAULT_SUMMARY_TRIGGER_TOKENS = 3072
+# ...dejando fuera del resumen los mensajes recientes que caben en estos tokens
+DEFAULT_SUMMARY_KEEP_TOKENS = 1536
+
+# Longitud máxima de un resumen (tokens de respuesta del modelo)
+SUMMARY_MAX_TOKENS = 512
+
+# Tokens del presupuesto de contexto que pueden ocupar los mensajes recuperados
+RETRIEVAL_TOKEN_BUDGET = 1024
+
+# Límites del pool HTTP compartido por todos los clientes del proceso
+MAX_CONNECTIONS = 100
+MAX_KEEPALIVE_CONNECTIONS = 20
+
+# Peticiones simultáneas como máximo desde los clientes asíncronos del proceso
+MAX_CONCURRENT_REQUESTS = 32
+
+_shared_http_client: Optional[httpx.Client] = None
+_shared_async_pools: "weakref.WeakKeyDictionary" = weakref.WeakKeyDictionary()
+_shared_pool_lock = threading.Lock()
+
+
+def configure_http_pool(
+    max_connections: Optional[int] = None,
+    max_concurrent_requests: Optional[int] = None
+):
+    """
+    Ajusta los límites del pool HTTP compartido.
+    
+    Debe llamarse antes de crear el primer cliente; los pools ya creados no cambian.
+    
+    Args:
+        max_connections: Conexiones abiertas como máximo hacia Groq
+        max_concurrent_requests: Peticiones asíncronas simultáneas como máximo
+    """
+    global MAX_CONNECTIONS, MAX_CONCURRENT_REQUESTS
+    if max_connections is not None:
+        MAX_CONNECTIONS = max_connections
+    if max_concurrent_requests is not None:
+        MAX_CONCURRENT_REQUESTS = max_concurrent_requests
+
+
+def _http_pool_options() -> Dict:
+    """Opciones comunes de los clientes HTTP compartidos."""
+    return {
+        "limits": httpx.Limits(
+            max_connections=MAX_CONNECTIONS,
+            max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS,
+        ),
+        # HTTP/2 multiplexa las peticiones en una conexión si está instalado h2
+        "http2": importlib.util.find_spec("h2") is not None,
+    }
+
+
+def get_shared_http_client() -> httpx.Client:
+    """Obtiene el cliente HTTP síncrono con keep-alive compartido por el proceso."""
+    global _shared_http_client
+    with _shared_pool_lock:
+        if _shared_http_client is None:
+            _shared_http_client = DefaultHttpxClient(**_http_pool_options())
+        return _shared_http_client
+
+
+async def _close_with_loop(loop: asyncio.AbstractEventLoop, http_client: httpx.AsyncClient):
+    """
+    Cierra el pool de un bucle de eventos cuando este termina.
+    
+    Es un generador asíncrono que queda suspendido en su yield: al terminar,
+    asyncio.run (y cualquier bucle que llame a loop.shutdown_asyncgens)
+    cierra los generadores pendientes, lo que ejecuta el finally.
+    """
+    try:
+        yield
+    finally:
+        with _shared_pool_lock:
+            if _shared_async_pools.get(loop, (None,))[0] is http_client:
+                del _shared_async_pools[loop]
+        await http_client.aclose()
+
+
+def get_shared_async_pool() -> Tuple[httpx.AsyncClient, asyncio.Semaphore]:
+    """
+    Obtiene el cliente HTTP asíncrono compartido y el límite de concurrencia.
+    
+    Los clientes asíncronos pertenecen a un bucle de eventos, así que hay un
+    pool por bucle (en la práctica, uno por proceso). El pool se cierra al
+    terminar su bucle: asyncio.run lo hace solo; un bucle creado a mano debe
+    llamar a loop.shutdown_asyncgens() antes de loop.close().
+    
+    Returns:
+        Tupla (cliente HTTP, semáforo de peticiones simultáneas)
+    """
+    loop = asyncio.get_running_loop()
+    with _shared_pool_lock:
+        pool = _shared_async_pools.get(loop)
+        if pool is None:
+            http_client = DefaultAsyncHttpxClient(**_http_pool_options())
+            closer = _close_with_loop(loop, http_client)
+            # Avanzar hasta el yield registra el generador en el bucle sin esperar a nada
+            try:
+                closer.asend(None).send(None)
+            except StopIteration:
+                pass
+            # El bucle solo guarda una referencia débil al generador
+            pool = (http_client, asyncio.Semaphore(MAX_CONCURRENT_REQUESTS), closer)
+            _shared_async_pools[loop] = pool
+        return pool[0], pool[1]
+
+
+def _stream_usage(chunk):
+    """Uso de la petición que Groq envía en el último fragmento de un stream (o None)."""
+    x_groq = getattr(chunk, "x_groq", None)
+    return getattr(x_groq, "usage", None)
+
+
+def _total_tokens(usage) -> Optional[int]:
+    """Tokens totales de un objeto usage de Groq (None si no lo hay)."""
+    return getattr(usage, "total_tokens", None)
+
+
+def _has_text(chunk) -> bool:
+    """Indica si un fragmento de un stream trae texto de la respuesta."""
+    return bool(chunk.choices and chunk.choices[0].delta.content)
+
+
+def _normalize(text: str) -> str:
+    """Normaliza un texto para que variaciones triviales compartan entrada de caché."""
+    return " ".join(text.split()).casefold()
+
+
+class ResponseCache:
+    """
+    Caché de respuestas de Groq con expulsión LRU y caducidad por tiempo.
+    
+    Las entradas se guardan en memoria hasta max_entries o max_bytes. Si se
+    indica db_path, se guardan también en SQLite y sobreviven a reinicios.
+    """
+    
+    def __init__(
+        self,
+        max_entries: int = 1024,
+        max_bytes: int = 8 * 1024 * 1024,
+        ttl: float = 24 * 3600,
+        db_path: Optional[str] = None,
+        allow_nondeterministic: bool = False
+    ):
+        """
+        Inicializa la caché.
+        
+        Args:
+            max_entries: Número máximo de respuestas en memoria
+            max_bytes: Tamaño máximo en bytes de las respuestas en memoria
+            ttl: Segundos que una respuesta sigue siendo válida
+            db_path: Archivo SQLite para la caché persistente (None para solo memoria)
+            allow_nondeterministic: Cachear también con temperature > 0
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.allow_nondeterministic = allow_nondeterministic
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()  # clave -> (respuesta, caducidad, bytes)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        
+        if db_path:
+            self._conn = sqlite3.connect(db_path, check_same_thread=False)
+            self._conn.execute('''
+                CREATE TABLE IF NOT EXISTS response_cache (
+                    key TEXT PRIMARY KEY,
+                    response TEXT NOT NULL,
+                    expires_at REAL NOT NULL
+                )
+            ''')
+            self._conn.commit()
+    
+    def is_cacheable(self, temperature: float) -> bool:
+        """Indica si una petición con esta temperatura puede servirse desde caché."""
+        return temperature == 0 or self.allow_nondeterministic
+    
+    @staticmethod
+    def make_key(
+        model: str,
+        system_prompt: Optional[str],
+        params: Dict[str, float],
+        messages: List[Dict[str, str]]
+    ) -> str:
+        """
+        Calcula la clave de caché de una petición.
+        
+        Args:
+            model: Modelo de la petición
+            system_prompt: Prompt del sistema
+            params: Parámetros de muestreo (temperature, top_p, max_tokens)
+            messages: Mensajes enviados; cuentan todos los de sistema (el
+                resumen y el contexto recuperado que añade build_context,
+                que cambian la respuesta) y los últimos CACHE_CONTEXT_MESSAGES
+                de la conversación
+            
+        Returns:
+            Clave hexadecimal
+        """
+        memory = [_normalize(msg["content"]) for msg in messages if msg["role"] == "system"]
+        conversation = [msg for msg in messages if msg["role"] != "system"]
+        recent = [
+            [msg["role"], _normalize(msg["content"])]
+            for msg in conversation[-CACHE_CONTEXT_MESSAGES:]
+        ]
+        payload = json.dumps(
+            [model, system_prompt or "", sorted(params.items()), memory, recent],
+            ensure_ascii=False
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+    
+    def get(self, key: str) -> Optional[str]:
+        """
+        Obtiene una respuesta guardada.
+        
+        Args:
+            key: Clave calculada con make_key
+            
+        Returns:
+            Respuesta guardada o None si no existe o ha caducado
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                response, expires_at, size = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return response
+                del self._entries[key]
+                self._bytes -= size
+            
+            if self._conn is not None:
+                row = self._conn.execute(
+                    'SELECT response, expires_at FROM response_cache WHERE key = ?', (key,)
+                ).fetchone()
+                if row and row[1] > now:
+                    self._store(key, row[0], row[1])
+                    self.hits += 1
+                    return row[0]
+                if row:
+                    self._conn.execute('DELETE FROM response_cache WHERE key = ?', (key,))
+                    self._conn.commit()
+            
+            self.misses += 1
+            return None
+    
+    def put(self, key: str, response: str):
+        """
+        Guarda una respuesta.
+        
+        Args:
+            key: Clave calculada con make_key
+            response: Respuesta del modelo
+        """
+        expires_at = time.time() + self.ttl
+        with self._lock:
+            self._store(key, response, expires_at)
+            if self._conn is not None:
+                self._conn.execute(
+                    'INSERT OR REPLACE INTO response_cache (key, response, expires_at) VALUES (?, ?, ?)',
+                    (key, response, expires_at)
+                )
+                self._conn.commit()
+    
+    def _store(self, key: str, response: str, expires_at: float):
+        """Guarda en memoria y expulsa las entradas menos usadas si hace falta."""
+        size = len(response.encode("utf-8"))
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self._bytes -= old[2]
+        if size > self.max_bytes:
+            return
+        
+        self._entries[key] = (response, expires_at, size)
+        self._bytes += size
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            _, (_, _, evicted_size) = self._entries.popitem(last=False)
+            self._bytes -= evicted_size
+    
+    def clear(self):
+        """Elimina todas las respuestas guardadas."""
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+            if self._conn is not None:
+                self._conn.execute('DELETE FROM response_cache')
+                self._conn.commit()
+    
+    def stats(self) -> Dict[str, int]:
+        """
+        Obtiene los contadores de la caché.
+        
+        Returns:
+            Diccionario con aciertos, fallos, entradas y bytes en memoria
+        """
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+            }
+
+
+@dataclass
+class ChatResult:
+    """Resultado de una petición de chat: la respuesta o el error que la impidió."""
+    
+    content: str = ""
+    error: Optional[ChatError] = None
+    
+    @property
+    def ok(self) -> bool:
+        """Indica si la petición terminó correctamente."""
+        return self.error is None
 
 
 class GroqClient:
     """Cliente para gestionar conversaciones con Groq AI."""
     
-    def __init__(self):
-        """Inicializa el cliente de Groq con la API key del archivo .env."""
+    def __init__(
+        self,
+        api_key: Optional[str] = None,
+        cache: Optional[ResponseCache] = None,
+        base_url: Optional[str] = None,
+        scheduler: Optional[RequestScheduler] = None
+    ):
+        """
+        Inicializa el cliente de Groq.
+        
+        Args:
+            api_key: API key de Groq (por defecto se lee GROQ_API_KEY del archivo .env)
+            cache: Caché de respuestas opcional
+            base_url: URL base de la API (por ejemplo, un servidor Groq simulado local)
+            scheduler: Planificador de peticiones (por defecto, límites de la cuenta gratuita)
+        """
         load_dotenv()
-        api_key = os.getenv('GROQ_API_KEY')
+        api_key = api_key or os.getenv('GROQ_API_KEY')
         
         if not api_key or api_key == 'your_groq_api_key_here':
             raise ValueError(
@@ -22,14 +383,120 @@ class GroqClient:
                 "Por favor configura GROQ_API_KEY en el archivo .env"
             )
         
-        self.client = Groq(api_key=api_key)
+        self.client = self._create_sdk_client(api_key, base_url)
+        self.scheduler = scheduler or RequestScheduler()
         self.model = "llama-3.1-8b-instant"  # Modelo por defecto
+        self.context_token_budget = DEFAULT_CONTEXT_TOKEN_BUDGET
+        self.summary_trigger_tokens = DEFAULT_SUMMARY_TRIGGER_TOKENS
+        self.summary_keep_tokens = DEFAULT_SUMMARY_KEEP_TOKENS
+        self.temperature = 0.7
+        self.max_tokens = 1024
+        self.top_p = 1
+        self.cache = cache
+    
+    def _create_sdk_client(self, api_key: str, base_url: Optional[str]):
+        """Crea el cliente del SDK de Groq sobre el pool HTTP compartido."""
+        # Los reintentos los gestiona el planificador, no el SDK
+        return Groq(
+            api_key=api_key,
+            base_url=base_url,
+            max_retries=0,
+            http_client=get_shared_http_client()
+        )
+    
+    def _cache_key(
+        self,
+        messages: List[Dict[str, str]],
+        system_prompt: Optional[str]
+    ) -> Optional[str]:
+        """Clave de caché de la petición, o None si no debe usarse la caché."""
+        if self.cache is None or not self.cache.is_cacheable(self.temperature):
+            return None
+        params = {
+            "temperature": self.temperature,
+            "max_tokens": self.max_tokens,
+            "top_p": self.top_p,
+        }
+        return self.cache.make_key(self.model, system_prompt, params, messages)
+    
+    def _completion_request(
+        self,
+        messages: List[Dict[str, str]],
+        system_prompt: Optional[str],
+        stream: bool,
+        **overrides
+    ) -> Tuple[Dict, int]:
+        """
+        Prepara los argumentos de la petición de completado.
+        
+        Los argumentos adicionales sustituyen a los parámetros del cliente
+        (por ejemplo, temperature o max_tokens).
+        
+        Returns:
+            Tupla (argumentos para chat.completions.create, tokens estimados)
+        """
+        # Preparar mensajes
+        chat_messages = []
+        
+        # Agregar system prompt si existe
+        if system_prompt:
+            chat_messages.append({
+                "role": "system",
+                "content": system_prompt
+            })
+        
+        # Agregar mensajes de conversación
+        chat_messages.extend(messages)
+        
+        estimated_tokens = sum(estimate_tokens(msg["content"]) for msg in chat_messages)
+        request = {
+            "model": self.model,
+            "messages": chat_messages,
+            "temperature": self.temperature,
+            "max_tokens": self.max_tokens,
+            "top_p": self.top_p,
+            "stream": stream,
+        }
+        request.update(overrides)
+        return request, estimated_tokens
+    
+    def _create_completion(
+        self,
+        messages: List[Dict[str, str]],
+        system_prompt: Optional[str],
+        stream: bool,
+        cancel_event: Optional[threading.Event] = None,
+        **overrides
+    ):
+        """
+        Hace la petición de completado a Groq con los parámetros del cliente.
+        
+        Con stream devuelve un generador de fragmentos (ver RequestScheduler.stream).
+        """
+        request, estimated_tokens = self._completion_request(
+            messages, system_prompt, stream, **overrides
+        )
+        # Se reservan también los tokens que puede generar la respuesta; los
+        # que no use se devuelven al límite de TPM cuando Groq informa del uso
+        reserved = estimated_tokens + (request.get("max_tokens") or 0)
+        create = lambda: self.client.chat.completions.create(**request)
+        
+        # Hacer la petición a Groq a través del planificador
+        if stream:
+            return self.scheduler.stream(
+                create, reserved, cancel_event, _has_text,
+                lambda chunk: _total_tokens(_stream_usage(chunk))
+            )
+        return self.scheduler.run(
+            create, reserved, cancel_event,
+            lambda response: _total_tokens(getattr(response, "usage", None))
+        )
     
     def chat(
         self, 
         messages: List[Dict[str, str]], 
         system_prompt: Optional[str] = None
-    ) -> str:
+    ) -> ChatResult:
         """
         Envía mensajes al modelo y obtiene una respuesta.
         
@@ -38,65 +505,251 @@ class GroqClient:
             system_prompt: Prompt del sistema opcional
             
         Returns:
-            Respuesta del modelo como string
+            ChatResult con la respuesta del modelo o el error tipado
         """
+        cache_key = self._cache_key(messages, system_prompt)
+        if cache_key is not None:
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                return ChatResult(cached)
+        
         try:
-            # Preparar mensajes
-            chat_messages = []
-            
-            # Agregar system prompt si existe
-            if system_prompt:
-                chat_messages.append({
-                    "role": "system",
-                    "content": system_prompt
-                })
-            
-            # Agregar mensajes de conversación
-            chat_messages.extend(messages)
-            
-            # Hacer la petición a Groq
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=chat_messages,
-                temperature=0.7,
-                max_tokens=1024,
-                top_p=1,
-                stream=False
-            )
+            with metrics.span('completion'):
+                response = self._create_completion(messages, system_prompt, stream=False)
+            metrics.record_usage(getattr(response, "usage", None))
             
             # Extraer y retornar la respuesta
-            return response.choices[0].message.content
+            content = response.choices[0].message.content
+            if cache_key is not None:
+                self.cache.put(cache_key, content)
+            return ChatResult(content)
         
         except Exception as e:
-            return f"Error al comunicarse con Groq: {str(e)}"
+            return ChatResult(error=classify_error(e))
+    
+    def chat_stream(
+        self,
+        messages: List[Dict[str, str]],
+        system_prompt: Optional[str] = None,
+        cancel_event: Optional[threading.Event] = None
+    ) -> Iterator[str]:
+        """
+        Envía mensajes al modelo y devuelve la respuesta a medida que se genera.
+        
+        Args:
+            messages: Lista de mensajes en formato [{"role": "user/assistant", "content": "..."}]
+            system_prompt: Prompt del sistema opcional
+            cancel_event: Evento que cancela la petición, también mientras
+                espera a los límites, a un reintento o al primer fragmento
+            
+        Yields:
+            Fragmentos de texto de la respuesta, en orden. Cerrar el generador
+            antes de terminar aborta la petición en curso.
+            
+        Raises:
+            ChatError: Si la petición falla tras los reintentos, se corta a
+                mitad o se cancela antes de empezar (tipo 'cancelled')
+        """
+        cache_key = self._cache_key(messages, system_prompt)
+        if cache_key is not None:
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                yield cached
+                return
+        
+        stream = None
+        started = time.perf_counter()
+        first_token_at = None
+        try:
+            stream = self._create_completion(messages, system_prompt, stream=True, cancel_event=cancel_event)
+            
+            chunks = []
+            for chunk in stream:
+                if cancel_event is not None and cancel_event.is_set():
+                    # También los fragmentos sin texto (rol, uso) antes del primer token
+                    raise ChatError('cancelled', "Petición cancelada")
+                metrics.record_usage(_stream_usage(chunk))
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    if first_token_at is None:
+                        # Incluye la espera del planificador y la cola de Groq
+                        first_token_at = time.perf_counter()
+                        metrics.observe('ttft', (first_token_at - started) * 1000)
+                    chunks.append(delta)
+                    yield delta
+            
+            if first_token_at is not None:
+                metrics.observe(
+                    'generation', (time.perf_counter() - first_token_at) * 1000, chunks=len(chunks)
+                )
+            
+            # Solo se guardan respuestas completas (no canceladas ni fallidas)
+            if cache_key is not None:
+                self.cache.put(cache_key, "".join(chunks))
+        
+        except Exception as e:
+            raise classify_error(e) from e
+        
+        finally:
+            # Cerrar la conexión si el consumidor abandona el stream (cancelación)
+            if stream is not None:
+                stream.close()
+    
+    @staticmethod
+    def _retrieved_context(
+        retrieved: List[Dict[str, str]],
+        skip: Set[str],
+        max_tokens: int
+    ) -> Optional[Dict[str, str]]:
+        """
+        Agrupa en un mensaje de sistema los mensajes recuperados que caben en max_tokens.
+        
+        Args:
+            retrieved: Mensajes recuperados, de más a menos relevante
+            skip: Contenidos que ya van en el contexto y no se repiten
+            max_tokens: Presupuesto de tokens para el mensaje
+        
+        Returns:
+            Mensaje de sistema, o None si no cabe ningún mensaje recuperado
+        """
+        used = estimate_tokens(RETRIEVAL_CONTEXT_PREFIX)
+        selected = []
+        for msg in retrieved:
+            if msg["content"] in skip:
+                continue
+            tokens = estimate_tokens(msg["content"])
+            if used + tokens > max_tokens:
+                continue
+            used += tokens
+            selected.append(msg)
+        
+        if not selected:
+            return None
+        
+        # En orden cronológico, que es como el modelo entiende mejor la conversación
+        selected.sort(key=lambda msg: msg.get("id", 0))
+        lines = [
+            f"{RETRIEVAL_ROLE_LABELS.get(msg['role'], msg['role'])}: {msg['content']}"
+            for msg in selected
+        ]
+        return {"role": "system", "content": RETRIEVAL_CONTEXT_PREFIX + "\n".join(lines)}
+    
+    def build_context(
+        self,
+        user_message: str,
+        conversation_history: Union[ConversationBuffer, List[Dict[str, str]]],
+        retrieved: Optional[List[Dict[str, str]]] = None
+    ) -> List[Dict[str, str]]:
+        """
+        Construye los mensajes a enviar respetando el presupuesto de tokens.
+        
+        Se incluyen los mensajes más recientes del historial que caben en
+        context_token_budget junto con el mensaje del usuario. Si el buffer
+        tiene un resumen de la parte antigua, va al principio y los mensajes
+        que ya cubre no se envían. Los mensajes recuperados por relevancia
+        van después, en un mensaje de sistema de como mucho
+        RETRIEVAL_TOKEN_BUDGET tokens, sin repetir los que ya están entre
+        los recientes. El system prompt se añade aparte en chat() y no
+        consume presupuesto.
+        
+        Args:
+            user_message: Mensaje del usuario
+            conversation_history: Historial previo (un ConversationBuffer
+                reutiliza los tokens ya calculados de cada mensaje)
+            retrieved: Mensajes anteriores relevantes (por ejemplo, de
+                MessageRetriever.search), de más a menos relevante
+        
+        Returns:
+            Lista de mensajes terminada en el mensaje del usuario
+        """
+        budget = self.context_token_budget - estimate_tokens(user_message)
+        context = []
+        
+        if isinstance(conversation_history, ConversationBuffer):
+            if conversation_history.summary:
+                summary_message = {
+                    "role": "system",
+                    "content": SUMMARY_CONTEXT_PREFIX + conversation_history.summary
+                }
+                budget -= estimate_tokens(summary_message["content"])
+                context.append(summary_message)
+            select = conversation_history.recent
+        else:
+            select = partial(select_recent, conversation_history)
+        
+        messages = select(max(0, budget))
+        
+        if retrieved:
+            skip = {msg["content"] for msg in messages}
+            skip.add(user_message)
+            retrieved_message = self._retrieved_context(
+                retrieved, skip, min(RETRIEVAL_TOKEN_BUDGET, max(0, budget) // 2)
+            )
+            if retrieved_message is not None:
+                context.append(retrieved_message)
+                # Los recuperados ocupan parte del presupuesto de los recientes
+                messages = select(max(0, budget - estimate_tokens(retrieved_message["content"])))
+        
+        messages[:0] = context
+        
+        messages.append({
+            "role": "user",
+            "content": user_message
+        })
+        return messages
     
     def chat_with_context(
         self, 
         user_message: str, 
-        conversation_history: List[Dict[str, str]],
-        system_prompt: Optional[str] = None
-    ) -> str:
+        conversation_history: Union[ConversationBuffer, List[Dict[str, str]]],
+        system_prompt: Optional[str] = None,
+        retrieved: Optional[List[Dict[str, str]]] = None
+    ) -> ChatResult:
         """
-        Envía un mensaje con contexto de conversación completo.
+        Envía un mensaje con el contexto reciente de la conversación.
         
         Args:
             user_message: Mensaje del usuario
             conversation_history: Historial previo de la conversación
             system_prompt: Prompt del sistema opcional
+            retrieved: Mensajes anteriores relevantes para incluir en el contexto
             
         Returns:
-            Respuesta del modelo
+            ChatResult con la respuesta del modelo o el error tipado
         """
-        # Agregar el nuevo mensaje del usuario al historial
-        messages = conversation_history.copy()
-        messages.append({
-            "role": "user",
-            "content": user_message
-        })
+        with metrics.span('context_build'):
+            messages = self.build_context(user_message, conversation_history, retrieved)
         
         # Obtener respuesta
         return self.chat(messages, system_prompt)
     
+    def chat_with_context_stream(
+        self,
+        user_message: str,
+        conversation_history: Union[ConversationBuffer, List[Dict[str, str]]],
+        system_prompt: Optional[str] = None,
+        retrieved: Optional[List[Dict[str, str]]] = None,
+        cancel_event: Optional[threading.Event] = None
+    ) -> Iterator[str]:
+        """
+        Igual que chat_with_context, pero devuelve la respuesta por fragmentos.
+        
+        Args:
+            user_message: Mensaje del usuario
+            conversation_history: Historial previo de la conversación
+            system_prompt: Prompt del sistema opcional
+            retrieved: Mensajes anteriores relevantes para incluir en el contexto
+            cancel_event: Evento que cancela la petición (ver chat_stream)
+            
+        Returns:
+            Iterador con los fragmentos de texto de la respuesta
+        """
+        with metrics.span('context_build'):
+            messages = self.build_context(user_message, conversation_history, retrieved)
+        return self.chat_stream(messages, system_prompt, cancel_event)
+    
     def set_model(self, model_name: str):
         """
         Cambia el modelo de IA a utilizar.
@@ -105,6 +758,363 @@ class GroqClient:
             model_name: Nombre del modelo (ej: llama-3.1-70b-versatile, mixtral-8x7b-32768)
         """
         self.model = model_name
+    
+    def set_temperature(self, temperature: float):
+        """
+        Cambia la temperatura de muestreo.
+        
+        Con temperature > 0 la respuesta no es determinista y la caché se
+        omite salvo que se haya creado con allow_nondeterministic=True.
+        
+        Args:
+            temperature: Temperatura entre 0 y 2
+        """
+        self.temperature = temperature
+    
+    def needs_summary(self, conversation: ConversationBuffer) -> bool:
+        """Indica si la parte de la conversación sin resumir ha crecido demasiado."""
+        return conversation.unsummarized_tokens() > self.summary_trigger_tokens
+    
+    def _summary_request(self, conversation: ConversationBuffer) -> Optional[Tuple[int, int, List[Dict[str, str]]]]:
+        """
+        Prepara la actualización del resumen con los mensajes nuevos.
+        
+        Returns:
+            Tupla (revisión del buffer, índice final resumido, mensajes para el
+            modelo), o None si no hay nada que resumir
+        """
+        end, pending = conversation.pending_summary(self.summary_keep_tokens)
+        if not pending:
+            return None
+        
+        transcript = "\n".join(
+            f"{'Usuario' if msg['role'] == 'user' else 'Asistente'}: {msg['content']}"
+            for msg in pending
+        )
+        prompt = (
+            f"Resumen actual:\n{conversation.summary or '(vacío)'}\n\n"
+            f"Mensajes nuevos:\n{transcript}"
+        )
+        return conversation.revision, end, [{"role": "user", "content": prompt}]
+    
+    @staticmethod
+    def _apply_summary(
+        conversation: ConversationBuffer,
+        revision: int,
+        end: int,
+        summary: str
+    ) -> Optional[Tuple[str, int]]:
+        """Guarda el resumen en el buffer si no se ha vaciado mientras se generaba."""
+        if conversation.revision != revision or not summary:
+            return None
+        conversation.set_summary(summary, conversation.offset + end)
+        return summary, conversation.summary_position
+    
+    def update_summary(self, conversation: ConversationBuffer) -> Optional[Tuple[str, int]]:
+        """
+        Incorpora al resumen los mensajes antiguos que aún no cubre.
+        
+        Solo se envían al modelo el resumen anterior y los mensajes nuevos,
+        así que el coste no crece con la longitud de la conversación. Pensado
+        para ejecutarse en segundo plano, fuera del turno del usuario.
+        
+        Args:
+            conversation: Conversación a resumir (se actualiza en sitio)
+        
+        Returns:
+            Tupla (resumen, mensajes de la conversación que cubre) para
+            guardarla, o None si no había nada que resumir o hubo un error
+        """
+        pending = self._summary_request(conversation)
+        if pending is None:
+            return None
+        revision, end, messages = pending
+        
+        try:
+            with metrics.span('summary'):
+                response = self._create_completion(
+                    messages,
+                    SUMMARY_PROMPT,
+                    stream=False,
+                    temperature=0,
+                    max_tokens=SUMMARY_MAX_TOKENS
+                )
+        except ChatError as e:
+            print(f"Error al resumir la conversación: {e.message}")
+            return None
+        metrics.record_usage(getattr(response, "usage", None), source='summary')
+        
+        summary = (response.choices[0].message.content or "").strip()
+        return self._apply_summary(conversation, revision, end, summary)
+    
+    def set_context_token_budget(self, max_tokens: int):
+        """
+        Cambia el número máximo de tokens de historial enviados en cada petición.
+        
+        Args:
+            max_tokens: Presupuesto de tokens para el historial y el mensaje del usuario
+        """
+        self.context_token_budget = max_tokens
+
+
+class AsyncGroqClient(GroqClient):
+    """
+    Variante asíncrona de GroqClient para servir muchas sesiones en un proceso.
+    
+    Todas las instancias comparten un único pool HTTP con keep-alive (HTTP/2
+    si está disponible) y un límite global de peticiones simultáneas. Tiene
+    la misma configuración que GroqClient, pero chat, chat_stream,
+    chat_with_context y chat_with_context_stream son asíncronos.
+    """
+    
+    def _create_sdk_client(self, api_key: str, base_url: Optional[str]):
+        """
+        Guarda la configuración; el cliente se crea en el bucle de eventos que lo use.
+        
+        Los clientes del SDK usan el pool compartido del bucle, que se cierra
+        con él (ver get_shared_async_pool), y se olvidan al desaparecer el bucle.
+        """
+        self._api_key = api_key
+        self._base_url = base_url
+        self._clients: "weakref.WeakKeyDictionary" = weakref.WeakKeyDictionary()
+        return None
+    
+    def _client_for_loop(self) -> Tuple[AsyncGroq, asyncio.Semaphore]:
+        """Cliente del SDK y semáforo compartido del bucle de eventos actual."""
+        http_client, semaphore = get_shared_async_pool()
+        loop = asyncio.get_running_loop()
+        client = self._clients.get(loop)
+        if client is None:
+            client = AsyncGroq(
+                api_key=self._api_key,
+                base_url=self._base_url,
+                max_retries=0,
+                http_client=http_client
+            )
+            self._clients[loop] = client
+        return client, semaphore
+    
+    async def _create_completion_async(
+        self,
+        client: AsyncGroq,
+        messages: List[Dict[str, str]],
+        system_prompt: Optional[str],
+        stream: bool,
+        **overrides
+    ):
+        """Hace la petición de completado (sin stream) a Groq a través del planificador."""
+        request, estimated_tokens = self._completion_request(
+            messages, system_prompt, stream, **overrides
+        )
+        # Como en GroqClient._create_completion: se reserva también max_tokens
+        reserved = estimated_tokens + (request.get("max_tokens") or 0)
+        return await self.scheduler.run_async(
+            lambda: client.chat.completions.create(**request),
+            reserved,
+            lambda response: _total_tokens(getattr(response, "usage", None))
+        )
+    
+    def _stream_completion_async(
+        self,
+        client: AsyncGroq,
+        messages: List[Dict[str, str]],
+        system_prompt: Optional[str]
+    ) -> AsyncIterator:
+        """Abre la petición con stream a través del planificador (ver RequestScheduler.stream_async)."""
+        request, estimated_tokens = self._completion_request(messages, system_prompt, stream=True)
+        reserved = estimated_tokens + (request.get("max_tokens") or 0)
+        return self.scheduler.stream_async(
+            lambda: client.chat.completions.create(**request),
+            reserved,
+            _has_text,
+            lambda chunk: _total_tokens(_stream_usage(chunk))
+        )
+    
+    async def chat(
+        self,
+        messages: List[Dict[str, str]],
+        system_prompt: Optional[str] = None
+    ) -> ChatResult:
+        """
+        Envía mensajes al modelo y obtiene una respuesta.
+        
+        Args:
+            messages: Lista de mensajes en formato [{"role": "user/assistant", "content": "..."}]
+            system_prompt: Prompt del sistema opcional
+            
+        Returns:
+            ChatResult con la respuesta del modelo o el error tipado
+        """
+        cache_key = self._cache_key(messages, system_prompt)
+        if cache_key is not None:
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                return ChatResult(cached)
+        
+        client, semaphore = self._client_for_loop()
+        try:
+            with metrics.span('completion'):
+                async with semaphore:
+                    response = await self._create_completion_async(
+                        client, messages, system_prompt, stream=False
+                    )
+            metrics.record_usage(getattr(response, "usage", None))
+            
+            content = response.choices[0].message.content
+            if cache_key is not None:
+                self.cache.put(cache_key, content)
+            return ChatResult(content)
+        
+        except Exception as e:
+            return ChatResult(error=classify_error(e))
+    
+    async def chat_stream(
+        self,
+        messages: List[Dict[str, str]],
+        system_prompt: Optional[str] = None
+    ) -> AsyncIterator[str]:
+        """
+        Envía mensajes al modelo y devuelve la respuesta a medida que se genera.
+        
+        La plaza de concurrencia se mantiene mientras dura el stream.
+        
+        Args:
+            messages: Lista de mensajes en formato [{"role": "user/assistant", "content": "..."}]
+            system_prompt: Prompt del sistema opcional
+            
+        Yields:
+            Fragmentos de texto de la respuesta, en orden
+            
+        Raises:
+            ChatError: Si la petición falla tras los reintentos o se corta a mitad
+        """
+        cache_key = self._cache_key(messages, system_prompt)
+        if cache_key is not None:
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                yield cached
+                return
+        
+        client, semaphore = self._client_for_loop()
+        started = time.perf_counter()
+        first_token_at = None
+        async with semaphore:
+            stream = None
+            try:
+                stream = self._stream_completion_async(client, messages, system_prompt)
+                
+                chunks = []
+                async for chunk in stream:
+                    metrics.record_usage(_stream_usage(chunk))
+                    if not chunk.choices:
+                        continue
+                    delta = chunk.choices[0].delta.content
+                    if delta:
+                        if first_token_at is None:
+                            # Incluye la espera del semáforo, del planificador y la cola de Groq
+                            first_token_at = time.perf_counter()
+                            metrics.observe('ttft', (first_token_at - started) * 1000)
+                        chunks.append(delta)
+                        yield delta
+                
+                if first_token_at is not None:
+                    metrics.observe(
+                        'generation', (time.perf_counter() - first_token_at) * 1000, chunks=len(chunks)
+                    )
+                
+                # Solo se guardan respuestas completas (no canceladas ni fallidas)
+                if cache_key is not None:
+                    self.cache.put(cache_key, "".join(chunks))
+            
+            except Exception as e:
+                raise classify_error(e) from e
+            
+            finally:
+                if stream is not None:
+                    await stream.aclose()
+    
+    async def chat_with_context(
+        self,
+        user_message: str,
+        conversation_history: Union[ConversationBuffer, List[Dict[str, str]]],
+        system_prompt: Optional[str] = None,
+        retrieved: Optional[List[Dict[str, str]]] = None
+    ) -> ChatResult:
+        """
+        Envía un mensaje con el contexto reciente de la conversación.
+        
+        Args:
+            user_message: Mensaje del usuario
+            conversation_history: Historial previo de la conversación
+            system_prompt: Prompt del sistema opcional
+            retrieved: Mensajes anteriores relevantes para incluir en el contexto
+            
+        Returns:
+            ChatResult con la respuesta del modelo o el error tipado
+        """
+        with metrics.span('context_build'):
+            messages = self.build_context(user_message, conversation_history, retrieved)
+        return await self.chat(messages, system_prompt)
+    
+    def chat_with_context_stream(
+        self,
+        user_message: str,
+        conversation_history: Union[ConversationBuffer, List[Dict[str, str]]],
+        system_prompt: Optional[str] = None,
+        retrieved: Optional[List[Dict[str, str]]] = None
+    ) -> AsyncIterator[str]:
+        """
+        Igual que chat_with_context, pero devuelve la respuesta por fragmentos.
+        
+        Args:
+            user_message: Mensaje del usuario
+            conversation_history: Historial previo de la conversación
+            system_prompt: Prompt del sistema opcional
+            retrieved: Mensajes anteriores relevantes para incluir en el contexto
+            
+        Returns:
+            Iterador asíncrono con los fragmentos de texto de la respuesta
+        """
+        with metrics.span('context_build'):
+            messages = self.build_context(user_message, conversation_history, retrieved)
+        return self.chat_stream(messages, system_prompt)
+    
+    async def update_summary(self, conversation: ConversationBuffer) -> Optional[Tuple[str, int]]:
+        """
+        Versión asíncrona de GroqClient.update_summary.
+        
+        ChatEngine es síncrono y no acepta este cliente (ver ChatEngine.__init__).
+        
+        Args:
+            conversation: Conversación a resumir (se actualiza en sitio)
+        
+        Returns:
+            Tupla (resumen, mensajes de la conversación que cubre) o None
+        """
+        pending = self._summary_request(conversation)
+        if pending is None:
+            return None
+        revision, end, messages = pending
+        
+        client, semaphore = self._client_for_loop()
+        try:
+            with metrics.span('summary'):
+                async with semaphore:
+                    response = await self._create_completion_async(
+                        client,
+                        messages,
+                        SUMMARY_PROMPT,
+                        stream=False,
+                        temperature=0,
+                        max_tokens=SUMMARY_MAX_TOKENS
+                    )
+        except ChatError as e:
+            print(f"Error al resumir la conversación: {e.message}")
+            return None
+        metrics.record_usage(getattr(response, "usage", None), source='summary')
+        
+        summary = (response.choices[0].message.content or "").strip()
+        return self._apply_summary(conversation, revision, end, summary)
 
 
 # System prompt por defecto para el chatbot
@@ -112,3 +1122,18 @@ DEFAULT_SYSTEM_PROMPT = """Eres un asistente virtual amigable y útil.
 Respondes de manera clara, concisa y profesional. 
 Ayudas a los usuarios con sus preguntas y tareas de la mejor manera posible.
 Mantén un tono conversacional y empático."""
+
+
+# Instrucciones para actualizar el resumen de la parte antigua de una conversación
+SUMMARY_PROMPT = """Mantienes la memoria de una conversación entre un usuario y un asistente.
+Recibes el resumen actual y los mensajes nuevos. Devuelve el resumen actualizado:
+conserva los datos del usuario, sus preferencias, las decisiones tomadas y las
+preguntas pendientes; omite saludos y detalles irrelevantes.
+Escribe solo el resumen, en el idioma de la conversación y en menos de 300 palabras."""
+
+# Encabezado con el que se envía el resumen al modelo en cada turno
+SUMMARY_CONTEXT_PREFIX = "Resumen de la conversación hasta ahora:\n"
+
+# Encabezado con el que se envían al modelo los mensajes anteriores recuperados
+RETRIEVAL_CONTEXT_PREFIX = "Mensajes anteriores del usuario que pueden ser relevantes:\n"
+RETRIEVAL_ROLE_LABELS = {"user": "Usuario", "assistant": "Asistente"}
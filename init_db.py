@@ -2,17 +2,21 @@
 Script de inicialización de la base de datos.
 Crea las tablas y opcionalmente usuarios de prueba.
 """
-from database import Database
+from sharded_database import open_database
 
 
 def init_database():
     """Inicializa la base de datos creando las tablas necesarias."""
     print("Inicializando base de datos...")
     
-    db = Database()
+    db = open_database()
     print("✓ Base de datos creada exitosamente")
     print("✓ Tablas creadas: users, messages")
     
+    # Las bases de datos creadas antes del borrado por lotes no liberan espacio
+    if db.enable_incremental_vacuum():
+        print("✓ Vaciado incremental activado")
+    
     # Preguntar si se desean crear usuarios de prueba
     crear_usuarios = input("\n¿Deseas crear usuarios de prueba? (s/n): ").lower()
     
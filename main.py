@@ -2,10 +2,125 @@
 Aplicación de Chatbot con Flet.
 Interfaz gráfica con autenticación y conversaciones persistentes por usuario.
 """
+import threading
+import time
 import flet as ft
-from database import Database
-from groq_client import GroqClient, DEFAULT_SYSTEM_PROMPT
-from typing import Optional
+import metrics
+from auth import run_in_background
+from avatars import get_avatar_color, get_avatar_icon
+from chat_engine import ChatEngine, ChatSession, TurnResult, get_engine
+from conversation import ConversationBuffer
+from database import CONVERSATION_PREVIEW_CHARS
+from chat_worker import ChatWorker
+from typing import Callable, Dict, Optional, Tuple
+
+
+# Intervalo mínimo entre refrescos de la UI mientras llega una respuesta (segundos)
+STREAM_UPDATE_INTERVAL = 0.05
+
+# Mensajes que se dibujan por página en la pantalla de chat
+HISTORY_PAGE_SIZE = 50
+
+# Distancia a un extremo de la lista (px) a partir de la cual se carga la página contigua
+SCROLL_LOAD_THRESHOLD = 100
+
+# Resultados que muestra el buscador del historial
+SEARCH_RESULT_LIMIT = 20
+
+# Caracteres mínimos para buscar mientras se escribe
+SEARCH_MIN_CHARS = 2
+
+# Conversaciones que muestra la barra lateral
+SIDEBAR_CONVERSATION_LIMIT = 100
+
+# Usuarios por página en la pantalla de selección de usuario
+USER_PAGE_SIZE = 24
+
+# Clave del almacenamiento del cliente donde se guarda el token de sesión
+SESSION_STORAGE_KEY = "chatbot.session_token"
+
+def create_user_card(user: Dict, on_click) -> ft.Container:
+    """
+    Crea la tarjeta de un usuario en la pantalla de selección.
+    
+    Args:
+        user: Usuario de Database.get_users_page (con su avatar_id)
+        on_click: Función que recibe el nombre de usuario al pulsar la tarjeta
+        
+    Returns:
+        Tarjeta del usuario
+    """
+    username = user['username']
+    return ft.Container(
+        content=ft.Column(
+            [
+                ft.Icon(get_avatar_icon(user['avatar_id']), size=50, color=get_avatar_color(user['avatar_id'])),
+                ft.Text(
+                    username,
+                    size=16,
+                    weight=ft.FontWeight.BOLD,
+                    color="white",
+                    text_align=ft.TextAlign.CENTER,
+                ),
+            ],
+            horizontal_alignment=ft.CrossAxisAlignment.CENTER,
+            spacing=8,
+        ),
+        padding=20,
+        border_radius=12,
+        bgcolor="#006341",
+        border=ft.border.all(2, "#00A859"),
+        width=140,
+        height=140,
+        on_click=lambda e: on_click(username),
+        ink=True,
+    )
+
+
+def create_message_bubble(role: str, content: str) -> Tuple[ft.Container, ft.Text]:
+    """
+    Crea la burbuja de un mensaje del chat.
+    
+    Args:
+        role: Rol del mensaje ('user' o 'assistant')
+        content: Contenido del mensaje
+        
+    Returns:
+        Tupla (burbuja, texto con el contenido para poder actualizarlo en sitio)
+    """
+    is_user = role == "user"
+    
+    content_text = ft.Text(
+        content,
+        size=14,
+        selectable=True,
+        color="white",
+    )
+    
+    message_bubble = ft.Container(
+        content=ft.Column(
+            [
+                ft.Text(
+                    "Tú" if is_user else "Asistente IA",
+                    size=11,
+                    weight=ft.FontWeight.BOLD,
+                    color="#A4D65E",
+                ),
+                content_text,
+            ],
+            spacing=5,
+        ),
+        padding=15,
+        border_radius=15,
+        bgcolor="#006341" if is_user else "#00A859",  # Verde oscuro para usuario, verde brillante para asistente
+        border=ft.border.all(1, "#00A859" if is_user else "#A4D65E"),
+        margin=ft.margin.only(
+            left=100 if is_user else 0,
+            right=0 if is_user else 100,
+        ),
+    )
+    
+    return message_bubble, content_text
 
 
 class ChatbotApp:
@@ -19,12 +134,13 @@ class ChatbotApp:
             page: Página principal de Flet
         """
         self.page = page
-        self.db = Database()
-        self.groq_client = None
-        self.groq_error = None
-        self.current_user_id: Optional[int] = None
-        self.current_username: Optional[str] = None
+        self.engine = get_engine()  # Autenticación, contexto y persistencia
+        self.db = self.engine.db  # Solo para las lecturas que dibuja la UI
+        self.session: Optional[ChatSession] = None  # Usuario con sesión iniciada
+        self.chat_worker = ChatWorker()  # Procesa los turnos fuera de la UI
         self.is_dark_mode = True  # Estado del tema
+        # Cambia los colores de la pantalla dibujada al cambiar el tema
+        self.restyle_screen: Optional[Callable[[], None]] = None
         
         # Configurar página
         self.page.title = "Chatbot IA"
@@ -34,16 +150,80 @@ class ChatbotApp:
         self.page.window_width = 900
         self.page.window_height = 700
         self.page.window_resizable = True
+        # En web cada sesión tiene su hilo de chat: se cancela el turno en curso si se corta
+        # la conexión y se termina el hilo cuando Flet da la sesión por cerrada
+        self.page.on_disconnect = lambda e: self.chat_worker.cancel_all()
+        self.page.on_close = lambda e: self.chat_worker.stop()
         
-        # Intentar inicializar Groq client
+        # Entrar directamente si hay una sesión guardada; si no, mostrar el login
+        self.resume_session()
+    
+    @property
+    def current_user_id(self) -> Optional[int]:
+        """ID del usuario con sesión iniciada (None en el login)."""
+        return self.session.user_id if self.session else None
+    
+    @property
+    def current_username(self) -> Optional[str]:
+        """Nombre del usuario con sesión iniciada (None en el login)."""
+        return self.session.username if self.session else None
+    
+    @property
+    def conversation_id(self) -> Optional[int]:
+        """Conversación abierta."""
+        return self.session.conversation_id if self.session else None
+    
+    @property
+    def conversation(self) -> ConversationBuffer:
+        """Historial de la conversación abierta."""
+        return self.session.conversation if self.session else ConversationBuffer()
+    
+    def resume_session(self):
+        """Inicia sesión con el token guardado en el cliente (sin bcrypt) o muestra el login."""
         try:
-            self.groq_client = GroqClient()
-        except ValueError as e:
-            # Guardar el error para mostrarlo después
-            self.groq_error = str(e)
+            token = self.page.client_storage.get(SESSION_STORAGE_KEY)
+        except Exception as e:
+            print(f"Error al leer la sesión guardada: {e}")
+            token = None
         
-        # Mostrar pantalla de login
-        self.show_login_screen()
+        session = self.engine.resume(token)
+        if session is None:
+            self.show_login_screen()
+            return
+        
+        self.start_session(session)
+    
+    def remember_session(self):
+        """Guarda en el cliente un token de sesión para no pedir la contraseña la próxima vez."""
+        token = self.session.create_token()
+        if token is None:
+            return
+        try:
+            self.page.client_storage.set(SESSION_STORAGE_KEY, token)
+        except Exception as e:
+            print(f"Error al guardar la sesión: {e}")
+    
+    def forget_session(self):
+        """Borra el token de sesión guardado en el cliente."""
+        try:
+            self.page.client_storage.remove(SESSION_STORAGE_KEY)
+        except Exception as e:
+            print(f"Error al borrar la sesión guardada: {e}")
+    
+    def start_session(self, session: ChatSession):
+        """
+        Abre la pantalla de chat de un usuario ya autenticado.
+        
+        Args:
+            session: Sesión de ChatEngine (con su conversación ya abierta)
+        """
+        self.session = session
+        
+        # Tema preferido del usuario (el perfil ya está en caché)
+        self.is_dark_mode = session.theme != "light"
+        self.apply_theme()
+        
+        self.show_chat_screen()
     
     def show_error_dialog(self, message: str):
         """Muestra un diálogo de error."""
@@ -67,27 +247,33 @@ class ChatbotApp:
         )
         self.page.open(dlg)
     
-    def toggle_theme(self, e=None):
-        """Cambia entre modo claro y oscuro."""
-        self.is_dark_mode = not self.is_dark_mode
-        
+    def apply_theme(self):
+        """Aplica a la página el modo claro u oscuro actual."""
         if self.is_dark_mode:
             self.page.theme_mode = ft.ThemeMode.DARK
             self.page.bgcolor = "#1a1a1a"
         else:
             self.page.theme_mode = ft.ThemeMode.LIGHT
             self.page.bgcolor = "white"
+    
+    def toggle_theme(self, e=None):
+        """Cambia entre modo claro y oscuro sin volver a leer la base de datos."""
+        self.is_dark_mode = not self.is_dark_mode
+        self.apply_theme()
         
-        # Recargar la pantalla actual
-        if self.current_user_id is None:
-            self.show_login_screen()
-        else:
-            self.show_chat_screen()
+        # Guardar la preferencia del usuario fuera del hilo de la UI
+        if self.session is not None:
+            self.page.run_thread(self.session.set_theme, "dark" if self.is_dark_mode else "light")
+        
+        # Solo cambian los colores de los controles ya dibujados
+        if self.restyle_screen is not None:
+            self.restyle_screen()
+        self.page.update()
     
     def show_login_screen(self):
         """Muestra la pantalla de selección de usuarios."""
-        # Obtener todos los usuarios
-        users = self.db.get_all_users()
+        # Primera página de usuarios (uno más para saber si hay más páginas)
+        users = self.db.get_users_page(limit=USER_PAGE_SIZE + 1)
         
         # Si no hay usuarios, mostrar pantalla de registro directamente
         if not users:
@@ -96,7 +282,7 @@ class ChatbotApp:
         
         # Mensaje de advertencia sobre Groq API
         groq_warning = ft.Container(visible=False)
-        if self.groq_error:
+        if self.engine.groq_error:
             groq_warning = ft.Container(
                 content=ft.Row(
                     [
@@ -121,40 +307,57 @@ class ChatbotApp:
             """Maneja el clic en una tarjeta de usuario."""
             self.show_password_screen(username)
         
-        # Crear tarjetas de usuario
-        user_cards = []
-        for user in users:
-            username = user['username']
-            
-            # Usar diferentes colores para cada usuario (tonos verdes institucionales)
-            colors = ["#A4D65E", "#00A859", "#A4D65E", "#00A859", "#A4D65E"]
-            color = colors[user['id'] % len(colors)]
-            
-            user_card = ft.Container(
-                content=ft.Column(
-                    [
-                        ft.Icon(ft.Icons.ACCOUNT_CIRCLE, size=50, color=color),
-                        ft.Text(
-                            username,
-                            size=16,
-                            weight=ft.FontWeight.BOLD,
-                            color="white",
-                            text_align=ft.TextAlign.CENTER,
-                        ),
-                    ],
-                    horizontal_alignment=ft.CrossAxisAlignment.CENTER,
-                    spacing=8,
-                ),
-                padding=20,
-                border_radius=12,
-                bgcolor="#006341",
-                border=ft.border.all(2, "#00A859"),
-                width=140,
-                height=140,
-                on_click=lambda e, u=username: on_user_click(u),
-                ink=True,
+        # Filtro y último usuario mostrado (clave de la página siguiente)
+        picker = {"prefix": "", "last": None}
+        
+        def show_users(page_users, reset: bool):
+            """Dibuja una página de usuarios (page_users trae uno de más si hay otra página)."""
+            has_more = len(page_users) > USER_PAGE_SIZE
+            page_users = page_users[:USER_PAGE_SIZE]
+            cards = [create_user_card(user, on_user_click) for user in page_users]
+            if reset:
+                user_grid.controls = cards + [add_user_card]
+            else:
+                user_grid.controls[-1:-1] = cards
+            if page_users:
+                picker["last"] = (page_users[-1]['username'], page_users[-1]['id'])
+            more_button.visible = has_more
+        
+        def on_search_change(e):
+            """Filtra los usuarios por el prefijo escrito."""
+            picker["prefix"] = search_field.value.strip()
+            picker["last"] = None
+            show_users(self.db.get_users_page(picker["prefix"], limit=USER_PAGE_SIZE + 1), reset=True)
+            self.page.update()
+        
+        def on_more_click(e):
+            """Carga la página siguiente de usuarios."""
+            show_users(
+                self.db.get_users_page(picker["prefix"], picker["last"], limit=USER_PAGE_SIZE + 1),
+                reset=False
             )
-            user_cards.append(user_card)
+            self.page.update()
+        
+        # Buscador, solo si los usuarios no caben en una página
+        search_field = ft.TextField(
+            hint_text="Buscar usuario...",
+            prefix_icon=ft.Icons.SEARCH_ROUNDED,
+            width=300,
+            bgcolor="#006341",
+            border_color="#00A859",
+            focused_border_color="#A4D65E",
+            border_radius=10,
+            text_size=14,
+            color="white",
+            on_change=on_search_change,
+            visible=len(users) > USER_PAGE_SIZE,
+        )
+        
+        more_button = ft.TextButton(
+            "Mostrar más usuarios",
+            on_click=on_more_click,
+            style=ft.ButtonStyle(color="#A4D65E"),
+        )
         
         # Botón para agregar nuevo usuario
         add_user_card = ft.Container(
@@ -181,16 +384,15 @@ class ChatbotApp:
             on_click=lambda e: self.show_register_screen(),
             ink=True,
         )
-        user_cards.append(add_user_card)
         
         # Grid de usuarios (máximo 4 por fila)
         user_grid = ft.Row(
-            controls=user_cards,
             wrap=True,
             spacing=15,
             run_spacing=15,
             alignment=ft.MainAxisAlignment.CENTER,
         )
+        show_users(users, reset=True)
         
         # Botón de cambio de tema
         theme_button = ft.IconButton(
@@ -203,6 +405,28 @@ class ChatbotApp:
         # Logo como marca de agua
         logo_path = "logo_udl_dark.png" if self.is_dark_mode else "logo_udl.png"
         
+        title_text = ft.Text(
+            "Chatbot IA",
+            size=32,
+            weight=ft.FontWeight.BOLD,
+            color="white" if self.is_dark_mode else "#006341",
+        )
+        footer_text = ft.Text(
+            "Powered by Manu",
+            size=12,
+            color="#006341" if not self.is_dark_mode else "#A4D65E",
+            weight=ft.FontWeight.W_500,
+            italic=True,
+        )
+        
+        def restyle():
+            """Aplica el tema actual a los controles que dependen de él."""
+            theme_button.icon = ft.Icons.LIGHT_MODE if self.is_dark_mode else ft.Icons.DARK_MODE
+            title_text.color = "white" if self.is_dark_mode else "#006341"
+            footer_text.color = "#006341" if not self.is_dark_mode else "#A4D65E"
+        
+        self.restyle_screen = restyle
+        
         # Layout principal
         login_container = ft.Container(
             content=ft.Column(
@@ -217,12 +441,7 @@ class ChatbotApp:
                     ),
                     ft.Container(height=20),
                     ft.Icon(ft.Icons.SMART_TOY_ROUNDED, size=80, color="#A4D65E"),
-                    ft.Text(
-                        "Chatbot IA",
-                        size=32,
-                        weight=ft.FontWeight.BOLD,
-                        color="white" if self.is_dark_mode else "#006341",
-                    ),
+                    title_text,
                     ft.Text(
                         "Universidad de León",
                         size=14,
@@ -237,18 +456,14 @@ class ChatbotApp:
                     ft.Container(height=10),
                     groq_warning,
                     ft.Container(height=20),
+                    search_field,
                     ft.Container(
                         content=user_grid,
                         padding=10,
                     ),
+                    more_button,
                     ft.Container(height=30),
-                    ft.Text(
-                        "Powered by Manu",
-                        size=12,
-                        color="#006341" if not self.is_dark_mode else "#A4D65E",
-                        weight=ft.FontWeight.W_500,
-                        italic=True,
-                    ),
+                    footer_text,
                 ],
                 horizontal_alignment=ft.CrossAxisAlignment.CENTER,
                 scroll=ft.ScrollMode.AUTO,
@@ -264,6 +479,8 @@ class ChatbotApp:
     
     def show_password_screen(self, username: str):
         """Muestra la pantalla para ingresar contraseña de un usuario específico."""
+        self.restyle_screen = None
+        
         # Campo de contraseña
         password_field = ft.TextField(
             label="Contraseña",
@@ -283,6 +500,39 @@ class ChatbotApp:
         # Mensaje de error
         error_text = ft.Text("", color="#F87171", size=12)
         
+        # Indicador mientras se comprueba la contraseña
+        progress_ring = ft.ProgressRing(width=20, height=20, color="#A4D65E", visible=False)
+        
+        # Guardar un token de sesión en este navegador (desactivado por defecto)
+        remember_checkbox = ft.Checkbox(
+            label="Recordarme en este dispositivo",
+            value=False,
+            active_color="#00A859",
+            check_color="white",
+        )
+        
+        def set_busy(busy: bool):
+            password_field.disabled = busy
+            remember_checkbox.disabled = busy
+            login_button.disabled = busy
+            progress_ring.visible = busy
+            self.page.update()
+        
+        def finish_login(session: Optional[ChatSession]):
+            """Continúa el inicio de sesión cuando termina bcrypt (en el pool de autenticación)."""
+            if session is not None:
+                self.start_session(session)
+                # Solo si el usuario lo pide: en un equipo compartido el
+                # siguiente entraría con su cuenta
+                if remember_checkbox.value:
+                    self.remember_session()
+                else:
+                    self.forget_session()
+            else:
+                error_text.value = "Contraseña incorrecta"
+                password_field.value = ""
+                set_busy(False)
+        
         def on_login_click(e):
             """Maneja el inicio de sesión."""
             password = password_field.value
@@ -292,17 +542,21 @@ class ChatbotApp:
                 self.page.update()
                 return
             
-            # Validar usuario
-            valid, user_id = self.db.validate_user(username, password)
-            
-            if valid:
-                self.current_user_id = user_id
-                self.current_username = username
-                self.show_chat_screen()
-            else:
-                error_text.value = "Contraseña incorrecta"
-                password_field.value = ""
-                self.page.update()
+            # Validar usuario fuera del manejador para no congelar la UI
+            error_text.value = ""
+            set_busy(True)
+            future = run_in_background(self.engine.login, username, password)
+            future.add_done_callback(on_login_done)
+        
+        def on_login_done(future):
+            """Recoge el resultado del pool; un error no debe dejar la pantalla bloqueada."""
+            error = future.exception()
+            if error is not None:
+                print(f"Error al iniciar sesión: {error}")
+                error_text.value = "No se pudo iniciar sesión, inténtalo de nuevo"
+                set_busy(False)
+                return
+            finish_login(future.result())
         
         def on_back_click(e):
             """Vuelve a la selección de usuarios."""
@@ -345,7 +599,9 @@ class ChatbotApp:
                     ),
                     ft.Container(height=30),
                     password_field,
+                    remember_checkbox,
                     error_text,
+                    progress_ring,
                     ft.Container(height=10),
                     login_button,
                     back_button,
@@ -367,6 +623,8 @@ class ChatbotApp:
     
     def show_register_screen(self, first_user: bool = False):
         """Muestra la pantalla de registro."""
+        self.restyle_screen = None
+        
         # Campos de entrada
         username_field = ft.TextField(
             label="Nuevo Usuario",
@@ -419,45 +677,43 @@ class ChatbotApp:
             confirm_password = confirm_password_field.value
             
             # Validaciones
-            if not username or not password or not confirm_password:
-                message_text.value = "Por favor completa todos los campos"
-                message_text.color = "#F87171"
-                self.page.update()
-                return
-            
-            if len(username) < 3:
-                message_text.value = "El usuario debe tener al menos 3 caracteres"
+            error = ChatEngine.validate_registration(username, password, confirm_password)
+            if error:
+                message_text.value = error
                 message_text.color = "#F87171"
                 self.page.update()
                 return
             
-            if len(password) < 6:
-                message_text.value = "La contraseña debe tener al menos 6 caracteres"
-                message_text.color = "#F87171"
-                self.page.update()
-                return
-            
-            if password != confirm_password:
-                message_text.value = "Las contraseñas no coinciden"
-                message_text.color = "#F87171"
-                self.page.update()
+            # Crear usuario (bcrypt, en el pool de autenticación)
+            register_button.disabled = True
+            message_text.value = "Creando usuario..."
+            message_text.color = "#A4D65E"
+            self.page.update()
+            future = run_in_background(self.engine.register, username, password)
+            future.add_done_callback(on_register_done)
+        
+        def on_register_done(future):
+            """Recoge el resultado del pool; un error no debe dejar la pantalla bloqueada."""
+            error = future.exception()
+            if error is not None:
+                print(f"Error al crear usuario: {error}")
+                finish_register(False, "No se pudo crear el usuario, inténtalo de nuevo")
                 return
-            
-            # Crear usuario
-            success, msg = self.db.create_user(username, password)
-            
+            finish_register(*future.result())
+        
+        def finish_register(success: bool, msg: str):
+            """Muestra el resultado del registro cuando termina bcrypt."""
             if success:
                 message_text.value = "¡Usuario creado! Redirigiendo..."
                 message_text.color = "#10B981"
                 self.page.update()
                 
-                # Esperar un momento y volver al login
-                import time
-                time.sleep(1.5)
-                self.show_login_screen()
+                # Esperar un momento y volver al login (sin ocupar el pool de autenticación)
+                threading.Timer(1.5, self.show_login_screen).start()
             else:
                 message_text.value = msg
                 message_text.color = "#F87171"
+                register_button.disabled = False
                 self.page.update()
         
         def on_back_click(e):
@@ -540,11 +796,10 @@ class ChatbotApp:
             expand=True,
             spacing=10,
             padding=20,
-            auto_scroll=True,
         )
         
-        # Cargar historial de mensajes
-        self.load_chat_history(message_list)
+        # Cargar historial de mensajes (la vista cambia al abrir un resultado de búsqueda)
+        history = {"state": self.load_chat_history(message_list)}
         
         # Campo de entrada
         message_input = ft.TextField(
@@ -566,60 +821,332 @@ class ChatbotApp:
         # Indicador de carga
         loading_indicator = ft.ProgressRing(visible=False, width=20, height=20, color="#A4D65E")
         
+        # Botón para cancelar la respuesta en curso
+        cancel_button = ft.IconButton(
+            icon=ft.Icons.STOP_CIRCLE_ROUNDED,
+            on_click=lambda e: self.chat_worker.cancel(),
+            tooltip="Cancelar respuesta",
+            icon_color="#F87171",
+            visible=False,
+        )
+        
+        def run_turn(
+            cancel_event,
+            session: ChatSession,
+            conversation_id: int,
+            conversation: ConversationBuffer,
+            user_message: str,
+            response_text: ft.Text
+        ):
+            """Procesa un turno en el hilo de fondo y dibuja la respuesta a medida que llega."""
+            loading_indicator.visible = True
+            cancel_button.visible = True
+            self.page.update()
+            
+            # Mostrar la respuesta del asistente a medida que se genera
+            chunks = []
+            last_update = [0.0]
+            
+            def show_delta(delta: str):
+                chunks.append(delta)
+                now = time.monotonic()
+                if now - last_update[0] >= STREAM_UPDATE_INTERVAL:
+                    with metrics.span('render'):
+                        response_text.value = "".join(chunks)
+                        loading_indicator.visible = False
+                        self.page.update()
+                        message_list.scroll_to(offset=-1)
+                    last_update[0] = now
+            
+            result = TurnResult()
+            try:
+                result = session.run_turn(
+                    user_message,
+                    cancel_event,
+                    on_delta=show_delta,
+                    # El primer mensaje da título a la conversación
+                    on_title=lambda title: refresh_sidebar(),
+                    conversation_id=conversation_id,
+                    conversation=conversation
+                )
+            
+            finally:
+                if result.error is not None:
+                    response_text.value = f"Error al obtener respuesta: {str(result.error)}"
+                elif result.content:
+                    response_text.value = result.content
+                    
+                    # Actualizar la vista previa de la conversación en la barra lateral
+                    preview_text = sidebar_previews.get(conversation_id)
+                    if preview_text is not None:
+                        preview_text.value = result.content[:CONVERSATION_PREVIEW_CHARS]
+                else:
+                    response_text.value = "Respuesta cancelada"
+                    response_text.italic = True
+                
+                # Ocultar indicadores si no quedan turnos en cola
+                busy = self.chat_worker.queued > 0
+                loading_indicator.visible = busy
+                cancel_button.visible = busy
+                with metrics.span('render'):
+                    self.page.update()
+        
         def send_message(e):
-            """Envía un mensaje al chatbot."""
+            """Envía un mensaje al chatbot sin bloquear la interfaz."""
             user_message = message_input.value.strip()
             
             if not user_message:
                 return
             
-            if not self.groq_client:
+            if self.engine.groq_client is None:
                 self.show_error_dialog("Cliente de Groq no inicializado. Verifica tu API key.")
                 return
             
             # Limpiar campo de entrada
             message_input.value = ""
-            message_input.disabled = True
-            loading_indicator.visible = True
+            
+            # Si se está viendo un resultado de búsqueda, volver a los últimos mensajes
+            if not history["state"]["at_latest"]:
+                history["state"] = self.load_chat_history(message_list)
+                latest_button.visible = False
+            
+            # Mostrar el mensaje del usuario y reservar el hueco de la respuesta
+            self.add_message_to_ui(message_list, "user", user_message, update_page=False)
+            response_text = self.add_message_to_ui(
+                message_list, "assistant", "", update_page=False
+            )
+            message_input.focus()
             self.page.update()
             
-            # Mostrar mensaje del usuario
-            self.add_message_to_ui(message_list, "user", user_message)
+            # El turno se procesa en segundo plano, después de los que ya estén en cola
+            session = self.session
+            conversation_id = session.conversation_id
+            conversation = session.conversation
+            self.chat_worker.submit(
+                lambda cancel_event: run_turn(
+                    cancel_event, session, conversation_id, conversation, user_message, response_text
+                )
+            )
+        
+        def show_latest(e=None):
+            """Vuelve a mostrar los mensajes más recientes."""
+            history["state"] = self.load_chat_history(message_list)
+            latest_button.visible = False
+            self.page.update()
+            message_list.scroll_to(offset=-1)
+        
+        # Botón para volver al final tras abrir un resultado de búsqueda
+        latest_button = ft.IconButton(
+            icon=ft.Icons.ARROW_DOWNWARD_ROUNDED,
+            on_click=show_latest,
+            tooltip="Ir a los mensajes recientes",
+            icon_color="#A4D65E",
+            visible=False,
+        )
+        
+        def jump_to_message(message_id: int, conversation_id: int):
+            """Muestra un mensaje del historial con los mensajes de alrededor."""
+            if conversation_id != self.conversation_id:
+                self.session.open_conversation(conversation_id)
+                mark_selected_conversation()
+            history["state"] = self.load_chat_history(message_list, anchor_id=message_id)
+            latest_button.visible = not history["state"]["at_latest"]
+            self.page.update()
+            message_list.scroll_to(key=f"msg-{message_id}")
+        
+        def on_search_click(e):
+            """Abre el buscador del historial."""
+            results_list = ft.ListView(spacing=5, height=320, width=500)
             
-            # Guardar mensaje del usuario en BD
-            self.db.save_message(self.current_user_id, "user", user_message)
+            def open_result(message_id: int, conversation_id: int):
+                self.page.close(search_dialog)
+                jump_to_message(message_id, conversation_id)
             
-            # Obtener historial de conversación
-            history = self.db.get_user_messages(self.current_user_id)
-            conversation_history = [
-                {"role": msg["role"], "content": msg["content"]}
-                for msg in history[:-1]  # Excluir el último mensaje que acabamos de agregar
-            ]
+            def run_search(e):
+                query = search_input.value.strip()
+                if len(query) < SEARCH_MIN_CHARS:
+                    results_list.controls.clear()
+                    self.page.update()
+                    return
+                
+                results = self.db.search_messages(
+                    self.current_user_id, query, limit=SEARCH_RESULT_LIMIT
+                )
+                results_list.controls = [
+                    ft.ListTile(
+                        leading=ft.Icon(
+                            ft.Icons.PERSON_ROUNDED if result["role"] == "user" else ft.Icons.SMART_TOY_ROUNDED,
+                            color="#A4D65E",
+                        ),
+                        title=ft.Text(result["snippet"], size=13, color="white"),
+                        subtitle=ft.Text(result["timestamp"], size=11, color="#A4D65E"),
+                        on_click=lambda e, message_id=result["id"], conversation_id=result["conversation_id"]: (
+                            open_result(message_id, conversation_id)
+                        ),
+                    )
+                    for result in results
+                ] or [ft.Text("Sin resultados", color="white", italic=True)]
+                self.page.update()
             
-            # Obtener respuesta del chatbot
-            try:
-                assistant_response = self.groq_client.chat_with_context(
-                    user_message,
-                    conversation_history,
-                    DEFAULT_SYSTEM_PROMPT
+            search_input = ft.TextField(
+                hint_text="Buscar en el historial...",
+                autofocus=True,
+                border_radius=25,
+                border_color="#00A859",
+                focused_border_color="#A4D65E",
+                text_size=14,
+                color="white",
+                hint_style=ft.TextStyle(color="#A4D65E"),
+                prefix_icon=ft.Icons.SEARCH_ROUNDED,
+                on_change=run_search,
+                on_submit=run_search,
+            )
+            
+            search_dialog = ft.AlertDialog(
+                title=ft.Text("Buscar", color="white"),
+                content=ft.Column([search_input, results_list], tight=True, spacing=10),
+                actions=[
+                    ft.TextButton("Cerrar", on_click=lambda e: self.page.close(search_dialog)),
+                ],
+                bgcolor="#006341",
+            )
+            self.page.open(search_dialog)
+        
+        # Barra lateral de conversaciones
+        conversation_list = ft.ListView(expand=True, spacing=2)
+        sidebar_tiles = {}
+        sidebar_previews = {}
+        
+        def mark_selected_conversation():
+            """Resalta en la barra lateral la conversación abierta."""
+            for conversation_id, tile in sidebar_tiles.items():
+                tile.selected = conversation_id == self.conversation_id
+        
+        def refresh_sidebar():
+            """Dibuja las conversaciones y carga sus vistas previas en segundo plano."""
+            conversations = self.db.get_conversations(
+                self.current_user_id, limit=SIDEBAR_CONVERSATION_LIMIT
+            )
+            sidebar_tiles.clear()
+            sidebar_previews.clear()
+            conversation_list.controls.clear()
+            
+            for conversation in conversations:
+                conversation_id = conversation["id"]
+                sidebar_previews[conversation_id] = ft.Text(
+                    "", size=11, color="#A4D65E", max_lines=1, overflow=ft.TextOverflow.ELLIPSIS
                 )
-                
-                # Mostrar respuesta del asistente
-                self.add_message_to_ui(message_list, "assistant", assistant_response)
-                
-                # Guardar respuesta en BD
-                self.db.save_message(self.current_user_id, "assistant", assistant_response)
+                tile = ft.ListTile(
+                    title=ft.Text(
+                        conversation["title"],
+                        size=13,
+                        color="white",
+                        max_lines=1,
+                        overflow=ft.TextOverflow.ELLIPSIS,
+                    ),
+                    subtitle=sidebar_previews[conversation_id],
+                    trailing=ft.IconButton(
+                        icon=ft.Icons.DELETE_OUTLINE_ROUNDED,
+                        on_click=lambda e, conversation_id=conversation_id: (
+                            on_delete_conversation_click(conversation_id)
+                        ),
+                        tooltip="Eliminar conversación",
+                        icon_color="#F87171",
+                        icon_size=16,
+                    ),
+                    on_click=lambda e, conversation_id=conversation_id: (
+                        switch_conversation(conversation_id)
+                    ),
+                    selected_tile_color="#00A859",
+                    dense=True,
+                )
+                sidebar_tiles[conversation_id] = tile
+                conversation_list.controls.append(tile)
             
-            except Exception as ex:
-                error_msg = f"Error al obtener respuesta: {str(ex)}"
-                self.add_message_to_ui(message_list, "assistant", error_msg)
+            mark_selected_conversation()
+            self.page.update()
             
-            finally:
-                # Rehabilitar entrada
-                message_input.disabled = False
-                loading_indicator.visible = False
-                message_input.focus()
+            def load_previews():
+                """Rellena las vistas previas sin retrasar el dibujo de la lista."""
+                preview_texts = dict(sidebar_previews)
+                previews = self.db.get_conversation_previews(list(preview_texts))
+                for conversation_id, preview in previews.items():
+                    preview_texts[conversation_id].value = preview
                 self.page.update()
+            
+            self.page.run_thread(load_previews)
+        
+        def show_conversation(conversation_id: Optional[int]):
+            """Abre una conversación y dibuja su historial."""
+            self.session.open_conversation(conversation_id)
+            history["state"] = self.load_chat_history(message_list)
+            latest_button.visible = False
+            mark_selected_conversation()
+            self.page.update()
+            message_list.scroll_to(offset=-1)
+        
+        def switch_conversation(conversation_id: int):
+            """Cambia a otra conversación de la barra lateral."""
+            if conversation_id != self.conversation_id:
+                show_conversation(conversation_id)
+        
+        def on_new_conversation_click(e):
+            """Empieza una conversación nueva sin borrar las anteriores."""
+            conversation_id = self.session.new_conversation()
+            if conversation_id is None:
+                self.show_error_dialog("No se pudo crear la conversación")
+                return
+            refresh_sidebar()
+            show_conversation(conversation_id)
+        
+        def on_delete_conversation_click(conversation_id: int):
+            """Elimina una conversación y sus mensajes."""
+            def finish_delete_conversation(session: ChatSession):
+                if self.session is session:
+                    refresh_sidebar()
+            
+            def confirm_delete_conversation(e):
+                if conversation_id == self.conversation_id:
+                    self.chat_worker.cancel_all()
+                self.page.close(confirm_dialog)
+                if conversation_id == self.conversation_id:
+                    show_conversation(None)
+                
+                # Los mensajes se borran por lotes en segundo plano
+                session = self.session
+                session.delete_conversation(
+                    conversation_id, on_done=lambda _: finish_delete_conversation(session)
+                )
+            
+            confirm_dialog = ft.AlertDialog(
+                title=ft.Text("Confirmar", color="white"),
+                content=ft.Text("¿Eliminar esta conversación y todos sus mensajes?", color="white"),
+                actions=[
+                    ft.TextButton("Cancelar", on_click=lambda e: self.page.close(confirm_dialog)),
+                    ft.TextButton("Eliminar", on_click=confirm_delete_conversation, style=ft.ButtonStyle(color="#F87171")),
+                ],
+                bgcolor="#006341",
+            )
+            self.page.open(confirm_dialog)
+        
+        sidebar = ft.Container(
+            content=ft.Column(
+                [
+                    ft.TextButton(
+                        "Nueva conversación",
+                        icon=ft.Icons.ADD_COMMENT_ROUNDED,
+                        on_click=on_new_conversation_click,
+                        style=ft.ButtonStyle(color="#A4D65E"),
+                    ),
+                    conversation_list,
+                ],
+                spacing=5,
+            ),
+            width=240,
+            padding=ft.padding.only(left=10, right=10, top=10, bottom=10),
+            bgcolor="#004D32",
+            border=ft.border.only(right=ft.BorderSide(2, "#00A859")),
+        )
         
         # Botón enviar
         send_button = ft.IconButton(
@@ -641,21 +1168,33 @@ class ChatbotApp:
         
         def on_logout_click(e):
             """Cierra sesión y vuelve al login."""
-            self.current_user_id = None
-            self.current_username = None
+            self.chat_worker.cancel_all()
+            # Revocar también las copias del token que hubiera en otros sitios
+            self.session.revoke_tokens()
+            self.session.close()
+            self.forget_session()
+            self.session = None
             self.show_login_screen()
         
         def on_clear_chat_click(e):
-            """Limpia el historial de chat."""
+            """Limpia el historial de la conversación abierta."""
+            def finish_clear(session: ChatSession):
+                if self.session is session:
+                    refresh_sidebar()
+            
             def confirm_clear(e):
-                self.db.clear_user_messages(self.current_user_id)
+                self.chat_worker.cancel_all()
                 message_list.controls.clear()
                 self.page.close(confirm_dialog)
                 self.page.update()
+                
+                # Los mensajes se borran por lotes en segundo plano
+                session = self.session
+                session.clear_conversation(on_done=lambda _: finish_clear(session))
             
             confirm_dialog = ft.AlertDialog(
                 title=ft.Text("Confirmar", color="white"),
-                content=ft.Text("¿Estás seguro de que deseas limpiar todo el historial de chat?", color="white"),
+                content=ft.Text("¿Estás seguro de que deseas limpiar el historial de esta conversación?", color="white"),
                 actions=[
                     ft.TextButton("Cancelar", on_click=lambda e: self.page.close(confirm_dialog)),
                     ft.TextButton("Limpiar", on_click=confirm_clear, style=ft.ButtonStyle(color="#A4D65E")),
@@ -666,21 +1205,42 @@ class ChatbotApp:
         
         def on_delete_account_click(e):
             """Elimina la cuenta del usuario actual."""
-            def confirm_delete(e):
-                # Eliminar el usuario
-                success, message = self.db.delete_user(self.current_user_id)
+            progress_bar = ft.ProgressBar(width=300, value=0, color="#A4D65E", bgcolor="#004D32")
+            progress_text = ft.Text("Eliminando mensajes...", size=12, color="white")
+            
+            def show_progress(deleted: int, total: int):
+                """Actualiza la barra solo cuando avanza al menos un 1 %."""
+                value = deleted / total if total else 1.0
+                if value - progress_bar.value >= 0.01 or deleted == total:
+                    progress_bar.value = value
+                    progress_text.value = f"Eliminando mensajes... {deleted}/{total}"
+                    self.page.update()
+            
+            def finish_delete(result: Optional[Tuple[bool, str]]):
+                """Continúa cuando termina el borrado (en el hilo del borrado)."""
+                success, message = result or (False, "el borrado no terminó")
                 
                 self.page.close(confirm_dialog)
                 
                 if success:
+                    self.forget_session()
+                    
                     # Mostrar mensaje de éxito y volver al login
                     self.show_info_dialog("Cuenta Eliminada", "Tu cuenta y todos tus datos han sido eliminados.")
-                    self.current_user_id = None
-                    self.current_username = None
+                    self.session = None
                     self.show_login_screen()
                 else:
                     self.show_error_dialog(f"Error al eliminar cuenta: {message}")
             
+            def confirm_delete(e):
+                # Eliminar el usuario por lotes en segundo plano, mostrando el progreso
+                self.chat_worker.cancel_all()
+                confirm_dialog.content = ft.Column([progress_text, progress_bar], tight=True)
+                confirm_dialog.actions = []
+                confirm_dialog.modal = True
+                self.page.update()
+                self.session.delete_account(on_progress=show_progress, on_done=finish_delete)
+            
             confirm_dialog = ft.AlertDialog(
                 title=ft.Text("⚠️ Eliminar Cuenta", color="#F87171"),
                 content=ft.Text(
@@ -704,6 +1264,27 @@ class ChatbotApp:
             )
             self.page.open(confirm_dialog)
         
+        # Controles que cambian con el tema
+        theme_button = ft.IconButton(
+            icon=ft.Icons.LIGHT_MODE if self.is_dark_mode else ft.Icons.DARK_MODE,
+            on_click=self.toggle_theme,
+            tooltip="Cambiar tema",
+            icon_color="#A4D65E",
+            icon_size=20,
+        )
+        message_area = ft.Container(
+            content=message_list,
+            expand=True,
+            bgcolor="white" if not self.is_dark_mode else "#1a1a1a",
+        )
+        
+        def restyle():
+            """Aplica el tema actual sin volver a cargar la barra lateral ni el historial."""
+            theme_button.icon = ft.Icons.LIGHT_MODE if self.is_dark_mode else ft.Icons.DARK_MODE
+            message_area.bgcolor = "white" if not self.is_dark_mode else "#1a1a1a"
+        
+        self.restyle_screen = restyle
+        
         # Barra superior con diseño elegante
         top_bar = ft.Container(
             content=ft.Row(
@@ -732,17 +1313,18 @@ class ChatbotApp:
                     ),
                     ft.Row(
                         [
+                            theme_button,
                             ft.IconButton(
-                                icon=ft.Icons.LIGHT_MODE if self.is_dark_mode else ft.Icons.DARK_MODE,
-                                on_click=self.toggle_theme,
-                                tooltip="Cambiar tema",
+                                icon=ft.Icons.SEARCH_ROUNDED,
+                                on_click=on_search_click,
+                                tooltip="Buscar en el historial",
                                 icon_color="#A4D65E",
                                 icon_size=20,
                             ),
                             ft.IconButton(
                                 icon=ft.Icons.DELETE_SWEEP_ROUNDED,
                                 on_click=on_clear_chat_click,
-                                tooltip="Limpiar historial",
+                                tooltip="Limpiar conversación",
                                 icon_color="#A4D65E",
                                 icon_size=20,
                             ),
@@ -775,8 +1357,10 @@ class ChatbotApp:
         bottom_bar = ft.Container(
             content=ft.Row(
                 [
+                    latest_button,
                     message_input,
                     loading_indicator,
+                    cancel_button,
                     send_button,
                 ],
                 spacing=10,
@@ -790,12 +1374,22 @@ class ChatbotApp:
         chat_layout = ft.Column(
             [
                 top_bar,
-                ft.Container(
-                    content=message_list,
+                ft.Row(
+                    [
+                        sidebar,
+                        ft.Column(
+                            [
+                                message_area,
+                                bottom_bar,
+                            ],
+                            spacing=0,
+                            expand=True,
+                        ),
+                    ],
+                    spacing=0,
                     expand=True,
-                    bgcolor="white" if not self.is_dark_mode else "#1a1a1a",
+                    vertical_alignment=ft.CrossAxisAlignment.STRETCH,
                 ),
-                bottom_bar,
             ],
             spacing=0,
             expand=True,
@@ -803,25 +1397,142 @@ class ChatbotApp:
         
         self.page.clean()
         self.page.add(chat_layout)
+        refresh_sidebar()
         message_input.focus()
         self.page.update()
+        message_list.scroll_to(offset=-1)
     
-    def load_chat_history(self, message_list: ft.ListView):
+    def load_chat_history(
+        self,
+        message_list: ft.ListView,
+        anchor_id: Optional[int] = None
+    ) -> Dict:
         """
-        Carga el historial de chat del usuario.
+        Carga una página del historial y las contiguas al hacer scroll.
+        
+        Sin anchor_id se dibuja la última página; las anteriores se toman
+        primero de la conversación en memoria y, cuando se agota, de la base
+        de datos paginando por id de mensaje. Con anchor_id se dibuja ese
+        mensaje con los de alrededor y se pagina desde la base de datos en
+        ambos sentidos, sin cargar el resto del historial.
         
         Args:
             message_list: ListView donde mostrar los mensajes
+            anchor_id: ID del mensaje a mostrar (None para los más recientes)
+            
+        Returns:
+            Estado de la vista; "at_latest" indica si llega hasta el último mensaje
         """
-        messages = self.db.get_user_messages(self.current_user_id)
-        
-        for msg in messages:
-            self.add_message_to_ui(
-                message_list,
-                msg["role"],
-                msg["content"],
-                update_page=False
+        conversation = self.conversation
+        conversation_id = self.conversation_id
+        user_id = self.current_user_id
+        messages = conversation.messages()
+        message_list.controls.clear()
+        
+        if anchor_id is None:
+            # Índice del mensaje más antiguo dibujado de la conversación en memoria
+            buffer_start = max(0, len(messages) - HISTORY_PAGE_SIZE)
+            for msg in messages[buffer_start:]:
+                self.add_message_to_ui(
+                    message_list,
+                    msg["role"],
+                    msg["content"],
+                    update_page=False
+                )
+            
+            state = {
+                "buffer_start": buffer_start,
+                "before_id": conversation.oldest_id,
+                "exhausted": conversation.oldest_id is None,
+                "after_id": None,
+                "at_latest": True,
+                "loading": False,
+            }
+        else:
+            older = self.db.get_messages_page(
+                user_id, before_id=anchor_id + 1, limit=HISTORY_PAGE_SIZE,
+                conversation_id=conversation_id
+            )
+            newer = self.db.get_messages_after(
+                user_id, anchor_id, limit=HISTORY_PAGE_SIZE, conversation_id=conversation_id
+            )
+            for msg in older + newer:
+                bubble = create_message_bubble(msg["role"], msg["content"])[0]
+                if msg["id"] == anchor_id:
+                    # Resaltar el resultado y permitir hacer scroll hasta él
+                    bubble.key = f"msg-{anchor_id}"
+                    bubble.border = ft.border.all(2, "#FACC15")
+                message_list.controls.append(bubble)
+            
+            state = {
+                "buffer_start": 0,
+                "before_id": older[0]["id"] if older else anchor_id,
+                "exhausted": len(older) < HISTORY_PAGE_SIZE,
+                "after_id": newer[-1]["id"] if newer else anchor_id,
+                "at_latest": len(newer) < HISTORY_PAGE_SIZE,
+                "loading": False,
+            }
+        
+        def load_older_page():
+            """Inserta al principio la página anterior a la más antigua dibujada."""
+            if state["buffer_start"] > 0:
+                end = state["buffer_start"]
+                state["buffer_start"] = max(0, end - HISTORY_PAGE_SIZE)
+                page = messages[state["buffer_start"]:end]
+            elif not state["exhausted"]:
+                page = self.db.get_messages_page(
+                    user_id, before_id=state["before_id"], limit=HISTORY_PAGE_SIZE,
+                    conversation_id=conversation_id
+                )
+                if len(page) < HISTORY_PAGE_SIZE:
+                    state["exhausted"] = True
+                if page:
+                    state["before_id"] = page[0]["id"]
+            else:
+                return
+            
+            bubbles = [create_message_bubble(msg["role"], msg["content"])[0] for msg in page]
+            message_list.controls[0:0] = bubbles
+            self.page.update()
+        
+        def load_newer_page():
+            """Añade al final la página siguiente a la más reciente dibujada."""
+            if state["at_latest"]:
+                return
+            
+            page = self.db.get_messages_after(
+                user_id, state["after_id"], limit=HISTORY_PAGE_SIZE,
+                conversation_id=conversation_id
+            )
+            if len(page) < HISTORY_PAGE_SIZE:
+                state["at_latest"] = True
+            if page:
+                state["after_id"] = page[-1]["id"]
+            
+            message_list.controls.extend(
+                create_message_bubble(msg["role"], msg["content"])[0] for msg in page
             )
+            self.page.update()
+        
+        def on_scroll(e):
+            """Carga más mensajes al acercarse a un extremo de la lista."""
+            if state["loading"]:
+                return
+            if e.pixels <= e.min_scroll_extent + SCROLL_LOAD_THRESHOLD:
+                load_page = load_older_page
+            elif e.pixels >= e.max_scroll_extent - SCROLL_LOAD_THRESHOLD:
+                load_page = load_newer_page
+            else:
+                return
+            
+            state["loading"] = True
+            try:
+                load_page()
+            finally:
+                state["loading"] = False
+        
+        message_list.on_scroll = on_scroll
+        return state
     
     def add_message_to_ui(
         self,
@@ -829,7 +1540,7 @@ class ChatbotApp:
         role: str,
         content: str,
         update_page: bool = True
-    ):
+    ) -> ft.Text:
         """
         Agrega un mensaje a la interfaz de usuario.
         
@@ -838,41 +1549,19 @@ class ChatbotApp:
             role: Rol del mensaje ('user' o 'assistant')
             content: Contenido del mensaje
             update_page: Si se debe actualizar la página
+            
+        Returns:
+            Texto con el contenido del mensaje, para poder actualizarlo en sitio
         """
-        is_user = role == "user"
-        
-        message_bubble = ft.Container(
-            content=ft.Column(
-                [
-                    ft.Text(
-                        "Tú" if is_user else "Asistente IA",
-                        size=11,
-                        weight=ft.FontWeight.BOLD,
-                        color="#A4D65E",
-                    ),
-                    ft.Text(
-                        content,
-                        size=14,
-                        selectable=True,
-                        color="white",
-                    ),
-                ],
-                spacing=5,
-            ),
-            padding=15,
-            border_radius=15,
-            bgcolor="#006341" if is_user else "#00A859",  # Verde oscuro para usuario, verde brillante para asistente
-            border=ft.border.all(1, "#00A859" if is_user else "#A4D65E"),
-            margin=ft.margin.only(
-                left=100 if is_user else 0,
-                right=0 if is_user else 100,
-            ),
-        )
+        message_bubble, content_text = create_message_bubble(role, content)
         
         message_list.controls.append(message_bubble)
         
         if update_page:
             self.page.update()
+            message_list.scroll_to(offset=-1, duration=200)
+        
+        return content_text
 
 
 def main(page: ft.Page):
@@ -0,0 +1,341 @@
+"""
+Métricas de latencia del procesamiento de un turno de chat.
+Mide la duración de cada etapa (escritura en BD, lectura del historial,
+construcción del contexto, primer token, generación, dibujado...) en
+histogramas, acumula el uso que informa Groq y lo exporta a un archivo
+JSONL (un evento por medida) o de texto de Prometheus.
+
+Se configura con variables de entorno (o con configure()):
+    METRICS_ENABLED=1       activa las medidas; por defecto solo se toman
+                            si se indica alguno de los archivos siguientes
+    METRICS_JSONL=ruta      añade una línea JSON por cada medida
+    METRICS_PROMETHEUS=ruta reescribe el archivo en cada export()
+    METRICS_WORKER=n        proceso de la aplicación (lo fija deploy.py): se
+                            añade a los nombres de los archivos y como
+                            etiqueta, para que los procesos no se pisen
+"""
+import atexit
+import bisect
+import json
+import os
+import threading
+import time
+from typing import Dict, List, Optional, TextIO
+
+from dotenv import load_dotenv
+
+
+load_dotenv()
+
+# Límites superiores (ms) de los intervalos de los histogramas
+LATENCY_BUCKETS_MS = (1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000)
+
+# Campos de usage de Groq que se acumulan como contadores...
+USAGE_TOKEN_FIELDS = ('prompt_tokens', 'completion_tokens', 'total_tokens')
+# ...y los que se miden como latencias (Groq los da en segundos)
+USAGE_TIME_FIELDS = ('queue_time', 'prompt_time', 'completion_time', 'total_time')
+
+# Prefijo de los nombres de las métricas exportadas a Prometheus
+PROMETHEUS_PREFIX = 'chatbot_'
+
+WORKER = os.getenv('METRICS_WORKER') or None
+
+
+def _worker_path(path: Optional[str]) -> Optional[str]:
+    """Ruta de un archivo de exportación propia del proceso (ver METRICS_WORKER)."""
+    if not path or WORKER is None:
+        return path
+    root, extension = os.path.splitext(path)
+    return f'{root}.worker-{WORKER}{extension}'
+
+
+JSONL_PATH = _worker_path(os.getenv('METRICS_JSONL'))
+PROMETHEUS_PATH = _worker_path(os.getenv('METRICS_PROMETHEUS'))
+# Desactivadas salvo que se pidan, para no medir en cada ejecución normal
+ENABLED = os.getenv('METRICS_ENABLED', '1' if JSONL_PATH or PROMETHEUS_PATH else '0') != '0'
+
+
+class Histogram:
+    """Histograma de latencias con intervalos fijos, como los de Prometheus."""
+    
+    def __init__(self, buckets=LATENCY_BUCKETS_MS):
+        """
+        Inicializa el histograma vacío.
+        
+        Args:
+            buckets: Límites superiores de los intervalos, en orden creciente
+        """
+        self.buckets = tuple(buckets)
+        # Un intervalo más para los valores por encima del último límite
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.min = 0.0
+        self.max = 0.0
+    
+    def observe(self, value: float):
+        """Añade una medida."""
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        if not self.count or value < self.min:
+            self.min = value
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+    
+    def quantile(self, q: float) -> float:
+        """
+        Estima un cuantil interpolando dentro de su intervalo.
+        
+        La interpolación se limita a los valores observados: en un intervalo
+        ancho con todas las medidas iguales devuelve ese valor, no uno
+        intermedio entre los límites del intervalo.
+        
+        Args:
+            q: Cuantil entre 0 y 1 (por ejemplo, 0.99)
+        
+        Returns:
+            Valor estimado (0 si no hay medidas)
+        """
+        if not self.count:
+            return 0.0
+        
+        rank = q * self.count
+        seen = 0
+        for i, bucket_count in enumerate(self.counts):
+            if seen + bucket_count >= rank and bucket_count:
+                lower = max(self.min, self.buckets[i - 1] if i > 0 else 0.0)
+                upper = min(self.max, self.buckets[i] if i < len(self.buckets) else self.max)
+                return lower + (upper - lower) * (rank - seen) / bucket_count
+            seen += bucket_count
+        return self.max
+    
+    def summary(self) -> Dict[str, float]:
+        """Número de medidas, media, p50, p95, p99 y máximo."""
+        return {
+            'count': self.count,
+            'mean': self.sum / self.count if self.count else 0.0,
+            'p50': self.quantile(0.5),
+            'p95': self.quantile(0.95),
+            'p99': self.quantile(0.99),
+            'max': self.max,
+        }
+
+
+class _Span:
+    """Mide el tiempo de un bloque with y lo registra al salir."""
+    
+    __slots__ = ('name', 'attrs', 'start')
+    
+    def __init__(self, name: str, attrs: Dict):
+        self.name = name
+        self.attrs = attrs
+        self.start = 0.0
+    
+    def __enter__(self) -> "_Span":
+        self.start = time.perf_counter()
+        return self
+    
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.attrs['error'] = exc_type.__name__
+        observe(self.name, (time.perf_counter() - self.start) * 1000, **self.attrs)
+        return False
+
+
+class _NullSpan:
+    """Bloque with que no mide nada (métricas desactivadas)."""
+    
+    __slots__ = ()
+    
+    def __enter__(self) -> "_NullSpan":
+        return self
+    
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+_histograms: Dict[str, Histogram] = {}
+_counters: Dict[str, float] = {}
+_lock = threading.Lock()
+_jsonl_file: Optional[TextIO] = None
+
+
+def configure(
+    enabled: Optional[bool] = None,
+    jsonl_path: Optional[str] = None,
+    prometheus_path: Optional[str] = None
+):
+    """
+    Cambia la configuración leída de las variables de entorno.
+    
+    Args:
+        enabled: Si se toman medidas
+        jsonl_path: Archivo al que se añade un evento JSON por medida
+        prometheus_path: Archivo de texto de Prometheus que escribe export()
+    
+    Con METRICS_WORKER las rutas llevan además el número del proceso.
+    """
+    global ENABLED, JSONL_PATH, PROMETHEUS_PATH, _jsonl_file
+    with _lock:
+        if enabled is not None:
+            ENABLED = enabled
+        jsonl_path = _worker_path(jsonl_path)
+        if jsonl_path is not None and jsonl_path != JSONL_PATH:
+            if _jsonl_file is not None:
+                _jsonl_file.close()
+                _jsonl_file = None
+            JSONL_PATH = jsonl_path or None
+        if prometheus_path is not None:
+            PROMETHEUS_PATH = _worker_path(prometheus_path) or None
+
+
+def span(name: str, **attrs):
+    """
+    Mide la duración de un bloque with como una etapa.
+    
+    Args:
+        name: Nombre de la etapa (por ejemplo, 'db_write' o 'context_build')
+        **attrs: Datos adicionales que acompañan al evento JSONL
+    
+    Returns:
+        Gestor de contexto; si las métricas están desactivadas no hace nada
+    """
+    if not ENABLED:
+        return _NULL_SPAN
+    return _Span(name, attrs)
+
+
+def observe(name: str, ms: float, **attrs):
+    """
+    Registra una duración medida por fuera de span() (por ejemplo, el primer token).
+    
+    Args:
+        name: Nombre de la etapa
+        ms: Duración en milisegundos
+        **attrs: Datos adicionales que acompañan al evento JSONL
+    """
+    if not ENABLED:
+        return
+    with _lock:
+        histogram = _histograms.get(name)
+        if histogram is None:
+            histogram = _histograms[name] = Histogram()
+        histogram.observe(ms)
+        if JSONL_PATH:
+            if WORKER is not None:
+                attrs['worker'] = WORKER
+            _write_event(dict(ts=round(time.time(), 3), name=name, ms=round(ms, 3), **attrs))
+
+
+def increment(name: str, amount: float = 1):
+    """Suma a un contador."""
+    if not ENABLED:
+        return
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + amount
+
+
+def record_usage(usage, source: str = 'chat'):
+    """
+    Acumula el uso que informa Groq en una respuesta.
+    
+    Args:
+        usage: Objeto usage de la respuesta (o de x_groq en el último
+            fragmento de un stream); se ignora si es None
+        source: Tipo de petición ('chat' o 'summary')
+    """
+    if not ENABLED or usage is None:
+        return
+    increment(f'groq_{source}_requests')
+    for field in USAGE_TOKEN_FIELDS:
+        value = getattr(usage, field, None)
+        if value:
+            increment(f'groq_{field}', value)
+    for field in USAGE_TIME_FIELDS:
+        value = getattr(usage, field, None)
+        if value is not None:
+            observe(f'groq_{field}', value * 1000, source=source)
+
+
+def _write_event(event: Dict):
+    """Añade un evento al archivo JSONL (con _lock tomado)."""
+    global _jsonl_file
+    if _jsonl_file is None:
+        _jsonl_file = open(JSONL_PATH, 'a', encoding='utf-8')
+    _jsonl_file.write(json.dumps(event, ensure_ascii=False) + '\n')
+
+
+def snapshot() -> Dict[str, Dict]:
+    """
+    Resumen de todas las medidas tomadas hasta ahora.
+    
+    Returns:
+        Diccionario con 'histograms' (nombre -> summary()) y 'counters'
+    """
+    with _lock:
+        return {
+            'histograms': {name: hist.summary() for name, hist in sorted(_histograms.items())},
+            'counters': dict(sorted(_counters.items())),
+        }
+
+
+def reset():
+    """Descarta todas las medidas."""
+    with _lock:
+        _histograms.clear()
+        _counters.clear()
+
+
+def prometheus_text() -> str:
+    """Medidas en el formato de texto de Prometheus."""
+    lines: List[str] = []
+    # Etiqueta del proceso para distinguir los archivos de cada uno
+    worker = f'worker="{WORKER}"' if WORKER is not None else ''
+    labels = f'{{{worker}}}' if worker else ''
+    bucket_prefix = f'{worker},' if worker else ''
+    with _lock:
+        for name, hist in sorted(_histograms.items()):
+            metric = f'{PROMETHEUS_PREFIX}{name}_ms'
+            lines.append(f'# TYPE {metric} histogram')
+            cumulative = 0
+            for bucket, bucket_count in zip(hist.buckets, hist.counts):
+                cumulative += bucket_count
+                lines.append(f'{metric}_bucket{{{bucket_prefix}le="{bucket}"}} {cumulative}')
+            lines.append(f'{metric}_bucket{{{bucket_prefix}le="+Inf"}} {hist.count}')
+            lines.append(f'{metric}_sum{labels} {hist.sum:.3f}')
+            lines.append(f'{metric}_count{labels} {hist.count}')
+        for name, value in sorted(_counters.items()):
+            metric = f'{PROMETHEUS_PREFIX}{name}_total'
+            lines.append(f'# TYPE {metric} counter')
+            lines.append(f'{metric}{labels} {value:g}')
+    return '\n'.join(lines) + '\n'
+
+
+def export() -> bool:
+    """
+    Vuelca el archivo JSONL y reescribe el de Prometheus, si están configurados.
+    
+    Returns:
+        True si se exportó correctamente (o no había nada que exportar)
+    """
+    try:
+        with _lock:
+            if _jsonl_file is not None:
+                _jsonl_file.flush()
+        if ENABLED and PROMETHEUS_PATH:
+            # Se escribe aparte y se renombra para no dejar nunca el archivo a medias
+            temp_path = f'{PROMETHEUS_PATH}.tmp'
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                f.write(prometheus_text())
+            os.replace(temp_path, PROMETHEUS_PATH)
+        return True
+    
+    except OSError as e:
+        print(f"Error al exportar métricas: {e}")
+        return False
+
+
+atexit.register(export)
@@ -0,0 +1,179 @@
+"""
+Migración de una base de datos de un solo archivo al almacenamiento repartido.
+Copia las cuentas, perfiles y ajustes al directorio y el historial de cada
+usuario (conversaciones, mensajes, resúmenes y vectores) a su fragmento,
+sumando a los IDs el comienzo del rango del fragmento (ver SHARD_ID_BITS).
+Los triggers de cada fragmento reconstruyen el índice FTS y las
+estadísticas; el archivo de origen no se modifica.
+
+Debe ejecutarse con la aplicación detenida.
+
+Uso: python migrate_shards.py [--source chatbot.db] [--target chatbot_shards] [--shards 4]
+"""
+import argparse
+import os
+import sys
+from typing import Tuple
+
+from database import Database
+from sharded_database import DEFAULT_SHARDS_PATH, DIRECTORY_FILE, SHARD_ID_BITS, ShardedDatabase
+
+
+# Mensajes copiados por transacción
+MIGRATE_BATCH_SIZE = 10000
+
+
+def copy_directory(db: ShardedDatabase, source: str):
+    """Copia usuarios, perfiles y ajustes conservando sus IDs (y la clave de las sesiones)."""
+    conn = db.get_connection()
+    conn.execute('ATTACH DATABASE ? AS src', (source,))
+    try:
+        with db.transaction() as cursor:
+            cursor.execute(
+                '''INSERT INTO users (id, username, password_hash, created_at)
+                   SELECT id, username, password_hash, created_at FROM src.users'''
+            )
+            cursor.execute(
+                '''INSERT INTO user_profiles (user_id, avatar_id, theme_preference)
+                   SELECT user_id, avatar_id, theme_preference FROM src.user_profiles'''
+            )
+            # shard_count ya está en el destino
+            cursor.execute('INSERT OR IGNORE INTO app_settings (key, value) SELECT key, value FROM src.app_settings')
+    finally:
+        conn.execute('DETACH DATABASE src')
+
+
+def copy_shard(shard: Database, source: str, number: int, shard_count: int) -> int:
+    """
+    Copia el historial de los usuarios de un fragmento.
+    
+    Args:
+        shard: Fragmento de destino (vacío)
+        source: Base de datos de un solo archivo
+        number: Número del fragmento
+        shard_count: Número total de fragmentos
+    
+    Returns:
+        Número de mensajes copiados
+    """
+    params = {'offset': number << SHARD_ID_BITS, 'count': shard_count, 'shard': number}
+    conn = shard.get_connection()
+    conn.execute('ATTACH DATABASE ? AS src', (source,))
+    try:
+        with shard.transaction() as cursor:
+            cursor.execute(
+                '''INSERT INTO conversations (id, user_id, title, created_at, updated_at)
+                   SELECT id + :offset, user_id, title, created_at, updated_at
+                   FROM src.conversations
+                   WHERE user_id % :count = :shard''',
+                params
+            )
+        
+        # Los mensajes, por lotes: cada inserción pasa por los triggers
+        copied, last_id = 0, 0
+        while True:
+            with shard.transaction() as cursor:
+                cursor.execute(
+                    '''INSERT INTO messages (id, user_id, role, content, timestamp, conversation_id)
+                       SELECT id + :offset, user_id, role, content, timestamp, conversation_id + :offset
+                       FROM src.messages
+                       WHERE user_id % :count = :shard AND id > :after
+                       ORDER BY id
+                       LIMIT :limit''',
+                    dict(params, after=last_id, limit=MIGRATE_BATCH_SIZE)
+                )
+                count = cursor.rowcount
+                if count <= 0:
+                    break
+                cursor.execute('SELECT MAX(id) - :offset FROM messages', params)
+                last_id = cursor.fetchone()[0]
+            copied += count
+            print(f"  fragmento {number}: {copied} mensajes")
+        
+        with shard.transaction() as cursor:
+            cursor.execute(
+                '''INSERT INTO conversation_summaries (conversation_id, summary, message_count, updated_at)
+                   SELECT s.conversation_id + :offset, s.summary, s.message_count, s.updated_at
+                   FROM src.conversation_summaries s
+                   JOIN src.conversations c ON c.id = s.conversation_id
+                   WHERE c.user_id % :count = :shard''',
+                params
+            )
+            cursor.execute(
+                '''INSERT INTO message_embeddings (message_id, user_id, embedding)
+                   SELECT message_id + :offset, user_id, embedding
+                   FROM src.message_embeddings
+                   WHERE user_id % :count = :shard''',
+                params
+            )
+            # total_messages ya lo han contado los triggers
+            cursor.execute(
+                '''INSERT INTO user_stats (user_id, total_chats, last_login)
+                   SELECT user_id, total_chats, last_login
+                   FROM src.user_stats
+                   WHERE user_id % :count = :shard
+                   ON CONFLICT (user_id) DO UPDATE SET
+                       total_chats = excluded.total_chats,
+                       last_login = excluded.last_login''',
+                params
+            )
+    finally:
+        conn.execute('DETACH DATABASE src')
+    return copied
+
+
+def migrate(source: str, target: str, shard_count: int) -> Tuple[bool, str]:
+    """
+    Convierte una base de datos de un solo archivo en una carpeta con fragmentos.
+    
+    Args:
+        source: Base de datos de origen
+        target: Carpeta de destino (no debe contener ya un directorio)
+        shard_count: Número de fragmentos
+    
+    Returns:
+        Tupla (éxito, mensaje)
+    """
+    if not os.path.exists(source):
+        return False, f"No existe {source}"
+    if os.path.exists(os.path.join(target, DIRECTORY_FILE)):
+        return False, f"{target} ya contiene una base de datos repartida"
+    
+    # Aplica las migraciones pendientes y vuelca el WAL del origen
+    db = Database(source)
+    conn = db.get_connection()
+    conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+    total = conn.execute('SELECT COUNT(*) FROM messages').fetchone()[0]
+    db.close()
+    
+    sharded = ShardedDatabase(target, shard_count)
+    try:
+        copy_directory(sharded, source)
+        copied = sum(
+            copy_shard(shard, source, number, shard_count)
+            for number, shard in enumerate(sharded.shards)
+        )
+    finally:
+        sharded.close()
+    
+    if copied != total:
+        return False, f"Se copiaron {copied} de {total} mensajes"
+    return True, f"{copied} mensajes repartidos en {shard_count} fragmentos"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--source", default="chatbot.db", help="Base de datos de un solo archivo")
+    parser.add_argument("--target", default=DEFAULT_SHARDS_PATH, help="Carpeta del almacenamiento repartido")
+    parser.add_argument("--shards", type=int, default=4, help="Número de fragmentos")
+    args = parser.parse_args()
+    
+    ok, message = migrate(args.source, args.target, args.shards)
+    print(f"{'✓' if ok else '✗'} {message}")
+    if not ok:
+        sys.exit(1)
+    print(f"Para usarla: CHATBOT_SHARDS={args.shards} CHATBOT_SHARDS_PATH={args.target} python main.py")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""
+Borrados grandes en segundo plano.
+Elimina una cuenta o vacía un historial por lotes fuera de los manejadores
+de eventos de la UI, informa del progreso y después devuelve al sistema el
+espacio liberado con el vaciado incremental.
+"""
+import threading
+from typing import Any, Callable, Optional
+
+from database import Database
+
+
+class PurgeJob:
+    """Hilo de fondo que ejecuta un borrado por lotes y el vaciado posterior."""
+    
+    def __init__(
+        self,
+        db: Database,
+        purge: Callable[..., Any],
+        *args,
+        on_progress: Optional[Callable[[int, int], None]] = None,
+        on_done: Optional[Callable[[Any], None]] = None,
+        vacuum: bool = True
+    ):
+        """
+        Prepara el borrado (no empieza hasta llamar a start()).
+        
+        Args:
+            db: Base de datos
+            purge: Método de borrado que acepta on_progress (por ejemplo,
+                db.delete_user o db.clear_conversation_messages)
+            *args: Argumentos del método de borrado
+            on_progress: Función llamada con (borrados, total) tras cada lote
+            on_done: Función llamada con el resultado del método de borrado
+            vacuum: Si se liberan después las páginas libres del archivo
+        """
+        self.db = db
+        self.purge = purge
+        self.args = args
+        self.on_progress = on_progress
+        self.on_done = on_done
+        self.vacuum = vacuum
+        self.deleted = 0
+        self.total = 0
+        self.freed_pages = 0
+        self.result: Any = None
+        self._done = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="purge", daemon=True)
+    
+    @property
+    def done(self) -> bool:
+        """Indica si el borrado (y el vaciado) ha terminado."""
+        return self._done.is_set()
+    
+    @property
+    def progress(self) -> float:
+        """Fracción de mensajes borrados, entre 0 y 1."""
+        if not self.total:
+            return 1.0 if self.done else 0.0
+        return self.deleted / self.total
+    
+    def start(self) -> "PurgeJob":
+        """Arranca el borrado en segundo plano y devuelve el propio trabajo."""
+        self._thread.start()
+        return self
+    
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """
+        Espera a que termine el borrado.
+        
+        Args:
+            timeout: Segundos máximos de espera (sin límite si es None)
+        
+        Returns:
+            True si ha terminado
+        """
+        return self._done.wait(timeout)
+    
+    def _report(self, deleted: int, total: int):
+        """Guarda el progreso y avisa a on_progress."""
+        self.deleted, self.total = deleted, total
+        if self.on_progress:
+            self.on_progress(deleted, total)
+    
+    def _run(self):
+        """Cuerpo del hilo de fondo."""
+        try:
+            self.result = self.purge(*self.args, on_progress=self._report)
+            if self.vacuum:
+                self.freed_pages = self.db.incremental_vacuum()
+        except Exception as e:
+            print(f"Error en el borrado en segundo plano: {e}")
+        finally:
+            # El hilo termina aquí: su conexión no volverá a usarse
+            self.db.release_connection()
+            self._done.set()
+        
+        if self.on_done:
+            self.on_done(self.result)
@@ -0,0 +1,638 @@
+"""
+Planificador de peticiones a Groq.
+Aplica límites de peticiones y tokens por minuto, reintentos con espera
+exponencial y un cortocircuito que deja de llamar a la API cuando falla de forma continuada.
+"""
+import asyncio
+import os
+import random
+import threading
+import time
+from typing import AsyncIterable, AsyncIterator, Awaitable, Callable, Iterable, Iterator, Optional, Tuple, TypeVar
+
+import groq
+
+import metrics
+
+
+# Límites por defecto de la cuenta gratuita de Groq para llama-3.1-8b-instant
+DEFAULT_REQUESTS_PER_MINUTE = 30
+DEFAULT_TOKENS_PER_MINUTE = 6000
+
+# Procesos de la aplicación que comparten la cuenta de Groq (lo fija
+# deploy.py); cada uno se queda con su parte de los límites
+PROCESSES_ENV = 'CHATBOT_PROCESSES'
+
+T = TypeVar("T")
+
+
+class ChatError(Exception):
+    """
+    Error de una petición a Groq, con su tipo para que la UI decida qué hacer.
+    
+    Tipos: 'rate_limit', 'timeout', 'connection', 'server', 'circuit_open',
+    'auth', 'bad_request', 'cancelled' y 'unknown'.
+    """
+    
+    # Tipos de error que merece la pena reintentar
+    RETRYABLE_KINDS = ('rate_limit', 'timeout', 'connection', 'server')
+    
+    def __init__(self, kind: str, message: str, retry_after: Optional[float] = None):
+        """
+        Inicializa el error.
+        
+        Args:
+            kind: Tipo de error
+            message: Descripción legible del error
+            retry_after: Segundos que el servidor pide esperar antes de reintentar
+        """
+        super().__init__(message)
+        self.kind = kind
+        self.message = message
+        self.retry_after = retry_after
+    
+    @property
+    def retryable(self) -> bool:
+        """Indica si la petición puede reintentarse."""
+        return self.kind in self.RETRYABLE_KINDS
+
+
+def _retry_after(response) -> Optional[float]:
+    """Lee la cabecera Retry-After (en segundos) de una respuesta HTTP."""
+    if response is None:
+        return None
+    value = response.headers.get("retry-after")
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+def classify_error(error: Exception) -> ChatError:
+    """
+    Convierte una excepción del SDK de Groq en un ChatError tipado.
+    
+    Args:
+        error: Excepción lanzada por el cliente de Groq
+    
+    Returns:
+        ChatError con el tipo correspondiente
+    """
+    if isinstance(error, ChatError):
+        return error
+    if isinstance(error, groq.RateLimitError):
+        return ChatError(
+            'rate_limit',
+            "Se ha alcanzado el límite de peticiones de Groq",
+            _retry_after(error.response)
+        )
+    if isinstance(error, groq.APITimeoutError):
+        return ChatError('timeout', "Groq no respondió a tiempo")
+    if isinstance(error, groq.APIConnectionError):
+        return ChatError('connection', "No se pudo conectar con Groq")
+    if isinstance(error, groq.AuthenticationError):
+        return ChatError('auth', "API key de Groq no válida")
+    if isinstance(error, groq.APIStatusError):
+        if error.status_code >= 500:
+            return ChatError(
+                'server',
+                f"Error del servidor de Groq ({error.status_code})",
+                _retry_after(error.response)
+            )
+        return ChatError('bad_request', f"Petición rechazada por Groq: {error.message}")
+    return ChatError('unknown', f"Error al comunicarse con Groq: {str(error)}")
+
+
+class TokenBucket:
+    """Limitador de tipo cubo de fichas que se rellena de forma continua."""
+    
+    def __init__(
+        self,
+        per_minute: float,
+        capacity: Optional[float] = None,
+        clock: Callable[[], float] = time.monotonic,
+        sleep: Callable[[float], None] = time.sleep
+    ):
+        """
+        Inicializa el cubo lleno.
+        
+        Args:
+            per_minute: Fichas que se reponen por minuto
+            capacity: Máximo de fichas acumulables (por defecto, un minuto)
+            clock: Reloj monotónico en segundos
+            sleep: Función de espera
+        """
+        self.rate = per_minute / 60.0
+        self.capacity = capacity if capacity is not None else per_minute
+        self._tokens = self.capacity
+        self._clock = clock
+        self._sleep = sleep
+        self._updated = clock()
+        self._lock = threading.Lock()
+    
+    def _refill(self):
+        """Repone las fichas generadas desde la última consulta."""
+        now = self._clock()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+    
+    def _try_acquire(self, amount: float) -> float:
+        """Consume fichas si hay suficientes; si no, devuelve los segundos a esperar."""
+        amount = min(amount, self.capacity)
+        with self._lock:
+            self._refill()
+            if self._tokens >= amount:
+                self._tokens -= amount
+                return 0.0
+            return (amount - self._tokens) / self.rate
+    
+    def acquire(self, amount: float = 1, cancel_event: Optional[threading.Event] = None) -> bool:
+        """
+        Consume fichas, esperando lo necesario hasta que haya suficientes.
+        
+        Args:
+            amount: Fichas a consumir (se limita a la capacidad del cubo)
+            cancel_event: Evento que interrumpe la espera al activarse
+        
+        Returns:
+            True si se consumieron las fichas, False si se canceló la espera
+        """
+        while True:
+            wait = self._try_acquire(amount)
+            if not wait:
+                return True
+            if cancel_event is None:
+                self._sleep(wait)
+            elif cancel_event.wait(wait):
+                return False
+    
+    async def acquire_async(self, amount: float = 1):
+        """
+        Versión asíncrona de acquire: espera sin bloquear el bucle de eventos.
+        
+        Args:
+            amount: Fichas a consumir (se limita a la capacidad del cubo)
+        """
+        while True:
+            wait = self._try_acquire(amount)
+            if not wait:
+                return
+            await asyncio.sleep(wait)
+    
+    def refund(self, amount: float):
+        """
+        Devuelve fichas consumidas de más (sin superar la capacidad).
+        
+        Args:
+            amount: Fichas a devolver
+        """
+        with self._lock:
+            self._refill()
+            self._tokens = min(self.capacity, self._tokens + amount)
+    
+    def drain(self, seconds: float):
+        """
+        Vacía el cubo durante un tiempo (por ejemplo, tras un 429 del servidor).
+        
+        Args:
+            seconds: Segundos hasta que vuelva a haber fichas
+        """
+        with self._lock:
+            self._refill()
+            self._tokens = min(self._tokens, -seconds * self.rate)
+
+
+class CircuitBreaker:
+    """
+    Cortocircuito de tres estados.
+    
+    Tras failure_threshold fallos seguidos se abre y rechaza peticiones
+    durante reset_timeout segundos; después deja pasar una petición de prueba
+    y se cierra si tiene éxito.
+    """
+    
+    def __init__(
+        self,
+        failure_threshold: int = 5,
+        reset_timeout: float = 30.0,
+        clock: Callable[[], float] = time.monotonic
+    ):
+        """
+        Inicializa el cortocircuito cerrado.
+        
+        Args:
+            failure_threshold: Fallos seguidos que lo abren
+            reset_timeout: Segundos que permanece abierto
+            clock: Reloj monotónico en segundos
+        """
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = 'closed'
+        self._failures = 0
+        self._opened_at = 0.0
+        self._clock = clock
+        self._lock = threading.Lock()
+    
+    def allow(self) -> bool:
+        """Indica si se puede hacer una petición ahora."""
+        with self._lock:
+            if self.state == 'open':
+                if self._clock() - self._opened_at < self.reset_timeout:
+                    return False
+                self.state = 'half_open'
+                return True
+            if self.state == 'half_open':
+                # Solo una petición de prueba a la vez
+                return False
+            return True
+    
+    def record_success(self):
+        """Registra una petición correcta."""
+        with self._lock:
+            self.state = 'closed'
+            self._failures = 0
+    
+    def release(self):
+        """
+        Libera la petición de prueba sin resultado (por ejemplo, si se canceló).
+        
+        El cortocircuito vuelve a abierto con el tiempo de espera ya
+        cumplido, así que la siguiente petición hace de prueba.
+        """
+        with self._lock:
+            if self.state == 'half_open':
+                self.state = 'open'
+    
+    def record_failure(self):
+        """Registra una petición fallida."""
+        with self._lock:
+            self._failures += 1
+            if self.state == 'half_open' or self._failures >= self.failure_threshold:
+                self.state = 'open'
+                self._opened_at = self._clock()
+
+
+class RequestScheduler:
+    """Ejecuta peticiones a Groq respetando los límites de la cuenta y reintentando fallos."""
+    
+    def __init__(
+        self,
+        requests_per_minute: float = DEFAULT_REQUESTS_PER_MINUTE,
+        tokens_per_minute: float = DEFAULT_TOKENS_PER_MINUTE,
+        max_retries: int = 4,
+        base_delay: float = 0.5,
+        max_delay: float = 20.0,
+        breaker: Optional[CircuitBreaker] = None,
+        processes: Optional[int] = None,
+        clock: Callable[[], float] = time.monotonic,
+        sleep: Callable[[float], None] = time.sleep
+    ):
+        """
+        Inicializa el planificador.
+        
+        Los límites son los de la cuenta: con varios procesos (deploy.py)
+        cada planificador aplica solo su parte, porque los contadores no
+        se comparten entre procesos.
+        
+        Args:
+            requests_per_minute: Peticiones por minuto permitidas (RPM)
+            tokens_per_minute: Tokens por minuto permitidos (TPM)
+            max_retries: Reintentos tras el primer intento
+            base_delay: Espera base del backoff exponencial (segundos)
+            max_delay: Espera máxima entre reintentos (segundos)
+            breaker: Cortocircuito a usar (por defecto uno nuevo)
+            processes: Procesos que comparten los límites (por defecto
+                CHATBOT_PROCESSES, o 1 si no está definida)
+            clock: Reloj monotónico en segundos
+            sleep: Función de espera
+        """
+        if processes is None:
+            processes = int(os.getenv(PROCESSES_ENV, "1"))
+        processes = max(1, processes)
+        self.requests = TokenBucket(requests_per_minute / processes, clock=clock, sleep=sleep)
+        self.tokens = TokenBucket(tokens_per_minute / processes, clock=clock, sleep=sleep)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.breaker = breaker or CircuitBreaker(clock=clock)
+        self._sleep = sleep
+    
+    def backoff(self, attempt: int) -> float:
+        """
+        Espera antes del reintento indicado (backoff exponencial con jitter completo).
+        
+        Args:
+            attempt: Número de reintento, empezando en 0
+        
+        Returns:
+            Segundos a esperar
+        """
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+    
+    def _wait(self, seconds: float, cancel_event: Optional[threading.Event]) -> bool:
+        """Espera antes de un reintento; devuelve False si se cancela antes."""
+        if cancel_event is None:
+            self._sleep(seconds)
+            return True
+        return not cancel_event.wait(seconds)
+    
+    def _check_breaker(self):
+        """Lanza ChatError si el cortocircuito está abierto."""
+        if not self.breaker.allow():
+            raise ChatError(
+                'circuit_open',
+                "Groq no está disponible en este momento, inténtalo más tarde"
+            )
+    
+    def _on_failure(self, exception: Exception, attempt: int) -> float:
+        """
+        Registra un intento fallido y decide si se reintenta.
+        
+        Returns:
+            Segundos a esperar antes del siguiente intento
+            
+        Raises:
+            ChatError: Si el error no es recuperable, se agotaron los
+                reintentos o el servidor pide esperar más de max_delay
+        """
+        error = classify_error(exception)
+        if not error.retryable:
+            # La API responde, aunque rechace la petición: no cuenta como caída
+            self.breaker.record_success()
+            raise error from exception
+        
+        self.breaker.record_failure()
+        if attempt == self.max_retries:
+            raise error from exception
+        
+        if error.kind == 'rate_limit' and error.retry_after:
+            # Ninguna petición de este proceso debe salir antes de Retry-After,
+            # pero tampoco quedarse bloqueada más de max_delay
+            self.requests.drain(min(self.max_delay, error.retry_after))
+            if error.retry_after > self.max_delay:
+                raise error from exception
+            return 0.0
+        return min(self.max_delay, error.retry_after or self.backoff(attempt))
+    
+    def _attempt(
+        self,
+        request: Callable[[], T],
+        estimated_tokens: int,
+        cancel_event: Optional[threading.Event],
+        attempt: int
+    ) -> Tuple[T, int]:
+        """
+        Reintenta la petición hasta que devuelve algo, sin registrar el éxito.
+        
+        Returns:
+            Tupla (resultado, número del intento que lo obtuvo)
+        """
+        while True:
+            if cancel_event is not None and cancel_event.is_set():
+                raise ChatError('cancelled', "Petición cancelada")
+            self._check_breaker()
+            try:
+                with metrics.span('rate_limit_wait'):
+                    acquired = (
+                        self.requests.acquire(1, cancel_event)
+                        and self.tokens.acquire(estimated_tokens, cancel_event)
+                    )
+                result = request() if acquired else None
+            except Exception as e:
+                delay = self._on_failure(e, attempt)
+                metrics.increment('groq_retries')
+                if delay and not self._wait(delay, cancel_event):
+                    raise ChatError('cancelled', "Petición cancelada") from e
+                attempt += 1
+                continue
+            except BaseException:
+                # Interrumpida sin resultado: que no deje el cortocircuito en half_open
+                self.breaker.release()
+                raise
+            
+            if not acquired:
+                # Cancelada antes de salir: tampoco cuenta como prueba
+                self.breaker.release()
+                raise ChatError('cancelled', "Petición cancelada")
+            return result, attempt
+    
+    def refund_tokens(self, reserved: int, used: Optional[int]):
+        """
+        Devuelve al límite de TPM los tokens reservados que la petición no usó.
+        
+        Args:
+            reserved: Tokens reservados al enviarla (prompt más max_tokens)
+            used: Tokens que informa Groq; sin ellos no se devuelve nada
+        """
+        if used is not None and used < reserved:
+            self.tokens.refund(reserved - used)
+    
+    def run(
+        self,
+        request: Callable[[], T],
+        estimated_tokens: int = 0,
+        cancel_event: Optional[threading.Event] = None,
+        used_tokens: Optional[Callable[[T], Optional[int]]] = None
+    ) -> T:
+        """
+        Ejecuta una petición con límites, reintentos y cortocircuito.
+        
+        Args:
+            request: Función que hace la petición
+            estimated_tokens: Tokens que se reservan para la petición (los
+                del prompt más los que puede generar la respuesta)
+            cancel_event: Evento que interrumpe las esperas de los límites y
+                de los reintentos (por ejemplo, el botón de cancelar)
+            used_tokens: Función que lee del resultado los tokens usados, para
+                devolver al límite los reservados de más
+        
+        Returns:
+            Lo que devuelva request
+        
+        Raises:
+            ChatError: Si la petición falla de forma definitiva o se cancela
+                (tipo 'cancelled')
+        """
+        result, _ = self._attempt(request, estimated_tokens, cancel_event, 0)
+        self.breaker.record_success()
+        if used_tokens is not None:
+            self.refund_tokens(estimated_tokens, used_tokens(result))
+        return result
+    
+    def stream(
+        self,
+        request: Callable[[], Iterable[T]],
+        estimated_tokens: int = 0,
+        cancel_event: Optional[threading.Event] = None,
+        is_output: Callable[[T], bool] = lambda chunk: True,
+        used_tokens: Optional[Callable[[T], Optional[int]]] = None
+    ) -> Iterator[T]:
+        """
+        Ejecuta una petición con stream y recorre sus fragmentos.
+        
+        A diferencia de run, la petición solo cuenta como un éxito del
+        cortocircuito cuando el stream termina. Un error antes del primer
+        fragmento con contenido se reintenta como en run; uno posterior
+        cuenta como fallo y se lanza, porque el consumidor ya ha recibido
+        parte de la respuesta. Cerrar el generador cierra el stream.
+        
+        Args:
+            request: Función que abre el stream
+            estimated_tokens: Tokens que se reservan (ver run)
+            cancel_event: Evento que interrumpe las esperas (ver run)
+            is_output: Indica si un fragmento lleva contenido para el consumidor
+            used_tokens: Función que lee de un fragmento los tokens usados
+                (None si no los trae), para devolver los reservados de más
+        
+        Yields:
+            Fragmentos del stream
+        
+        Raises:
+            ChatError: Si la petición falla de forma definitiva o se cancela
+        """
+        attempt = 0
+        while True:
+            stream, attempt = self._attempt(request, estimated_tokens, cancel_event, attempt)
+            output = False
+            used = None
+            try:
+                for chunk in stream:
+                    output = output or is_output(chunk)
+                    if used_tokens is not None:
+                        used = used_tokens(chunk) or used
+                    yield chunk
+            except Exception as e:
+                if output:
+                    error = classify_error(e)
+                    if error.retryable:
+                        self.breaker.record_failure()
+                    else:
+                        self.breaker.record_success()
+                    raise error from e
+                delay = self._on_failure(e, attempt)
+                metrics.increment('groq_retries')
+                if delay and not self._wait(delay, cancel_event):
+                    raise ChatError('cancelled', "Petición cancelada") from e
+                attempt += 1
+                continue
+            except BaseException:
+                # El consumidor ha cerrado el generador (cancelación)
+                self.breaker.release()
+                raise
+            finally:
+                stream.close()
+            
+            self.breaker.record_success()
+            self.refund_tokens(estimated_tokens, used)
+            return
+    
+    async def _attempt_async(
+        self,
+        request: Callable[[], Awaitable[T]],
+        estimated_tokens: int,
+        attempt: int
+    ) -> Tuple[T, int]:
+        """Versión asíncrona de _attempt."""
+        while True:
+            self._check_breaker()
+            try:
+                with metrics.span('rate_limit_wait'):
+                    await self.requests.acquire_async(1)
+                    await self.tokens.acquire_async(estimated_tokens)
+                result = await request()
+            except Exception as e:
+                delay = self._on_failure(e, attempt)
+                metrics.increment('groq_retries')
+                if delay:
+                    await asyncio.sleep(delay)
+                attempt += 1
+                continue
+            except BaseException:
+                # asyncio.CancelledError no es Exception: sin esto, una prueba
+                # cancelada dejaría el cortocircuito en half_open para siempre
+                self.breaker.release()
+                raise
+            return result, attempt
+    
+    async def run_async(
+        self,
+        request: Callable[[], Awaitable[T]],
+        estimated_tokens: int = 0,
+        used_tokens: Optional[Callable[[T], Optional[int]]] = None
+    ) -> T:
+        """
+        Versión asíncrona de run: las esperas no bloquean el bucle de eventos.
+        
+        Args:
+            request: Función que devuelve la corrutina de la petición
+            estimated_tokens: Tokens que se reservan para la petición
+            used_tokens: Función que lee del resultado los tokens usados
+            
+        Returns:
+            Lo que devuelva la corrutina
+            
+        Raises:
+            ChatError: Si la petición falla de forma definitiva
+        """
+        result, _ = await self._attempt_async(request, estimated_tokens, 0)
+        self.breaker.record_success()
+        if used_tokens is not None:
+            self.refund_tokens(estimated_tokens, used_tokens(result))
+        return result
+    
+    async def stream_async(
+        self,
+        request: Callable[[], Awaitable[AsyncIterable[T]]],
+        estimated_tokens: int = 0,
+        is_output: Callable[[T], bool] = lambda chunk: True,
+        used_tokens: Optional[Callable[[T], Optional[int]]] = None
+    ) -> AsyncIterator[T]:
+        """
+        Versión asíncrona de stream.
+        
+        Args:
+            request: Función que devuelve la corrutina que abre el stream
+            estimated_tokens: Tokens que se reservan (ver run)
+            is_output: Indica si un fragmento lleva contenido para el consumidor
+            used_tokens: Función que lee de un fragmento los tokens usados
+        
+        Yields:
+            Fragmentos del stream
+        
+        Raises:
+            ChatError: Si la petición falla de forma definitiva
+        """
+        attempt = 0
+        while True:
+            stream, attempt = await self._attempt_async(request, estimated_tokens, attempt)
+            output = False
+            used = None
+            try:
+                async for chunk in stream:
+                    output = output or is_output(chunk)
+                    if used_tokens is not None:
+                        used = used_tokens(chunk) or used
+                    yield chunk
+            except Exception as e:
+                if output:
+                    error = classify_error(e)
+                    if error.retryable:
+                        self.breaker.record_failure()
+                    else:
+                        self.breaker.record_success()
+                    raise error from e
+                delay = self._on_failure(e, attempt)
+                metrics.increment('groq_retries')
+                if delay:
+                    await asyncio.sleep(delay)
+                attempt += 1
+                continue
+            except BaseException:
+                self.breaker.release()
+                raise
+            finally:
+                await stream.close()
+            
+            self.breaker.record_success()
+            self.refund_tokens(estimated_tokens, used)
+            return
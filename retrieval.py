@@ -0,0 +1,438 @@
+"""
+Recuperación semántica de mensajes anteriores.
+Convierte los mensajes en vectores con un embedder local, los guarda en la
+base de datos como BLOB float32 y busca los más parecidos a una consulta
+con similitud coseno sobre un índice en memoria por usuario.
+"""
+import bisect
+import hashlib
+import re
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from database import Database
+
+
+# Dimensión de los vectores del embedder por defecto
+EMBEDDING_DIM = 256
+
+# Mensajes que se vectorizan y guardan en cada transacción al indexar
+INDEX_BATCH_SIZE = 256
+
+# Mensajes recuperados por defecto en cada turno
+DEFAULT_TOP_K = 4
+
+# Similitud mínima para considerar relevante un mensaje recuperado
+DEFAULT_MIN_SCORE = 0.15
+
+# Palabras y pares de palabras cuyo hash se recuerda como máximo
+FEATURE_CACHE_SIZE = 200000
+
+# Filas que se reservan de más al ampliar el índice de un usuario
+INDEX_GROWTH = 1024
+
+# Memoria máxima de los índices en memoria de todos los usuarios; se
+# descartan primero los de quienes llevan más tiempo sin buscar
+INDEX_CACHE_BYTES = 256 * 1024 * 1024
+
+_WORD_RE = re.compile(r"\w+")
+
+# Marcas diacríticas que quedan separadas de su letra tras normalizar a NFKD
+_COMBINING_RE = re.compile(r"[\u0300-\u036f]")
+
+
+def _tokenize(text: str) -> List[str]:
+    """Palabras del texto en minúsculas y sin tildes."""
+    text = text.lower()
+    if not text.isascii():
+        text = _COMBINING_RE.sub("", unicodedata.normalize("NFKD", text))
+    return _WORD_RE.findall(text)
+
+
+def to_blob(vector: np.ndarray) -> bytes:
+    """
+    Serializa un vector para guardarlo en la base de datos.
+    
+    Args:
+        vector: Vector de una dimensión
+    
+    Returns:
+        Bytes del vector en float32
+    """
+    return np.asarray(vector, dtype=np.float32).tobytes()
+
+
+def from_blob(blob: bytes) -> np.ndarray:
+    """
+    Reconstruye un vector guardado con to_blob.
+    
+    Args:
+        blob: Bytes leídos de la base de datos
+    
+    Returns:
+        Vector float32 (de solo lectura, comparte memoria con blob)
+    """
+    return np.frombuffer(blob, dtype=np.float32)
+
+
+class HashingEmbedder:
+    """
+    Embedder local y determinista basado en feature hashing.
+    
+    Cada palabra y cada par de palabras consecutivas suma +1 o -1 en una
+    posición del vector elegida por su hash; el resultado se normaliza.
+    No necesita modelo ni red, y textos con vocabulario común quedan
+    cerca. Cualquier objeto con atributo dim y método embed() con la misma
+    firma puede sustituirlo (por ejemplo, un modelo de sentence-transformers).
+    """
+    
+    def __init__(self, dim: int = EMBEDDING_DIM, bigrams: bool = True):
+        """
+        Inicializa el embedder.
+        
+        Args:
+            dim: Dimensión de los vectores
+            bigrams: Si se incluyen pares de palabras consecutivas
+        """
+        self.dim = dim
+        self.bigrams = bigrams
+        # Posición y signo ya calculados de cada palabra (el vocabulario se repite mucho)
+        self._buckets: Dict[str, Tuple[int, float]] = {}
+    
+    def _features(self, text: str) -> List[str]:
+        """Palabras (y pares de palabras) del texto."""
+        words = _tokenize(text)
+        if self.bigrams:
+            words += [f"{a} {b}" for a, b in zip(words, words[1:])]
+        return words
+    
+    def _bucket(self, feature: str) -> Tuple[int, float]:
+        """Posición y signo de una característica en el vector."""
+        digest = hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest()
+        number = int.from_bytes(digest, "little")
+        # El bit más alto decide el signo para que las colisiones se compensen
+        value = ((number & 0x7FFFFFFFFFFFFFFF) % self.dim, 1.0 if number >> 63 else -1.0)
+        if len(self._buckets) < FEATURE_CACHE_SIZE:
+            self._buckets[feature] = value
+        return value
+    
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        """
+        Convierte textos en vectores.
+        
+        Args:
+            texts: Textos a vectorizar
+        
+        Returns:
+            Matriz float32 de len(texts) x dim con filas de norma 1 (o cero
+            si el texto no tiene palabras)
+        """
+        buckets = self._buckets
+        rows, columns, signs = [], [], []
+        for row, text in enumerate(texts):
+            for feature in self._features(text):
+                column, sign = buckets.get(feature) or self._bucket(feature)
+                rows.append(row)
+                columns.append(column)
+                signs.append(sign)
+        
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        np.add.at(vectors, (rows, columns), np.asarray(signs, dtype=np.float32))
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        np.divide(vectors, norms, out=vectors, where=norms > 0)
+        return vectors
+
+
+class VectorIndex:
+    """Matriz de vectores normalizados en memoria con búsqueda top-k por coseno."""
+    
+    def __init__(self, dim: int):
+        """
+        Inicializa un índice vacío.
+        
+        Args:
+            dim: Dimensión de los vectores
+        """
+        self.dim = dim
+        self._ids = np.empty(0, dtype=np.int64)
+        self._vectors = np.empty((0, dim), dtype=np.float32)
+        self._size = 0
+        # ID del último mensaje añadido, para cargar solo los nuevos
+        self.last_id = 0
+    
+    def __len__(self) -> int:
+        return self._size
+    
+    @property
+    def nbytes(self) -> int:
+        """Memoria reservada por el índice (incluida la holgura)."""
+        return self._ids.nbytes + self._vectors.nbytes
+    
+    def add(self, ids: Sequence[int], vectors: np.ndarray):
+        """
+        Agrega vectores al final del índice.
+        
+        Args:
+            ids: IDs de los mensajes, en orden creciente y mayores que last_id
+            vectors: Matriz float32 de len(ids) x dim
+        """
+        count = len(ids)
+        if not count:
+            return
+        
+        needed = self._size + count
+        if needed > len(self._ids):
+            # Se reserva con holgura para no copiar la matriz en cada turno
+            capacity = max(needed, 2 * len(self._ids), INDEX_GROWTH)
+            grown_ids = np.empty(capacity, dtype=np.int64)
+            grown_vectors = np.empty((capacity, self.dim), dtype=np.float32)
+            grown_ids[:self._size] = self._ids[:self._size]
+            grown_vectors[:self._size] = self._vectors[:self._size]
+            self._ids, self._vectors = grown_ids, grown_vectors
+        
+        self._ids[self._size:needed] = ids
+        self._vectors[self._size:needed] = vectors
+        self._size = needed
+        self.last_id = int(ids[-1])
+    
+    def search(self, query: np.ndarray, k: int, min_score: float = -1.0) -> List[tuple]:
+        """
+        Busca los vectores más parecidos a la consulta.
+        
+        Args:
+            query: Vector de la consulta, normalizado
+            k: Número máximo de resultados
+            min_score: Similitud mínima de los resultados
+        
+        Returns:
+            Lista de tuplas (id, similitud) de mayor a menor similitud
+        """
+        if not self._size or k <= 0:
+            return []
+        
+        # Con filas de norma 1, el producto escalar es la similitud coseno
+        scores = self._vectors[:self._size] @ query
+        if k < self._size:
+            top = np.argpartition(scores, -k)[-k:]
+        else:
+            top = np.arange(self._size)
+        top = top[np.argsort(scores[top])[::-1]]
+        return [
+            (int(self._ids[i]), float(scores[i]))
+            for i in top
+            if scores[i] >= min_score
+        ]
+
+
+class MessageRetriever:
+    """Indexa los mensajes de la base de datos y recupera los relevantes para una consulta."""
+    
+    def __init__(
+        self,
+        db: Database,
+        embedder=None,
+        min_score: float = DEFAULT_MIN_SCORE,
+        max_cache_bytes: int = INDEX_CACHE_BYTES
+    ):
+        """
+        Inicializa el recuperador.
+        
+        Args:
+            db: Base de datos con los mensajes
+            embedder: Objeto con atributo dim y método embed(texts) (por
+                defecto un HashingEmbedder)
+            min_score: Similitud mínima de los mensajes recuperados
+            max_cache_bytes: Memoria máxima de los índices en memoria
+        """
+        self.db = db
+        self.embedder = embedder or HashingEmbedder()
+        self.min_score = min_score
+        self.max_cache_bytes = max_cache_bytes
+        # Índices por usuario, del usado hace más tiempo al más reciente
+        self._indexes: "OrderedDict[int, VectorIndex]" = OrderedDict()
+        # Por usuario: todos sus mensajes con id menor o igual ya tienen vector
+        # (un entero por usuario; no se descarta con su índice)
+        self._user_indexed_upto: Dict[int, int] = {}
+        # Lo mismo por fragmento (ver Database.shards), para index_pending
+        self._indexed_upto: Dict[int, int] = {}
+        # Protege los índices y las marcas; las lecturas de la BD y la
+        # vectorización se hacen sin él para no bloquear otras búsquedas
+        self._lock = threading.Lock()
+        # Un solo recorrido completo de la base de datos a la vez
+        self._backfill_lock = threading.Lock()
+    
+    def _index_batch(self, db: Database, pending: List[Dict]) -> bool:
+        """Vectoriza un lote de mensajes y guarda sus vectores."""
+        vectors = self.embedder.embed([msg["content"] for msg in pending])
+        return db.save_embeddings([
+            (msg["id"], msg["user_id"], to_blob(vector))
+            for msg, vector in zip(pending, vectors)
+        ])
+    
+    def index_user(self, user_id: int, batch_size: int = INDEX_BATCH_SIZE) -> int:
+        """
+        Vectoriza los mensajes guardados de un usuario que aún no tienen vector.
+        
+        Es lo que se hace en cada turno: solo recorre los mensajes del
+        usuario posteriores a los ya indexados, no la base de datos entera.
+        
+        Args:
+            user_id: ID del usuario
+            batch_size: Mensajes por transacción
+        
+        Returns:
+            Número de mensajes indexados
+        """
+        indexed = 0
+        while True:
+            with self._lock:
+                after_id = self._user_indexed_upto.get(user_id, 0)
+            pending = self.db.get_unindexed_messages(after_id, batch_size, user_id=user_id)
+            if not pending or not self._index_batch(self.db, pending):
+                break
+            
+            with self._lock:
+                # Otro hilo puede haber indexado ya más allá
+                self._user_indexed_upto[user_id] = max(
+                    self._user_indexed_upto.get(user_id, 0), pending[-1]["id"]
+                )
+            indexed += len(pending)
+        return indexed
+    
+    def index_pending(self, batch_size: int = INDEX_BATCH_SIZE) -> int:
+        """
+        Vectoriza todos los mensajes guardados que aún no tienen vector.
+        
+        Recorre la base de datos entera (por ejemplo, tras actualizar una
+        base de datos creada sin vectores), así que en la aplicación se
+        ejecuta en segundo plano con index_in_background.
+        
+        Args:
+            batch_size: Mensajes por transacción
+        
+        Returns:
+            Número de mensajes indexados
+        """
+        indexed = 0
+        with self._backfill_lock:
+            # Los ids solo crecen dentro de cada fragmento, no entre fragmentos
+            for number, shard in enumerate(self.db.shards):
+                while True:
+                    pending = shard.get_unindexed_messages(self._indexed_upto.get(number, 0), batch_size)
+                    if not pending or not self._index_batch(shard, pending):
+                        break
+                    self._indexed_upto[number] = pending[-1]["id"]
+                    indexed += len(pending)
+        return indexed
+    
+    def index_in_background(self) -> threading.Thread:
+        """
+        Arranca index_pending en un hilo de fondo.
+        
+        Returns:
+            Hilo arrancado
+        """
+        def backfill():
+            try:
+                indexed = self.index_pending()
+                if indexed:
+                    print(f"Búsqueda semántica: {indexed} mensajes anteriores indexados")
+            except Exception as e:
+                print(f"Error al indexar mensajes anteriores: {e}")
+            finally:
+                self.db.release_connection()
+        
+        thread = threading.Thread(target=backfill, name="retrieval-backfill", daemon=True)
+        thread.start()
+        return thread
+    
+    def _evict(self):
+        """
+        Descarta los índices usados hace más tiempo hasta caber en max_cache_bytes (con _lock).
+        
+        Las marcas de _user_indexed_upto se conservan: los vectores ya están
+        guardados y _user_index los vuelve a leer de la base de datos, así que
+        index_user no tiene que vectorizar de nuevo el historial del usuario.
+        """
+        total = sum(index.nbytes for index in self._indexes.values())
+        # El índice recién usado se conserva aunque no quepa
+        while total > self.max_cache_bytes and len(self._indexes) > 1:
+            _, index = self._indexes.popitem(last=False)
+            total -= index.nbytes
+    
+    def _user_index(self, user_id: int) -> VectorIndex:
+        """Índice en memoria del usuario, completado con los vectores nuevos de la BD."""
+        with self._lock:
+            index = self._indexes.get(user_id)
+            if index is None:
+                index = self._indexes[user_id] = VectorIndex(self.embedder.dim)
+            self._indexes.move_to_end(user_id)
+            last_id = index.last_id
+        
+        rows = self.db.get_embeddings(user_id, last_id)
+        if rows:
+            # Un solo búfer para todos los vectores evita crear un array por fila
+            vectors = from_blob(b"".join(blob for _, blob in rows)).reshape(len(rows), index.dim)
+            ids = [message_id for message_id, _ in rows]
+            with self._lock:
+                # Otra búsqueda simultánea puede haber añadido ya parte de las filas
+                start = bisect.bisect_right(ids, index.last_id)
+                index.add(ids[start:], vectors[start:])
+                self._evict()
+        return index
+    
+    def search(
+        self,
+        user_id: int,
+        query: str,
+        k: int = DEFAULT_TOP_K,
+        exclude_ids: Optional[Iterable[int]] = None
+    ) -> List[Dict]:
+        """
+        Recupera los mensajes del usuario más parecidos a una consulta.
+        
+        Args:
+            user_id: ID del usuario
+            query: Texto de la consulta (normalmente el mensaje del usuario)
+            k: Número máximo de mensajes
+            exclude_ids: IDs de mensajes que no deben devolverse
+        
+        Returns:
+            Lista de mensajes (id, conversation_id, role, content, timestamp y
+            score) de mayor a menor similitud
+        """
+        exclude = set(exclude_ids or ())
+        query_vector = self.embedder.embed([query])[0]
+        if not query_vector.any():
+            return []
+        
+        index = self._user_index(user_id)
+        with self._lock:
+            hits = index.search(query_vector, k + len(exclude), self.min_score)
+        
+        hits = [(message_id, score) for message_id, score in hits if message_id not in exclude][:k]
+        messages = self.db.get_messages_by_ids([message_id for message_id, _ in hits])
+        if len(messages) < len(hits):
+            # Hay mensajes borrados: el índice se recarga en la próxima búsqueda
+            self.forget(user_id)
+        
+        return [
+            dict(messages[message_id], score=score)
+            for message_id, score in hits
+            if message_id in messages
+        ]
+    
+    def forget(self, user_id: int):
+        """
+        Descarta el índice en memoria de un usuario (por ejemplo, tras borrar mensajes).
+        
+        Args:
+            user_id: ID del usuario
+        """
+        with self._lock:
+            self._indexes.pop(user_id, None)
+            self._user_indexed_upto.pop(user_id, None)
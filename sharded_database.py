@@ -0,0 +1,482 @@
+"""
+Almacenamiento repartido en varios archivos SQLite para instalaciones grandes.
+Un archivo de directorio guarda las cuentas (users, user_profiles y
+app_settings) y los mensajes, conversaciones, resúmenes, vectores y
+estadísticas de cada usuario van al fragmento user_id % K. Cada fragmento
+tiene su propio bloqueo de escritura y su propia cola diferida, así que
+los usuarios de fragmentos distintos no esperan unos a otros al guardar.
+
+Los IDs de mensajes y conversaciones llevan el fragmento en sus bits altos
+(ver SHARD_ID_BITS): son únicos en toda la instalación y basta el ID para
+saber en qué archivo está cada fila.
+
+Se activa con CHATBOT_SHARDS=K (y CHATBOT_SHARDS_PATH, carpeta de los
+archivos); migrate_shards.py convierte una base de datos de un solo archivo.
+"""
+import os
+import sqlite3
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+
+from database import (
+    DEFAULT_CONVERSATION_TITLE,
+    DURABILITY_COMMITTED,
+    Database,
+    ProgressCallback,
+    PURGE_PAUSE,
+    VACUUM_STEP_PAGES,
+)
+
+
+# Variables de entorno con el número de fragmentos y la carpeta donde se guardan
+SHARDS_ENV = 'CHATBOT_SHARDS'
+SHARDS_PATH_ENV = 'CHATBOT_SHARDS_PATH'
+
+# Carpeta por defecto de los archivos del almacenamiento repartido
+DEFAULT_SHARDS_PATH = 'chatbot_shards'
+
+# Archivos dentro de la carpeta
+DIRECTORY_FILE = 'directory.db'
+SHARD_FILE = 'shard-{:03d}.db'
+
+# Los IDs de mensajes y conversaciones del fragmento k empiezan en k << SHARD_ID_BITS
+# (2^40 filas por fragmento; el fragmento de un ID es id >> SHARD_ID_BITS)
+SHARD_ID_BITS = 40
+
+# Tablas cuyos IDs identifican el fragmento
+SHARDED_ID_TABLES = ('messages', 'conversations')
+
+
+def shard_path(path: str, number: int) -> str:
+    """Ruta del archivo de un fragmento dentro de la carpeta del almacenamiento."""
+    return os.path.join(path, SHARD_FILE.format(number))
+
+
+def open_database(db_path: str = "chatbot.db", **options) -> Database:
+    """
+    Abre la base de datos configurada en el entorno.
+    
+    Args:
+        db_path: Archivo de la base de datos si no se usa el almacenamiento repartido
+        **options: write_behind, writer_address y writer_authkey (ver Database)
+    
+    Returns:
+        ShardedDatabase si CHATBOT_SHARDS indica un número de fragmentos, si no Database
+    """
+    shard_count = int(os.getenv(SHARDS_ENV) or 0)
+    if shard_count > 0:
+        return ShardedDatabase(os.getenv(SHARDS_PATH_ENV) or DEFAULT_SHARDS_PATH, shard_count, **options)
+    return Database(db_path, **options)
+
+
+class ShardedDatabase(Database):
+    """
+    Database repartida entre un archivo de directorio y K fragmentos.
+    
+    Tiene los mismos métodos que Database y encamina cada uno al archivo que
+    corresponde: las cuentas y la caché de perfiles se gestionan aquí (en el
+    directorio) y el historial en el fragmento del usuario, que es a su vez
+    una Database completa.
+    """
+    
+    def __init__(
+        self,
+        path: str = DEFAULT_SHARDS_PATH,
+        shard_count: int = 4,
+        write_behind: bool = False,
+        writer_address: Optional[str] = None,
+        writer_authkey: Optional[bytes] = None
+    ):
+        """
+        Abre (o crea) el directorio y los fragmentos.
+        
+        Args:
+            path: Carpeta con el directorio y los fragmentos
+            shard_count: Número de fragmentos; no puede cambiar una vez creados
+            write_behind: Cada fragmento guarda los mensajes con su propia
+                cola de escritura diferida
+            writer_address: Dirección de un proceso escritor compartido (ver
+                Database); si se indica, los mensajes se guardan a través de él
+            writer_authkey: Clave del proceso escritor
+        
+        Raises:
+            ValueError: Si la carpeta se creó con otro número de fragmentos
+        """
+        if shard_count < 1:
+            raise ValueError("Se necesita al menos un fragmento")
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        super().__init__(os.path.join(path, DIRECTORY_FILE), False, writer_address, writer_authkey)
+        
+        with self.transaction() as cursor:
+            cursor.execute(
+                "INSERT OR IGNORE INTO app_settings (key, value) VALUES ('shard_count', ?)",
+                (str(shard_count),)
+            )
+            cursor.execute("SELECT value FROM app_settings WHERE key = 'shard_count'")
+            stored = int(cursor.fetchone()['value'])
+        if stored != shard_count:
+            super().close()
+            raise ValueError(
+                f"{path} tiene {stored} fragmentos, no {shard_count} (usa migrate_shards.py para cambiarlo)"
+            )
+        
+        # Con un proceso escritor compartido los fragmentos no necesitan cola propia
+        shard_write_behind = write_behind and not writer_address
+        self._shards = [
+            Database(shard_path(path, number), write_behind=shard_write_behind)
+            for number in range(shard_count)
+        ]
+        for number, shard in enumerate(self._shards):
+            self._reserve_ids(shard, number)
+    
+    @staticmethod
+    def _reserve_ids(shard: Database, number: int):
+        """Hace que los IDs nuevos del fragmento empiecen en su rango (nunca los reduce)."""
+        first = number << SHARD_ID_BITS
+        with shard.transaction() as cursor:
+            for table in SHARDED_ID_TABLES:
+                cursor.execute(
+                    '''INSERT INTO sqlite_sequence (name, seq)
+                       SELECT ?, ? WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = ?)''',
+                    (table, first, table)
+                )
+                cursor.execute(
+                    'UPDATE sqlite_sequence SET seq = ? WHERE name = ? AND seq < ?',
+                    (first, table, first)
+                )
+    
+    @property
+    def shards(self) -> List[Database]:
+        """Fragmentos con los mensajes, en orden de número."""
+        return self._shards
+    
+    def shard_for_user(self, user_id: int) -> Database:
+        """Fragmento con el historial de un usuario."""
+        return self._shards[user_id % len(self._shards)]
+    
+    def shard_for_id(self, row_id: int) -> Database:
+        """Fragmento de un mensaje o una conversación según su ID."""
+        # Un ID fuera de todo rango no existe en el fragmento al que se lleva
+        return self._shards[(row_id >> SHARD_ID_BITS) % len(self._shards)]
+    
+    def _group_by_shard(self, row_ids: List[int]) -> Dict[int, List[int]]:
+        """Reparte IDs de mensajes o conversaciones por número de fragmento."""
+        groups: Dict[int, List[int]] = {}
+        for row_id in row_ids:
+            groups.setdefault((row_id >> SHARD_ID_BITS) % len(self._shards), []).append(row_id)
+        return groups
+    
+    def flush(self, durability: str = DURABILITY_COMMITTED) -> bool:
+        """Espera a las escrituras diferidas del proceso escritor y de todos los fragmentos."""
+        results = [super().flush(durability)]
+        results.extend(shard.flush(durability) for shard in self._shards)
+        return all(results)
+    
+    def close(self):
+        """Vuelca las escrituras pendientes y cierra el directorio y los fragmentos."""
+        super().close()
+        for shard in self._shards:
+            shard.close()
+    
+    def release_connection(self):
+        """Cierra las conexiones del hilo actual con el directorio y los fragmentos."""
+        super().release_connection()
+        for shard in self._shards:
+            shard.release_connection()
+    
+    def enable_incremental_vacuum(self) -> bool:
+        """Activa el vaciado incremental en el directorio y en todos los fragmentos."""
+        results = [super().enable_incremental_vacuum()]
+        results.extend(shard.enable_incremental_vacuum() for shard in self._shards)
+        return all(results)
+    
+    def incremental_vacuum(self, step_pages: int = VACUUM_STEP_PAGES, pause: float = PURGE_PAUSE) -> int:
+        """Devuelve al sistema las páginas libres de todos los archivos (ver Database)."""
+        freed = super().incremental_vacuum(step_pages, pause)
+        for shard in self._shards:
+            freed += shard.incremental_vacuum(step_pages, pause)
+        return freed
+    
+    # ===============================
+    # Cuentas
+    # ===============================
+    
+    def delete_user(self, user_id: int, on_progress: Optional[ProgressCallback] = None) -> Tuple[bool, str]:
+        """
+        Elimina un usuario: primero su historial del fragmento y después la cuenta.
+        
+        Args:
+            user_id: ID del usuario a eliminar
+            on_progress: Función llamada tras cada lote de mensajes borrados
+        
+        Returns:
+            Tupla (éxito, mensaje)
+        """
+        try:
+            self.flush()
+            
+            conn = self.get_connection()
+            if not conn.execute('SELECT id FROM users WHERE id = ?', (user_id,)).fetchone():
+                return False, "El usuario no existe"
+            
+            shard = self.shard_for_user(user_id)
+            shard._purge_messages(user_id=user_id, on_progress=on_progress)
+            with shard.transaction() as cursor:
+                cursor.execute('DELETE FROM messages WHERE user_id = ?', (user_id,))
+                cursor.execute(
+                    '''DELETE FROM conversation_summaries
+                       WHERE conversation_id IN (SELECT id FROM conversations WHERE user_id = ?)''',
+                    (user_id,)
+                )
+                cursor.execute('DELETE FROM conversations WHERE user_id = ?', (user_id,))
+                cursor.execute('DELETE FROM user_daily_stats WHERE user_id = ?', (user_id,))
+                cursor.execute('DELETE FROM user_stats WHERE user_id = ?', (user_id,))
+            
+            with self.transaction() as cursor:
+                cursor.execute('DELETE FROM users WHERE id = ?', (user_id,))
+            
+            self.profiles.invalidate(user_id)
+            return True, "Usuario eliminado exitosamente"
+        
+        except Exception as e:
+            return False, f"Error al eliminar usuario: {str(e)}"
+    
+    # ===============================
+    # Mensajes
+    # ===============================
+    
+    def save_message(
+        self,
+        user_id: int,
+        role: str,
+        content: str,
+        durability: str = DURABILITY_COMMITTED,
+        conversation_id: Optional[int] = None
+    ) -> bool:
+        """Guarda un mensaje en el fragmento del usuario (ver Database.save_message)."""
+        if self.writer is not None:
+            # El proceso escritor compartido lo encamina con su propia ShardedDatabase
+            return super().save_message(user_id, role, content, durability, conversation_id)
+        
+        saved = self.shard_for_user(user_id).save_message(user_id, role, content, durability, conversation_id)
+        if saved:
+            self.profiles.add_stat(user_id, 'total_messages')
+        return saved
+    
+    def get_user_messages(
+        self,
+        user_id: int,
+        limit: Optional[int] = None,
+        conversation_id: Optional[int] = None
+    ) -> List[Dict[str, str]]:
+        """Ver Database.get_user_messages."""
+        return self.shard_for_user(user_id).get_user_messages(user_id, limit, conversation_id)
+    
+    def get_messages_page(
+        self,
+        user_id: int,
+        before_id: Optional[int] = None,
+        limit: int = 50,
+        conversation_id: Optional[int] = None
+    ) -> List[Dict[str, str]]:
+        """Ver Database.get_messages_page."""
+        return self.shard_for_user(user_id).get_messages_page(user_id, before_id, limit, conversation_id)
+    
+    def get_messages_after(
+        self,
+        user_id: int,
+        after_id: int,
+        limit: int = 50,
+        conversation_id: Optional[int] = None
+    ) -> List[Dict[str, str]]:
+        """Ver Database.get_messages_after."""
+        return self.shard_for_user(user_id).get_messages_after(user_id, after_id, limit, conversation_id)
+    
+    def search_messages(self, user_id: int, query: str, limit: int = 20) -> List[Dict[str, str]]:
+        """Ver Database.search_messages."""
+        # Pendientes del proceso escritor incluidos en los resultados
+        super().flush()
+        return self.shard_for_user(user_id).search_messages(user_id, query, limit)
+    
+    def clear_user_messages(self, user_id: int, on_progress: Optional[ProgressCallback] = None) -> bool:
+        """Ver Database.clear_user_messages."""
+        super().flush()
+        cleared = self.shard_for_user(user_id).clear_user_messages(user_id, on_progress)
+        self.profiles.invalidate(user_id)
+        return cleared
+    
+    # ===============================
+    # Conversaciones
+    # ===============================
+    
+    def create_conversation(
+        self,
+        user_id: int,
+        title: str = DEFAULT_CONVERSATION_TITLE
+    ) -> Optional[int]:
+        """Crea una conversación en el fragmento del usuario (ver Database.create_conversation)."""
+        conversation_id = self.shard_for_user(user_id).create_conversation(user_id, title)
+        if conversation_id is not None:
+            self.profiles.add_stat(user_id, 'total_chats')
+        return conversation_id
+    
+    def get_conversations(self, user_id: int, limit: int = 100) -> List[Dict[str, str]]:
+        """Ver Database.get_conversations."""
+        return self.shard_for_user(user_id).get_conversations(user_id, limit)
+    
+    def get_conversation_previews(self, conversation_ids: List[int]) -> Dict[int, str]:
+        """Ver Database.get_conversation_previews (una consulta por fragmento)."""
+        previews = {}
+        for number, ids in self._group_by_shard(conversation_ids).items():
+            previews.update(self._shards[number].get_conversation_previews(ids))
+        return previews
+    
+    def rename_conversation(self, conversation_id: int, title: str) -> bool:
+        """Ver Database.rename_conversation."""
+        return self.shard_for_id(conversation_id).rename_conversation(conversation_id, title)
+    
+    def clear_conversation_messages(
+        self,
+        conversation_id: int,
+        on_progress: Optional[ProgressCallback] = None
+    ) -> bool:
+        """Ver Database.clear_conversation_messages."""
+        super().flush()
+        shard = self.shard_for_id(conversation_id)
+        cleared = shard.clear_conversation_messages(conversation_id, on_progress)
+        self.profiles.invalidate(shard._conversation_owner(conversation_id))
+        return cleared
+    
+    def delete_conversation(
+        self,
+        conversation_id: int,
+        on_progress: Optional[ProgressCallback] = None
+    ) -> bool:
+        """Ver Database.delete_conversation."""
+        super().flush()
+        shard = self.shard_for_id(conversation_id)
+        # El dueño se busca antes de borrar la conversación
+        user_id = shard._conversation_owner(conversation_id)
+        deleted = shard.delete_conversation(conversation_id, on_progress)
+        self.profiles.invalidate(user_id)
+        return deleted
+    
+    def count_conversation_messages(self, conversation_id: int) -> int:
+        """Ver Database.count_conversation_messages."""
+        return self.shard_for_id(conversation_id).count_conversation_messages(conversation_id)
+    
+    def get_conversation_summary(self, conversation_id: int) -> Optional[Dict]:
+        """Ver Database.get_conversation_summary."""
+        return self.shard_for_id(conversation_id).get_conversation_summary(conversation_id)
+    
+    def delete_conversation_summary(self, conversation_id: int) -> bool:
+        """Ver Database.delete_conversation_summary."""
+        return self.shard_for_id(conversation_id).delete_conversation_summary(conversation_id)
+    
+    def save_conversation_summary(self, conversation_id: int, summary: str, message_count: int) -> bool:
+        """Ver Database.save_conversation_summary."""
+        return self.shard_for_id(conversation_id).save_conversation_summary(conversation_id, summary, message_count)
+    
+    # ===============================
+    # Búsqueda Semántica
+    # ===============================
+    
+    def get_unindexed_messages(
+        self,
+        after_id: int = 0,
+        limit: int = 256,
+        user_id: Optional[int] = None
+    ) -> List[Dict]:
+        """
+        Obtiene mensajes sin vector de todos los fragmentos, en orden de id.
+        
+        Los IDs nuevos de un fragmento pueden ser menores que los ya vistos
+        de otro, así que quien indexa todo debe llevar una marca por
+        fragmento (como MessageRetriever, recorriendo shards).
+        """
+        if user_id is not None:
+            return self.shard_for_user(user_id).get_unindexed_messages(after_id, limit, user_id)
+        
+        pending = []
+        for shard in self._shards:
+            pending.extend(shard.get_unindexed_messages(after_id, limit))
+            if len(pending) >= limit:
+                # Los fragmentos siguientes solo tienen IDs mayores
+                break
+        return pending[:limit]
+    
+    def save_embeddings(self, embeddings: List[Tuple[int, int, bytes]]) -> bool:
+        """Guarda los vectores en el fragmento de cada mensaje (una transacción por fragmento)."""
+        groups: Dict[int, List[Tuple[int, int, bytes]]] = {}
+        for embedding in embeddings:
+            groups.setdefault((embedding[0] >> SHARD_ID_BITS) % len(self._shards), []).append(embedding)
+        results = [self._shards[number].save_embeddings(group) for number, group in groups.items()]
+        return all(results)
+    
+    def get_embeddings(self, user_id: int, after_id: int = 0) -> List[Tuple[int, bytes]]:
+        """Ver Database.get_embeddings."""
+        return self.shard_for_user(user_id).get_embeddings(user_id, after_id)
+    
+    def get_messages_by_ids(self, message_ids: List[int]) -> Dict[int, Dict[str, str]]:
+        """Ver Database.get_messages_by_ids (una consulta por fragmento)."""
+        messages = {}
+        for number, ids in self._group_by_shard(message_ids).items():
+            messages.update(self._shards[number].get_messages_by_ids(ids))
+        return messages
+    
+    # ===============================
+    # Perfiles de Usuario
+    # ===============================
+    
+    def initialize_user_profile(self, user_id: int) -> bool:
+        """Crea el perfil (directorio) y las estadísticas (fragmento) si no existen y los carga en la caché."""
+        try:
+            with self.transaction() as cursor:
+                cursor.execute('INSERT OR IGNORE INTO user_profiles (user_id) VALUES (?)', (user_id,))
+            with self.shard_for_user(user_id).transaction() as cursor:
+                cursor.execute('INSERT OR IGNORE INTO user_stats (user_id, last_login) VALUES (?, CURRENT_TIMESTAMP)', (user_id,))
+            self.profiles.invalidate(user_id)
+            self.get_user_profile(user_id)
+            return True
+        except sqlite3.Error as e:
+            print(f"Error al inicializar perfil: {e}")
+            return False
+    
+    def _load_profile_row(self, user_id: int) -> Optional[Dict]:
+        """Lee la cuenta y el perfil del directorio y las estadísticas del fragmento."""
+        row = self.get_connection().execute(
+            '''SELECT u.created_at, p.avatar_id, p.theme_preference
+               FROM users u
+               LEFT JOIN user_profiles p ON p.user_id = u.id
+               WHERE u.id = ?''',
+            (user_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        
+        stats = self.shard_for_user(user_id).get_connection().execute(
+            'SELECT total_messages, total_chats, last_login FROM user_stats WHERE user_id = ?',
+            (user_id,)
+        ).fetchone()
+        profile = dict(row, total_messages=None, total_chats=None, last_login=None)
+        if stats is not None:
+            profile.update(dict(stats))
+        return profile
+    
+    def update_last_login(self, user_id: int) -> bool:
+        """Actualiza el último login en el fragmento del usuario y en la caché."""
+        # Mismo formato que CURRENT_TIMESTAMP (UTC), para guardar el mismo valor en caché
+        now = datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+        try:
+            with self.shard_for_user(user_id).transaction() as cursor:
+                cursor.execute('UPDATE user_stats SET last_login = ? WHERE user_id = ?', (now, user_id))
+            self.profiles.update(user_id, last_login=now)
+            return True
+        except sqlite3.Error:
+            return False
+    
+    def get_daily_stats(self, user_id: int, days: int = 30) -> List[Dict]:
+        """Ver Database.get_daily_stats."""
+        super().flush()
+        return self.shard_for_user(user_id).get_daily_stats(user_id, days)